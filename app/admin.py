@@ -1,5 +1,7 @@
-from sqladmin import ModelAdmin
+from sqladmin import Admin, ModelAdmin
 
+from app import facets, related  # noqa: F401 - счётчики и похожие посты обновляются обработчиками flush
+from app.database import async_engine, engine
 from app.models import Category, Post, User, Tag
 
 
@@ -18,4 +20,12 @@ class PostAdmin(ModelAdmin, model=Post):
 
 
 class UserAdmin(ModelAdmin, model=User):
-    form_columns = [User.email, User.name, User.password, User.is_active]
+    form_columns = [User.email, User.name, User.password, User.is_active, User.is_admin]
+
+
+def build_admin(app, base_url='/admin'):
+    """Создаёт sqladmin, монтирует его в app по base_url и регистрирует модели."""
+    admin = Admin(app, async_engine or engine, base_url=base_url)
+    for model_admin in (CategoryAdmin, PostAdmin, UserAdmin, TagAdmin):
+        admin.register_model(model_admin)
+    return admin
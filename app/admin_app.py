@@ -0,0 +1,48 @@
+"""Админка (sqladmin) без влияния на старт API.
+
+ADMIN_PANEL=lazy (по умолчанию) монтирует в основное приложение
+LazyAdmin: sqladmin импортируется и собирается при первом запросе
+к /admin. ADMIN_PANEL=off не монтирует админку вовсе - тогда её
+можно запустить отдельным процессом:
+
+    uvicorn app.admin_app:create_app --factory --port 8001
+"""
+import threading
+
+from starlette.applications import Starlette
+
+
+def create_app():
+    from app.admin import build_admin
+
+    app = Starlette()
+    build_admin(app)
+    return app
+
+
+class LazyAdmin:
+    """ASGI-приложение, которое собирает sqladmin при первом обращении.
+
+    Монтируется под именем 'admin', как это делает сам sqladmin, чтобы
+    url_for('admin:...') в его шаблонах продолжал работать.
+    """
+
+    def __init__(self):
+        self._admin = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._admin is None:
+            with self._lock:
+                if self._admin is None:
+                    # sqladmin монтирует своё приложение в переданное - забираем его оттуда
+                    host = create_app()
+                    self._admin = host.routes[0].app
+        return self._admin
+
+    @property
+    def routes(self):
+        return self.get().routes
+
+    async def __call__(self, scope, receive, send):
+        await self.get()(scope, receive, send)
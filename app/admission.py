@@ -0,0 +1,169 @@
+"""Ограничение нагрузки.
+
+AdmissionMiddleware делит запросы на классы (auth, write, read, admin)
+и держит для каждого свой лимит одновременных запросов. Запрос сверх
+лимита ждёт в очереди не дольше ADMISSION_MAX_WAIT, а если очередь
+заполнена или время вышло - сразу получает 503 с Retry-After, не
+занимая ни threadpool, ни соединения с БД.
+
+Отдельно /login/ и /register/ ограничены по частоте ведром токенов на
+IP клиента и на email, чтобы перебор паролей не съедал CPU на bcrypt.
+За прокси IP клиента берётся из X-Forwarded-For только если uvicorn
+запущен с --proxy-headers.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from fastapi import HTTPException, Request
+from starlette.responses import JSONResponse
+
+from app import settings
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+AUTH_PATHS = ('/login/', '/register/')
+ADMIN_PREFIXES = ('/admin', '/slow-queries/')
+# Мониторинг должен отвечать и под нагрузкой
+EXEMPT_PATHS = ('/metrics',)
+OVERLOADED = 'Сервис перегружен, повторите попытку позже'
+
+
+class Limiter:
+    """Семафор с ограниченной очередью и ограниченным временем ожидания (FIFO)."""
+
+    def __init__(self, name, concurrency, queue_size, max_wait):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self.rejected = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        """True, если место получено; False - запрос нужно отклонить."""
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=self.max_wait)
+        except BaseException:
+            # Клиент ушёл, пока ждал: если место уже передали, возвращаем его
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+        if waiter.done():
+            return True
+        waiter.cancel()
+        self._waiters.remove(waiter)
+        self.rejected += 1
+        return False
+
+    def release(self):
+        # Место передаётся следующему в очереди, не освобождаясь
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+
+def _limiter(name, concurrency):
+    return Limiter(name, concurrency, settings.ADMISSION_QUEUE_SIZE, settings.ADMISSION_MAX_WAIT)
+
+
+limiters = {
+    'auth': _limiter('auth', settings.ADMISSION_AUTH_CONCURRENCY),
+    'write': _limiter('write', settings.ADMISSION_WRITE_CONCURRENCY),
+    'read': _limiter('read', settings.ADMISSION_READ_CONCURRENCY),
+    'admin': _limiter('admin', settings.ADMISSION_ADMIN_CONCURRENCY),
+}
+
+
+def route_class(scope):
+    path = scope['path']
+    if path in EXEMPT_PATHS:
+        return None
+    if path in AUTH_PATHS:
+        return 'auth'
+    if path.startswith(ADMIN_PREFIXES):
+        return 'admin'
+    return 'read' if scope['method'] in SAFE_METHODS else 'write'
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        name = route_class(scope) if scope['type'] == 'http' else None
+        if name is None:
+            return await self.app(scope, receive, send)
+        limiter = limiters[name]
+        if not await limiter.acquire():
+            response = JSONResponse({'detail': OVERLOADED},
+                                    status_code=503,
+                                    headers={'Retry-After': str(settings.ADMISSION_RETRY_AFTER)})
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+
+class TokenBucket:
+    """Ведро токенов на каждый ключ: rate токенов в минуту, не больше burst.
+
+    Хранится не больше max_keys вёдер: давно не использованные
+    вытесняются (и для них лимит начинается заново).
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Снимает токен; возвращает 0 или сколько секунд ждать следующего токена."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+ip_buckets = TokenBucket(settings.AUTH_THROTTLE_IP_RATE, settings.AUTH_THROTTLE_IP_BURST)
+email_buckets = TokenBucket(settings.AUTH_THROTTLE_EMAIL_RATE, settings.AUTH_THROTTLE_EMAIL_BURST)
+
+
+def throttle_auth(request: Request, email: str):
+    """Отклоняет попытку входа/регистрации с 429, если исчерпан лимит IP или email."""
+    ip = request.client.host if request.client else 'unknown'
+    wait = max(ip_buckets.take(ip), email_buckets.take(email.lower()))
+    if wait:
+        raise HTTPException(status_code=429,
+                            detail='Слишком много попыток, повторите позже',
+                            headers={'Retry-After': str(math.ceil(wait))})
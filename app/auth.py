@@ -1,20 +1,27 @@
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from pydantic import ValidationError
-from sqlalchemy.orm import Session
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 
 from app import settings
-from app.database import get_db
+from app.database import get_db, run_db
 from app.models import User
 from app.schemas import UserSchema, TokenPayload
 
 
-def create_access_token(subject: str) -> str:
+def create_access_token(subject: str, user: User = None) -> str:
     expiration_time = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_LIFETIME)
     payload = {"exp": expiration_time, "sub": subject}
+    if settings.AUTH_TOKEN_CLAIMS and user is not None:
+        payload.update({"email": user.email, "name": user.name, "is_active": user.is_active,
+                        "is_admin": user.is_admin})
     encoded_jwt = jwt.encode(payload, settings.SECRET_KEY, settings.ALGORITHM)
     return encoded_jwt
 
@@ -32,7 +39,74 @@ reusable_oauth = OAuth2PasswordBearer(
 )
 
 
-def get_request_user(token: str = Depends(reusable_oauth), db: Session = Depends(get_db)) -> UserSchema:
+class PrincipalCache:
+    """LRU-кеш пользователей по (id, токен) с TTL.
+
+    Кеш свой у каждого процесса: изменения пользователя сбрасывают его
+    только в том процессе, где они закоммичены, в остальных запись живёт
+    не дольше ttl.
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, token: str):
+        key = (user_id, token)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, principal = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return principal
+
+    def set(self, user_id: int, token: str, principal: UserSchema, token_exp: int):
+        ttl = min(self.ttl, token_exp - time.time())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._items[(user_id, token)] = (time.monotonic() + ttl, principal)
+            self._items.move_to_end((user_id, token))
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            for key in [key for key in self._items if key[0] == user_id]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def remember_changed_user(mapper, connection, target):
+    object_session(target).info.setdefault('changed_users', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_changed_users(session):
+    for user_id in session.info.pop('changed_users', ()):
+        principal_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def forget_changed_users(session, previous_transaction):
+    session.info.pop('changed_users', None)
+
+
+async def get_request_user(token: str = Depends(reusable_oauth), db: Session = Depends(get_db)) -> UserSchema:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         token_data = TokenPayload(**payload)
@@ -46,7 +120,19 @@ def get_request_user(token: str = Depends(reusable_oauth), db: Session = Depends
             detail='Неверный токен',
             headers={"WWW-Authenticate": "Bearer"}
         )
-    user = db.get(User, token_data.sub)
+    user_id = int(token_data.sub)
+    # Без AUTH_TOKEN_CLAIMS данные из токена не используются: выданный раньше токен
+    # с данными не должен сохранять права деактивированного пользователя
+    if settings.AUTH_TOKEN_CLAIMS and token_data.email is not None:
+        return UserSchema(id=user_id,
+                          email=token_data.email,
+                          name=token_data.name,
+                          is_active=token_data.is_active,
+                          is_admin=bool(token_data.is_admin))
+    principal = principal_cache.get(user_id, token)
+    if principal is not None:
+        return principal
+    user = await run_db(db, Session.get, User, user_id)
     if user is None:
         raise HTTPException(
             status_code=404,
@@ -56,6 +142,15 @@ def get_request_user(token: str = Depends(reusable_oauth), db: Session = Depends
         'id': user.id,
         'email': user.email,
         'name': user.name,
-        'is_active': user.is_active
+        'is_active': user.is_active,
+        'is_admin': user.is_admin
     }
-    return UserSchema(**data)
+    principal = UserSchema(**data)
+    principal_cache.set(user_id, token, principal, token_data.exp)
+    return principal
+
+
+async def get_admin_user(user: UserSchema = Depends(get_request_user)) -> UserSchema:
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail='Недостаточно прав')
+    return user
@@ -0,0 +1,190 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+from app import settings
+from app.models import Category, Post, Tag
+
+
+class CacheEntry:
+    __slots__ = ('body', 'etag', 'tags', 'cache_control', 'expires')
+
+    def __init__(self, body, etag, tags, cache_control, expires):
+        self.body = body
+        self.etag = etag
+        self.tags = tags
+        self.cache_control = cache_control
+        self.expires = expires
+
+
+class ResponseCache:
+    """Кеш JSON-ответов GET-роутов в памяти процесса.
+
+    Записи помечаются тегами ('post:<slug>', 'category:<slug>', ...),
+    после коммита изменений моделей сбрасываются записи с затронутыми тегами.
+    При превышении max_bytes вытесняются давно не запрошенные записи.
+
+    Кеш, как и метрики, свой у каждого процесса: коммит сбрасывает записи
+    только там, где он выполнен. Другие воркеры uvicorn и отдельный процесс
+    админки (admin_app) об изменениях не знают, поэтому каждая запись живёт
+    не дольше ttl секунд - столько после изменения может отдаваться старый
+    ответ.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+        self.expired = 0
+        self.invalidated_at = 0.0
+        self._entries = OrderedDict()
+        self._keys_by_tag = defaultdict(set)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(request: Request):
+        return f'{request.url.path}?{request.url.query}'
+
+    @staticmethod
+    def _matches(request: Request, etag: str):
+        if_none_match = request.headers.get('if-none-match')
+        if not if_none_match:
+            return False
+        candidates = {value.strip()[2:] if value.strip().startswith('W/') else value.strip()
+                      for value in if_none_match.split(',')}
+        return etag in candidates or '*' in candidates
+
+    def _response(self, request: Request, entry: CacheEntry, status: str):
+        headers = {'ETag': entry.etag, 'Cache-Control': entry.cache_control, 'X-Cache': status}
+        if self._matches(request, entry.etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type='application/json', headers=headers)
+
+    def get(self, request: Request):
+        key = self.key(request)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return self._response(request, entry, 'HIT')
+
+    def set(self, request: Request, content, tags, cache_control='no-cache', store=True):
+        """Кладёт ответ в кеш; content - готовые байты JSON или то, что принимает jsonable_encoder.
+
+        С store=False только строит ответ с ETag, не сохраняя его.
+        """
+        body = content if isinstance(content, bytes) else JSONResponse(jsonable_encoder(content)).body
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        entry = CacheEntry(body, etag, frozenset(tags), cache_control, time.monotonic() + self.ttl)
+        if store and self.ttl > 0 and len(body) <= self.max_bytes:
+            key = self.key(request)
+            with self._lock:
+                self._remove(key)
+                self._entries[key] = entry
+                self.size += len(body)
+                for tag in entry.tags:
+                    self._keys_by_tag[tag].add(key)
+                while self.size > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+                    self.evictions += 1
+        return self._response(request, entry, 'MISS')
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry.body)
+        for tag in entry.tags:
+            keys = self._keys_by_tag[tag]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tag[tag]
+
+    def recently_invalidated(self, seconds):
+        """Была ли инвалидация за последние seconds: реплика могла ещё не получить эти изменения."""
+        return time.monotonic() - self.invalidated_at < seconds
+
+    def invalidate(self, *tags):
+        self.invalidated_at = time.monotonic()
+        with self._lock:
+            for tag in tags:
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+            'evictions': self.evictions,
+            'expired': self.expired,
+            'entries': len(self._entries),
+            'bytes': self.size,
+        }
+
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_MAX_BYTES, settings.RESPONSE_CACHE_TTL)
+
+
+def post_cache_tags(post: Post):
+    return ['post:' + post.slug, 'category:' + str(post.category_id), *('tag:' + tag.slug for tag in post.tags)]
+
+
+def _values(obj, attr):
+    """Текущее и старые (до flush) значения атрибута."""
+    history = inspect(obj).attrs[attr].history
+    return {*history.added, *history.unchanged, *history.deleted} - {None}
+
+
+def _affected_tags(obj):
+    if isinstance(obj, Post):
+        return {'post:' + slug for slug in _values(obj, 'slug')}
+    if isinstance(obj, Category):
+        return {'categories', *('category:' + slug for slug in _values(obj, 'slug'))}
+    if isinstance(obj, Tag):
+        return {'tag:' + slug for slug in _values(obj, 'slug')}
+    return set()
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_cache_tags(session, flush_context):
+    tags = session.info.setdefault('cache_tags', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        tags.update(_affected_tags(obj))
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_cache_tags(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        response_cache.invalidate(*tags)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def forget_cache_tags(session, previous_transaction):
+    session.info.pop('cache_tags', None)
@@ -0,0 +1,376 @@
+from fastapi import HTTPException
+from fastapi_pagination import Params
+from slugify import slugify
+from sqlalchemy import and_, exists, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased, joinedload, load_only, selectinload, undefer
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import facets, related
+from app.models import Category, Post, User, Tag, post_views, related_posts, through_table
+from app.schemas import PostSummarySchema
+from app.pagination import Keyset, paginate_cursor, paginate_offset
+from app.search import escape_like, render_snippet, search_posts
+from app.send_mail import send_email
+from app.serializers import serializer
+
+
+# Синхронные функции работы с БД. Роуты вызывают их через database.run_db,
+# поэтому всё, что нужно для сериализации ответа, должно быть загружено здесь.
+
+TITLE_TAKEN = 'Пост с таким заголовком уже существует'
+SLUG_TAKEN = 'Пост с таким слагом уже существует'
+CATEGORY_NOT_FOUND = 'Категория не найдена'
+EMAIL_TAKEN = 'Email уже занят'
+SLUG_ATTEMPTS = 3
+
+POST_LIST_FIELDS = ('id', 'title', 'slug', 'category', 'tags', 'created_at')
+POST_OPTIONAL_FIELDS = ('excerpt', 'text')
+POST_COLUMN_FIELDS = ('title', 'slug', 'text', 'created_at')
+POPULAR_FIELDS = (*POST_LIST_FIELDS, 'views')
+RELATED_FIELDS = ('id', 'title', 'slug', 'category', 'created_at')
+# Порядки списка постов; newest и oldest идут по индексам ix_posts_*_created_at_id
+POST_SORTS = {
+    'newest': Keyset(Post.created_at, Post.id, name='newest'),
+    'oldest': Keyset(Post.created_at, Post.id, descending=False, name='oldest'),
+    'title': Keyset(Post.title, descending=False, name='title'),
+}
+
+
+# Ограничения, которые роуты превращают в понятные ошибки: имя на PostgreSQL
+# и то, что SQLite пишет в тексте ошибки (у него имён ограничений там нет)
+POST_TITLE_UNIQUE = {'posts_title_key', 'posts.title'}
+POST_SLUG_UNIQUE = {'ix_posts_slug', 'posts.slug'}
+POST_CATEGORY_FK = {'posts_category_id_fkey', 'FOREIGN KEY'}
+USER_EMAIL_UNIQUE = {'ix_users_email', 'users.email'}
+
+
+def violated_constraint(exc: IntegrityError):
+    """Имя нарушенного ограничения.
+
+    На PostgreSQL - из диагностики драйвера (psycopg2 - diag, asyncpg -
+    исходное исключение), на SQLite - из текста ошибки: 'posts.slug' для
+    UNIQUE, 'FOREIGN KEY' для внешнего ключа.
+    """
+    for error in (exc.orig, exc.orig.__cause__):
+        diag = getattr(error, 'diag', None)
+        name = diag.constraint_name if diag is not None else getattr(error, 'constraint_name', None)
+        if name:
+            return name
+    kind, found, columns = str(exc.orig).partition(' constraint failed')
+    if not found:
+        return None
+    return columns.lstrip(': ').split(',')[0] or kind
+
+
+def violates(exc: IntegrityError, constraint) -> bool:
+    return violated_constraint(exc) in constraint
+
+
+def post_conflict(exc: IntegrityError):
+    """HTTPException для нарушенного ограничения posts; прочие IntegrityError пробрасываются дальше."""
+    if violates(exc, POST_TITLE_UNIQUE):
+        return HTTPException(status_code=400, detail=TITLE_TAKEN)
+    if violates(exc, POST_SLUG_UNIQUE):
+        return HTTPException(status_code=400, detail=SLUG_TAKEN)
+    if violates(exc, POST_CATEGORY_FK):
+        return HTTPException(status_code=400, detail=CATEGORY_NOT_FOUND)
+    raise exc
+
+
+def posts_query(db: Session):
+    """Посты вместе со всем, что нужно PostSchema: категория одним JOIN, теги одним IN-запросом."""
+    return db.query(Post).options(joinedload(Post.category), selectinload(Post.tags))
+
+
+def get_post(db: Session, slug: str):
+    return posts_query(db).filter(Post.slug == slug).first()
+
+
+def get_post_views(db: Session, slug: str):
+    """Записанные просмотры поста одним запросом по первичным ключам; None - поста нет."""
+    return db.query(Post.views).filter(Post.slug == slug).scalar()
+
+
+def list_categories(db: Session):
+    return db.query(Category).all()
+
+
+def filter_posts(posts, dialect: str, category=None, tag=None, q=None, highlight=False,
+                 author=None, since=None, until=None):
+    """Общие фильтры списка постов, работают и с Query, и с select().
+
+    `since` включает границу, `until` - нет.
+    """
+    if category:
+        posts = posts.filter(Post.category_id == category)
+    if author is not None:
+        posts = posts.filter(Post.author_id == author)
+    if tag:
+        # tag_id - это слаг тега, таблица tags не нужна
+        posts = posts.filter(Post.id.in_(select(through_table.c.post_id).where(through_table.c.tag_id == tag)))
+    if since is not None:
+        posts = posts.filter(Post.created_at >= since)
+    if until is not None:
+        posts = posts.filter(Post.created_at < until)
+    rank = None
+    if q:
+        posts, rank = search_posts(posts, q, dialect, highlight)
+    return posts, rank
+
+
+def summary_query(db: Session, fields, keyset: Keyset):
+    """Посты только с нужными полями: остальные колонки отложены и не читаются из БД.
+
+    Колонки keyset загружаются всегда - из них строятся курсоры.
+    """
+    columns = {'id', *(col.key for col in keyset.columns)} | {f for f in fields if f in POST_COLUMN_FIELDS}
+    options = [load_only(*columns)]
+    if 'category' in fields:
+        options.append(joinedload(Post.category))
+    if 'tags' in fields:
+        options.append(selectinload(Post.tags))
+    if 'excerpt' in fields:
+        options.append(undefer(Post.excerpt))
+    return db.query(Post).options(*options)
+
+
+def list_posts(db: Session, params: Params, category=None, tag=None, q=None, cursor=None, highlight=False,
+               fields=POST_LIST_FIELDS, fast=False, total_mode='exact', sort=None, author=None, since=None,
+               until=None):
+    """Страница постов; при `fast` - сразу байты JSON (сериализация идёт здесь, пока доступна сессия).
+
+    Без `sort` посты идут от новых к старым, а с `q` - по релевантности.
+    """
+    keyset = POST_SORTS[sort or 'newest']
+    posts, rank = filter_posts(summary_query(db, fields, keyset), db.get_bind().dialect.name, category, tag, q,
+                               highlight, author, since, until)
+    if sort:
+        rank = None
+    if cursor:
+        page = paginate_cursor(posts, params, keyset, cursor)
+    else:
+        page = paginate_offset(posts, params, keyset, rank, total_mode)
+    if highlight and q:
+        fields = (*fields, 'snippet')
+        for post in page.items:
+            set_committed_value(post, 'snippet', render_snippet(post.snippet))
+    if fast:
+        return serializer(PostSummarySchema, frozenset(fields)).dumps_page(page)
+    page.items = [PostSummarySchema(**{field: getattr(post, field) for field in fields}) for post in page.items]
+    return page
+
+
+def popular_posts(db: Session, limit: int, category=None, fast=False):
+    """Самые просматриваемые посты, по индексу ix_post_views_views_post_id."""
+    posts = (summary_query(db, POPULAR_FIELDS, POST_SORTS['newest'])
+             .options(undefer(Post.views))
+             .join(post_views, post_views.c.post_id == Post.id)
+             .order_by(post_views.c.views.desc(), post_views.c.post_id.desc()))
+    if category:
+        posts = posts.filter(Post.category_id == category)
+    posts = posts.limit(limit).all()
+    if fast:
+        return serializer(PostSummarySchema, frozenset(POPULAR_FIELDS)).dumps_many(posts)
+    return [PostSummarySchema(**{field: getattr(post, field) for field in POPULAR_FIELDS}) for post in posts]
+
+
+def related_to(db: Session, slug: str, fast=False):
+    """Похожие посты одним запросом по первичному ключу related_posts; None - поста нет."""
+    post = aliased(Post)
+    posts = (summary_query(db, RELATED_FIELDS, POST_SORTS['newest'])
+             .join(related_posts, related_posts.c.related_id == Post.id)
+             .filter(related_posts.c.post_id == select(post.id).where(post.slug == slug).scalar_subquery())
+             .order_by(related_posts.c.rank)
+             .all())
+    if not posts and not db.query(exists().where(Post.slug == slug)).scalar():
+        return None
+    if fast:
+        return serializer(PostSummarySchema, frozenset(RELATED_FIELDS)).dumps_many(posts)
+    return [PostSummarySchema(**{field: getattr(post, field) for field in RELATED_FIELDS}) for post in posts]
+
+
+def free_slug(db: Session, title: str):
+    """Слаг для нового поста за один запрос: проверяет и заголовок, и занятые слаги с суффиксами.
+
+    Возвращает None, если пост с таким заголовком уже есть.
+    """
+    base = slugify(title)
+    if db.get_bind().dialect.name == 'postgresql':
+        # Индекс ix_posts_slug_pattern (varchar_pattern_ops): диапазон по
+        # ix_posts_slug при не-C collation сравнивал бы без учёта дефисов
+        suffixed = Post.slug.like(f'{escape_like(base)}-%', escape='\\')
+    else:
+        # LIKE в SQLite без учёта регистра и мимо индекса, а сравнение строк побайтовое
+        suffixed = and_(Post.slug >= f'{base}-', Post.slug < f'{base}.')
+    rows = db.query(Post.title, Post.slug).filter(or_(Post.title == title, Post.slug == base, suffixed)).all()
+    if any(row.title == title for row in rows):
+        return None
+    taken = {row.slug for row in rows}
+    if base not in taken:
+        return base
+    suffixes = [int(slug[len(base) + 1:]) for slug in taken if slug[len(base) + 1:].isdigit()]
+    return f'{base}-{max(suffixes, default=1) + 1}'
+
+
+def create_post(db: Session, data, author_id: int):
+    if db.get_bind().dialect.name != 'postgresql' and db.get(Category, data.category_id) is None:
+        # SQLite без PRAGMA foreign_keys вставил бы пост с несуществующей категорией
+        raise HTTPException(status_code=400, detail=CATEGORY_NOT_FOUND)
+    for _ in range(SLUG_ATTEMPTS):
+        slug = free_slug(db, data.title)
+        if slug is None:
+            raise HTTPException(status_code=400, detail=TITLE_TAKEN)
+        post = Post(author_id=author_id,
+                    slug=slug,
+                    **data.dict())
+        db.add(post)
+        try:
+            db.commit()
+        except IntegrityError as exc:
+            # Параллельная вставка успела раньше: со слагом - следующий суффикс, иначе отказ
+            db.rollback()
+            if violates(exc, POST_SLUG_UNIQUE):
+                continue
+            raise post_conflict(exc)
+        return get_post(db, slug)
+    raise HTTPException(status_code=409, detail='Не удалось подобрать слаг, повторите запрос')
+
+
+def insert_ignore(db: Session, table):
+    """INSERT ... ON CONFLICT DO NOTHING для PostgreSQL и SQLite."""
+    dialect = {'postgresql': postgresql, 'sqlite': sqlite}[db.get_bind().dialect.name]
+    return dialect.insert(table).on_conflict_do_nothing()
+
+
+def import_posts(db: Session, rows, author_id: int):
+    """Вставляет пачку постов несколькими executemany вместо запросов на каждый пост.
+
+    rows - список (номер строки, ImportPostSchema). Строки с ошибками
+    пропускаются и попадают в список ошибок, остальные вставляются.
+    """
+    errors, imported = [], 0
+    categories = {slug for slug, in db.query(Category.slug)
+                  .filter(Category.slug.in_({data.category_id for _, data in rows}))}
+    titles = {data.title for _, data in rows}
+    slugs = {slugify(data.title) for _, data in rows}
+    taken_titles, taken_slugs = set(), set()
+    for title, slug in db.query(Post.title, Post.slug).filter(or_(Post.title.in_(titles), Post.slug.in_(slugs))):
+        taken_titles.add(title)
+        taken_slugs.add(slug)
+
+    posts, tags, lines = {}, {}, {}
+    for line, data in rows:
+        slug = slugify(data.title)
+        if data.category_id not in categories:
+            errors.append({'line': line, 'detail': CATEGORY_NOT_FOUND})
+        elif data.title in taken_titles:
+            errors.append({'line': line, 'detail': TITLE_TAKEN})
+        elif not slug or slug in taken_slugs:
+            errors.append({'line': line, 'detail': SLUG_TAKEN})
+        else:
+            taken_titles.add(data.title)
+            taken_slugs.add(slug)
+            posts[slug] = {'title': data.title, 'slug': slug, 'text': data.text,
+                           'category_id': data.category_id, 'author_id': author_id}
+            tags[slug] = {slugify(tag) for tag in data.tags} - {''}
+            lines[slug] = line
+
+    if posts:
+        all_tags = set().union(*tags.values())
+        if all_tags:
+            db.execute(insert_ignore(db, Tag.__table__), [{'slug': tag, 'title': tag} for tag in all_tags])
+            # Тег мог не вставиться из-за чужого тега с тем же заголовком
+            all_tags = {slug for slug, in db.query(Tag.slug).filter(Tag.slug.in_(all_tags))}
+        db.execute(insert_ignore(db, Post.__table__), list(posts.values()))
+        ids = dict(db.query(Post.slug, Post.id).filter(Post.slug.in_(posts), Post.author_id == author_id))
+        imported = len(ids)
+        # Строки, которые между проверкой и вставкой занял параллельный запрос
+        for slug in set(posts) - set(ids):
+            errors.append({'line': lines[slug], 'detail': TITLE_TAKEN})
+        links = [{'post_id': ids[slug], 'tag_id': tag}
+                 for slug, post_tags in tags.items() if slug in ids
+                 for tag in post_tags if tag in all_tags]
+        if links:
+            db.execute(insert_ignore(db, through_table), links)
+        # Вставка мимо ORM: обработчики flush её не видят
+        delta = facets.Delta()
+        for slug in ids:
+            delta.add(posts[slug]['category_id'], tags[slug] & all_tags, 1)
+        facets.apply(db, delta)
+        related.queue(db, ids.values())
+    db.commit()
+    return imported, errors
+
+
+def update_post(db: Session, slug: str, data, user_id: int):
+    post = db.query(Post).filter(Post.slug == slug).first()
+    if post is None:
+        raise HTTPException(status_code=404,
+                            detail='Пост не найден')
+    if post.author_id != user_id:
+        raise HTTPException(status_code=403,
+                            detail='Вы не являетесь автором')
+    for key, value in data.dict().items():
+        if value is not None:
+            setattr(post, key, value)
+    try:
+        db.commit()
+    except IntegrityError as exc:
+        db.rollback()
+        raise post_conflict(exc)
+    return posts_query(db).filter(Post.id == post.id).one()
+
+
+def delete_post(db: Session, slug: str, user_id: int):
+    post = db.query(Post).filter(Post.slug == slug).first()
+    if post is None:
+        raise HTTPException(status_code=404,
+                            detail='Пост не найден')
+    if post.author_id != user_id:
+        raise HTTPException(status_code=403,
+                            detail='Вы не являетесь автором')
+    db.delete(post)
+    db.commit()
+
+
+def email_taken(db: Session, email: str):
+    return db.query(exists().where(User.email == email)).scalar()
+
+
+def create_user(db: Session, email: str, name: str, hashed_password: str, activation_code: str, emails=()):
+    """Создаёт пользователя; письма (subject, body) попадают в outbox в той же транзакции."""
+    user = User(**{'email': email, 'name': name})
+    user.password = hashed_password
+    user.activation_code = activation_code
+    db.add(user)
+    for subject, body in emails:
+        send_email(db, subject, email, body)
+    try:
+        db.commit()
+    except IntegrityError as exc:
+        db.rollback()
+        if not violates(exc, USER_EMAIL_UNIQUE):
+            raise
+        raise HTTPException(status_code=400, detail=EMAIL_TAKEN)
+    db.refresh(user)
+    return user
+
+
+def activate_user(db: Session, activation_code: str):
+    user = db.query(User).filter(User.activation_code == activation_code).first()
+    if user:
+        user.activation_code = ''
+        user.is_active = True
+        db.commit()
+    return user
+
+
+def get_user_by_email(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+
+def set_password(db: Session, user_id: int, hashed_password: str):
+    db.query(User).filter(User.id == user_id).update({'password': hashed_password})
+    db.commit()
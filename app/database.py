@@ -1,19 +1,101 @@
-from app.settings import DATABASE_URL
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
+
+from app import settings
+
+
+# Функции (pool, секунды), которые получают время каждой выдачи соединения из пула
+pool_checkout_observers = []
+
+
+class TimedPoolMixin:
+    """Засекает, сколько запрос ждал соединение из пула (включая открытие нового)."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            for observe in pool_checkout_observers:
+                observe(self, time.perf_counter() - started)
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
 
+def engine_options(url, asynchronous=False):
+    options = {
+        'pool_pre_ping': settings.DB_POOL_PRE_PING,
+        'pool_recycle': settings.DB_POOL_RECYCLE,
+    }
+    if url.startswith('sqlite'):
+        options['connect_args'] = {'check_same_thread': False}
+    else:
+        options['pool_size'] = settings.DB_POOL_SIZE
+        options['max_overflow'] = settings.DB_MAX_OVERFLOW
+        options['poolclass'] = TimedAsyncQueuePool if asynchronous else TimedQueuePool
+    return options
 
-engine = create_engine(DATABASE_URL)
+
+engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = None
+AsyncSessionLocal = None
+if settings.DB_ASYNC:
+    async_engine = create_async_engine(settings.ASYNC_DATABASE_URL,
+                                       **engine_options(settings.ASYNC_DATABASE_URL, asynchronous=True))
+    AsyncSessionLocal = sessionmaker(autocommit=False,
+                                     autoflush=False,
+                                     expire_on_commit=False,
+                                     bind=async_engine,
+                                     class_=AsyncSession)
+
 
 Base = declarative_base()
 
 
-def get_db():
+def get_sync_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def sync_engines():
+    """Все синхронные Engine, в том числе внутри AsyncEngine, - для подписки на события."""
+    engines = [engine]
+    if async_engine is not None:
+        engines.append(async_engine.sync_engine)
+    return engines
+
+
+get_db = get_async_db if settings.DB_ASYNC else get_sync_db
+
+
+async def run_db(db, fn, *args, **kwargs):
+    """Выполняет синхронную функцию fn(session, ...) не блокируя event loop.
+
+    С AsyncSession функция работает через greenlet на асинхронном драйвере,
+    с обычной Session - в threadpool.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
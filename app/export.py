@@ -0,0 +1,65 @@
+import csv
+import io
+import json
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud
+from app.models import Post
+
+EXPORT_BATCH = 1000
+EXPORT_COLUMNS = (Post.id, Post.title, Post.slug, Post.text, Post.category_id, Post.author_id, Post.created_at)
+FIELDNAMES = [column.key for column in EXPORT_COLUMNS]
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def export_statement(dialect: str, category=None, tag=None, q=None, since=None):
+    """Колонки постов без ORM-объектов, чтобы identity map не рос при выгрузке."""
+    stmt = sa.select(*EXPORT_COLUMNS)
+    stmt, _ = crud.filter_posts(stmt, dialect, category, tag, q, since=since)
+    return stmt.order_by(Post.created_at, Post.id).execution_options(stream_results=True)
+
+
+def _values(row):
+    values = dict(zip(FIELDNAMES, row))
+    if values['created_at'] is not None:
+        values['created_at'] = values['created_at'].isoformat()
+    return values
+
+
+def render(rows, fmt: str) -> str:
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(_values(row), ensure_ascii=False) + '\n' for row in rows)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(_values(row).values() for row in rows)
+    return buffer.getvalue()
+
+
+def header(fmt: str) -> str:
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(FIELDNAMES)
+        return buffer.getvalue()
+    return ''
+
+
+def stream_posts(db, stmt, fmt: str):
+    """Генератор частей ответа: серверный курсор читается пачками по EXPORT_BATCH строк."""
+    if isinstance(db, AsyncSession):
+        async def chunks():
+            yield header(fmt)
+            result = await db.stream(stmt)
+            async for rows in result.partitions(EXPORT_BATCH):
+                yield render(rows, fmt)
+        return chunks()
+
+    def chunks():
+        yield header(fmt)
+        result = db.execute(stmt)
+        for rows in result.partitions(EXPORT_BATCH):
+            yield render(rows, fmt)
+    return chunks()
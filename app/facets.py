@@ -0,0 +1,207 @@
+"""Счётчики постов по категориям и тегам для боковой панели.
+
+categories.posts_count, tags.posts_count и category_tag_counts (число
+постов категории с каждым тегом) меняются в той же транзакции, что и
+посты: ORM-изменения (роуты, админка) учитываются обработчиками flush
+сессии, массовая вставка в crud.import_posts вызывает apply сама.
+Если счётчики разошлись с данными (правка БД руками, datagen), их
+пересчитывает
+
+    python -m app.facets
+"""
+import time
+from collections import Counter, defaultdict
+
+import sqlalchemy as sa
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.database import engine
+from app.models import Category, Post, Tag, category_tag_counts, through_table
+from app.search import search_posts
+
+
+class Delta:
+    """Изменения счётчиков: +1/-1 на каждую категорию, тег и пару категория-тег поста."""
+
+    def __init__(self):
+        self.categories = Counter()
+        self.tags = Counter()
+        self.pairs = Counter()
+
+    def add(self, category, tags, sign):
+        if category is not None:
+            self.categories[category] += sign
+        for tag in tags:
+            self.tags[tag] += sign
+            if category is not None:
+                self.pairs[category, tag] += sign
+
+    def __bool__(self):
+        return any(self.categories.values()) or any(self.tags.values()) or any(self.pairs.values())
+
+
+def _increment(table, key, counts):
+    # Сортировка по ключу - одинаковый порядок блокировок строк в параллельных транзакциях
+    rows = [{'b_key': k, 'b_delta': v} for k, v in sorted(counts.items()) if v]
+    if not rows:
+        return None
+    return (table.update()
+            .where(table.c[key] == sa.bindparam('b_key'))
+            .values(posts_count=table.c.posts_count + sa.bindparam('b_delta'))), rows
+
+
+def apply(db, delta: Delta):
+    """Применяет изменения счётчиков в текущей транзакции сессии."""
+    if not delta:
+        return
+    for update in (_increment(Category.__table__, 'slug', delta.categories),
+                   _increment(Tag.__table__, 'slug', delta.tags)):
+        if update:
+            db.execute(*update)
+    pairs = [{'category_id': category, 'tag_id': tag, 'posts_count': count}
+             for (category, tag), count in sorted(delta.pairs.items()) if count]
+    if pairs:
+        dialect = {'postgresql': postgresql, 'sqlite': sqlite}[db.get_bind().dialect.name]
+        insert = dialect.insert(category_tag_counts)
+        db.execute(insert.on_conflict_do_update(
+            index_elements=[category_tag_counts.c.category_id, category_tag_counts.c.tag_id],
+            set_={'posts_count': category_tag_counts.c.posts_count + insert.excluded.posts_count},
+        ), pairs)
+        db.execute(category_tag_counts.delete().where(
+            category_tag_counts.c.category_id.in_({row['category_id'] for row in pairs}),
+            category_tag_counts.c.posts_count <= 0,
+        ))
+
+
+def _changed(post):
+    state = inspect(post)
+    return any(state.attrs[attr].history.has_changes() for attr in ('category_id', 'category', 'tags'))
+
+
+def _stored_state(session, ids):
+    """Категории и теги постов в текущей транзакции: {id: (категория, теги)}."""
+    if not ids:
+        return {}
+    tags = defaultdict(set)
+    for post_id, tag in session.execute(sa.select(through_table.c.post_id, through_table.c.tag_id)
+                                        .where(through_table.c.post_id.in_(ids))):
+        tags[post_id].add(tag)
+    return {post_id: (category, tags[post_id])
+            for post_id, category in session.execute(sa.select(Post.id, Post.category_id).where(Post.id.in_(ids)))}
+
+
+def changed_posts(session):
+    """Посты, у которых в этом flush меняются категория или теги: новые, удалённые и изменённые."""
+    posts = {obj for obj in session.new if isinstance(obj, Post)}
+    posts.update(obj for obj in session.dirty if isinstance(obj, Post) and _changed(obj))
+    posts.update(obj for obj in session.deleted if isinstance(obj, Post))
+    for obj in session.dirty:
+        # Посты, перенесённые в категорию или привязанные к тегу с их стороны (админка)
+        if isinstance(obj, (Category, Tag)):
+            history = inspect(obj).attrs.posts.history
+            posts.update(history.added or (), history.deleted or ())
+    return posts
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_facet_state(session, flush_context, instances):
+    # Состояние до и после flush читается из БД, а не из истории атрибутов: в ней
+    # нет старых значений незагруженных атрибутов и изменений, сделанных с другой стороны связи
+    posts = changed_posts(session)
+    ids = {post.id for post in posts if inspect(post).has_identity}
+    session.info['facet_state'] = (_stored_state(session, ids), [post for post in posts if post.id not in ids])
+    session.info['facet_removed'] = [obj for obj in session.deleted if isinstance(obj, (Category, Tag))]
+
+
+@event.listens_for(Session, 'after_flush')
+def apply_facet_delta(session, flush_context):
+    old, new_posts = session.info.pop('facet_state', ({}, []))
+    ids = [*old, *(post.id for post in new_posts if post.id is not None)]
+    current = _stored_state(session, ids)
+    delta = Delta()
+    for post_id in ids:
+        before, after = old.get(post_id, (None, set())), current.get(post_id, (None, set()))
+        if before != after:
+            delta.add(*before, -1)
+            delta.add(*after, 1)
+    # Строки новых категорий и тегов уже вставлены, их счётчики можно увеличивать
+    apply(session, delta)
+    for obj in session.info.pop('facet_removed', ()):
+        # SQLite без PRAGMA foreign_keys не выполняет ON DELETE CASCADE
+        column = category_tag_counts.c.category_id if isinstance(obj, Category) else category_tag_counts.c.tag_id
+        session.execute(category_tag_counts.delete().where(column == obj.slug))
+
+
+def reconcile(conn):
+    """Пересчитывает все счётчики по posts и post_tags в транзакции conn."""
+    if conn.dialect.name == 'postgresql':
+        # Запись постов ждёт конца пересчёта, иначе её изменения счётчиков потерялись бы
+        conn.execute(sa.text('LOCK TABLE posts, post_tags IN SHARE MODE'))
+    categories, tags = Category.__table__, Tag.__table__
+    conn.execute(categories.update().values(posts_count=(
+        sa.select(sa.func.count()).where(Post.category_id == categories.c.slug).scalar_subquery())))
+    conn.execute(tags.update().values(posts_count=(
+        sa.select(sa.func.count()).where(through_table.c.tag_id == tags.c.slug).scalar_subquery())))
+    conn.execute(category_tag_counts.delete())
+    conn.execute(category_tag_counts.insert().from_select(
+        ['category_id', 'tag_id', 'posts_count'],
+        sa.select(Post.category_id, through_table.c.tag_id, sa.func.count())
+        .join(through_table, through_table.c.post_id == Post.id)
+        .where(Post.category_id.isnot(None))
+        .group_by(Post.category_id, through_table.c.tag_id),
+    ))
+
+
+def _rows(query):
+    return [{'slug': slug, 'title': title, 'count': count} for slug, title, count in query]
+
+
+def _search_counts(db, category, q, limit):
+    """Счётчики по найденным постам: посты выбираются через полнотекстовый индекс."""
+    dialect = db.get_bind().dialect.name
+    matched, _ = search_posts(db.query(Post), q, dialect)
+    count = sa.func.count(Post.id)
+    categories = (matched.join(Category, Category.slug == Post.category_id)
+                  .with_entities(Category.slug, Category.title, count)
+                  .group_by(Category.slug, Category.title)
+                  .order_by(count.desc(), Category.slug))
+    if category:
+        matched = matched.filter(Post.category_id == category)
+    tags = (matched.join(through_table, through_table.c.post_id == Post.id)
+            .join(Tag, Tag.slug == through_table.c.tag_id)
+            .with_entities(Tag.slug, Tag.title, count)
+            .group_by(Tag.slug, Tag.title)
+            .order_by(count.desc(), Tag.slug)
+            .limit(limit))
+    return {'categories': _rows(categories), 'tags': _rows(tags)}
+
+
+def facet_counts(db: Session, category=None, q=None, limit=50):
+    """Число постов по категориям и тегам (limit самых частых тегов).
+
+    Категории считаются без учёта фильтра по категории, чтобы в панели
+    были видны и соседние, теги - только по постам выбранной категории.
+    """
+    if q:
+        return _search_counts(db, category, q, limit)
+    categories = (db.query(Category.slug, Category.title, Category.posts_count)
+                  .filter(Category.posts_count > 0)
+                  .order_by(Category.posts_count.desc(), Category.slug))
+    if category:
+        count = category_tag_counts.c.posts_count
+        tags = (db.query(Tag.slug, Tag.title, count)
+                .join(category_tag_counts, category_tag_counts.c.tag_id == Tag.slug)
+                .filter(category_tag_counts.c.category_id == category, count > 0))
+    else:
+        count = Tag.posts_count
+        tags = db.query(Tag.slug, Tag.title, count).filter(count > 0)
+    return {'categories': _rows(categories), 'tags': _rows(tags.order_by(count.desc(), Tag.slug).limit(limit))}
+
+
+if __name__ == '__main__':
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        reconcile(connection)
+    print(f'Счётчики пересчитаны за {time.perf_counter() - started:.1f}s')
@@ -1,15 +1,86 @@
-from passlib.context import CryptContext
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 
+from app import settings
 
-password_context = CryptContext(schemes=['bcrypt'],
-                                deprecated='auto')
+
+@lru_cache(maxsize=None)
+def password_context():
+    """CryptContext создаётся при первом хешировании (в каждом процессе пула - своё)."""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=['bcrypt'],
+                        deprecated='auto',
+                        bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+                        bcrypt__min_rounds=settings.BCRYPT_ROUNDS)
+
+
+class HashingOverloaded(Exception):
+    """Очередь на хеширование заполнена, запрос нужно отклонить сразу."""
+
+
+def _hash(password):
+    return password_context().hash(password)
+
+
+def _verify_and_update(raw_password, hashed_password):
+    return password_context().verify_and_update(raw_password, hashed_password)
 
 
 class Hasher:
+    executor = None
+    capacity = 0
+    pending = 0
+    rejected = 0
+    # Функции (операция, секунды), которые получают время каждой задачи хеширования
+    observers = []
+
     @staticmethod
     def hash_password(password):
-        return password_context.hash(password)
+        return password_context().hash(password)
 
     @staticmethod
     def verify_password(raw_password, hashed_password):
-        return password_context.verify(raw_password, hashed_password)
+        return password_context().verify(raw_password, hashed_password)
+
+    @classmethod
+    def configure(cls, kind=None, workers=None):
+        cls.shutdown()
+        kind = kind or settings.HASHING_EXECUTOR
+        workers = workers or settings.HASHING_WORKERS
+        executor_class = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+        cls.executor = executor_class(max_workers=workers)
+        cls.capacity = workers + settings.HASHING_QUEUE_LIMIT
+
+    @classmethod
+    def shutdown(cls):
+        if cls.executor is not None:
+            cls.executor.shutdown(wait=False)
+            cls.executor = None
+
+    @classmethod
+    async def _submit(cls, operation, fn, *args):
+        if cls.executor is None:
+            cls.configure()
+        # Счётчики меняются только из event loop, блокировка не нужна
+        if cls.pending >= cls.capacity:
+            cls.rejected += 1
+            raise HashingOverloaded
+        cls.pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(cls.executor, fn, *args)
+        finally:
+            cls.pending -= 1
+            for observe in cls.observers:
+                observe(operation, time.perf_counter() - started)
+
+    @classmethod
+    async def hash_password_async(cls, password):
+        return await cls._submit('hash', _hash, password)
+
+    @classmethod
+    async def verify_and_update(cls, raw_password, hashed_password):
+        """Возвращает (пароль верен, новый хеш или None, если перехеширование не нужно)."""
+        return await cls._submit('verify', _verify_and_update, raw_password, hashed_password)
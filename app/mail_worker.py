@@ -0,0 +1,156 @@
+"""Отправка писем из outbox.
+
+    python -m app.mail_worker
+
+Забирает пачки писем, у которых подошло время попытки, и рассылает их
+через EMAIL_CONCURRENCY SMTP-соединений, которые живут между пачками.
+Забранные письма откладываются на LEASE, поэтому после падения воркера
+они будут отправлены повторно (доставка at-least-once). Неудачные
+попытки откладываются с экспоненциальной задержкой, после
+EMAIL_MAX_ATTEMPTS письмо помечается как failed. Если упала сама пачка
+(недоступна БД и т.п.), воркер пишет ошибку в лог и повторяет попытку
+с растущей паузой, но не реже раза в MAX_BACKOFF секунд.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import aiosmtplib
+from sqlalchemy.orm import Session
+
+from app import settings
+from app.database import SessionLocal
+from app.models import EmailOutbox
+from app.send_mail import get_conf
+
+logger = logging.getLogger(__name__)
+
+LEASE = timedelta(minutes=5)
+MAX_BACKOFF = 60
+
+
+def claim_batch(db: Session, limit: int):
+    now = datetime.utcnow()
+    rows = (db.query(EmailOutbox)
+            .filter(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now)
+            .order_by(EmailOutbox.next_attempt_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all())
+    for row in rows:
+        row.attempts += 1
+        row.next_attempt_at = now + LEASE
+    db.commit()
+    return [(row.id, row.recipient, row.subject, row.body, row.attempts) for row in rows]
+
+
+def save_results(db: Session, sent: list, failed: dict):
+    now = datetime.utcnow()
+    if sent:
+        (db.query(EmailOutbox)
+         .filter(EmailOutbox.id.in_(sent))
+         .update({'status': 'sent', 'sent_at': now, 'last_error': None}, synchronize_session=False))
+    for outbox_id, (attempts, error) in failed.items():
+        values = {'last_error': error}
+        if attempts >= settings.EMAIL_MAX_ATTEMPTS:
+            values['status'] = 'failed'
+        else:
+            values['next_attempt_at'] = now + timedelta(seconds=settings.EMAIL_RETRY_BASE * 2 ** (attempts - 1))
+        db.query(EmailOutbox).filter(EmailOutbox.id == outbox_id).update(values, synchronize_session=False)
+    db.commit()
+
+
+def run_in_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+class Connection:
+    """SMTP-соединение, которое переподключается, только если сервер его закрыл."""
+
+    def __init__(self):
+        self.conf = conf = get_conf()
+        self.smtp = aiosmtplib.SMTP(hostname=conf.MAIL_SERVER,
+                                    port=conf.MAIL_PORT,
+                                    use_tls=conf.MAIL_SSL,
+                                    validate_certs=conf.VALIDATE_CERTS)
+
+    async def ensure_connected(self):
+        if self.smtp.is_connected:
+            return
+        await self.smtp.connect()
+        if self.conf.MAIL_TLS:
+            await self.smtp.starttls()
+        if self.conf.USE_CREDENTIALS:
+            await self.smtp.login(self.conf.MAIL_USERNAME, self.conf.MAIL_PASSWORD)
+
+    async def send(self, recipient, subject, body):
+        message = EmailMessage()
+        message['From'] = self.conf.MAIL_FROM
+        message['To'] = recipient
+        message['Subject'] = subject
+        message.set_content(body)
+        await self.ensure_connected()
+        await self.smtp.send_message(message)
+
+    async def close(self):
+        if self.smtp.is_connected:
+            try:
+                await self.smtp.quit()
+            except aiosmtplib.SMTPException:
+                self.smtp.close()
+
+
+async def deliver(connection: Connection, messages, sent: list, failed: dict):
+    for outbox_id, recipient, subject, body, attempts in messages:
+        try:
+            await connection.send(recipient, subject, body)
+        except (aiosmtplib.SMTPException, OSError) as exc:
+            logger.warning('Не удалось отправить письмо %s: %s', outbox_id, exc)
+            failed[outbox_id] = (attempts, str(exc))
+            connection.smtp.close()
+        else:
+            sent.append(outbox_id)
+
+
+async def drain_once(connections) -> int:
+    loop = asyncio.get_running_loop()
+    batch = await loop.run_in_executor(None, run_in_session, claim_batch, settings.EMAIL_BATCH_SIZE)
+    if not batch:
+        return 0
+    sent, failed = [], {}
+    chunks = [batch[i::len(connections)] for i in range(len(connections))]
+    await asyncio.gather(*(deliver(connection, chunk, sent, failed)
+                           for connection, chunk in zip(connections, chunks) if chunk))
+    await loop.run_in_executor(None, run_in_session, save_results, sent, failed)
+    return len(batch)
+
+
+async def run():
+    connections = [Connection() for _ in range(settings.EMAIL_CONCURRENCY)]
+    failures = 0
+    try:
+        while True:
+            try:
+                processed = await drain_once(connections)
+            except Exception:
+                failures += 1
+                delay = min(settings.EMAIL_POLL_INTERVAL * 2 ** failures, MAX_BACKOFF)
+                logger.exception('Ошибка при обработке пачки писем, повтор через %.0fs', delay)
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            if processed < settings.EMAIL_BATCH_SIZE:
+                await asyncio.sleep(settings.EMAIL_POLL_INTERVAL)
+    finally:
+        for connection in connections:
+            await connection.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run())
@@ -2,36 +2,78 @@ from fastapi import FastAPI
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi_pagination import add_pagination
-from sqladmin import Admin
 
-from starlette.responses import JSONResponse
-
-from app.database import engine
-from app.admin import CategoryAdmin, PostAdmin, UserAdmin, TagAdmin
+from app import admission, metrics, query_stats, settings, slow_queries
+from app.replicas import ReadAfterWriteMiddleware, replicas
+from app.admin_app import LazyAdmin
+from app.database import sync_engines
+from app.hashing import Hasher, HashingOverloaded
+from app.related import related_updater
 from app.routes import router
+from app.serializers import DefaultResponse
+from app.view_counts import view_counter
+
 
+app = FastAPI(default_response_class=DefaultResponse)
 
-app = FastAPI()
+for sync_engine in [*sync_engines(), *replicas.sync_engines()]:
+    query_stats.install(sync_engine)
+    if settings.SLOW_QUERY_MS:
+        slow_queries.install(sync_engine)
+# Middleware добавляются изнутри наружу: метрики видят и отклонённые запросы
+if settings.DEBUG:
+    app.middleware('http')(query_stats.query_count_middleware)
+if replicas.replicas:
+    app.add_middleware(ReadAfterWriteMiddleware)
+if settings.SLOW_QUERY_MS:
+    app.add_middleware(slow_queries.RequestContextMiddleware)
+if settings.ADMISSION:
+    app.add_middleware(admission.AdmissionMiddleware)
+if settings.METRICS:
+    metrics.install()
+    app.add_middleware(metrics.MetricsMiddleware)
 
-admin = Admin(app, engine)
+if settings.ADMIN_PANEL == 'lazy':
+    app.mount('/admin', LazyAdmin(), name='admin')
 
 
 @app.exception_handler(RequestValidationError)
 def validation_handler(request, exc):
-    return JSONResponse(
+    return DefaultResponse(
         status_code=400,
         content=jsonable_encoder({'detail': exc.errors()})
     )
 
 
+@app.exception_handler(HashingOverloaded)
+def hashing_overloaded_handler(request, exc):
+    return DefaultResponse(
+        status_code=503,
+        content={'detail': 'Сервис перегружен, повторите попытку позже'},
+        headers={'Retry-After': '1'}
+    )
+
+
+@app.on_event('startup')
+def start_background_tasks():
+    replicas.start()
+    view_counter.start()
+    related_updater.start()
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    Hasher.shutdown()
+    await view_counter.stop()
+    await related_updater.stop()
+    await replicas.stop()
+
+
 app.include_router(router)
+if settings.METRICS:
+    app.include_router(metrics.router)
 
 #TODO: Docker
 #TODO: деплой
 
-admin.register_model(CategoryAdmin)
-admin.register_model(PostAdmin)
-admin.register_model(UserAdmin)
-admin.register_model(TagAdmin)
-
 add_pagination(app)
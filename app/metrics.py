@@ -0,0 +1,315 @@
+"""Метрики сервиса в текстовом формате Prometheus.
+
+Счётчики живут в памяти процесса, поэтому при нескольких воркерах
+uvicorn Prometheus должен опрашивать каждый из них. Запись метрики -
+обновление словаря под блокировкой, всё остальное делается при опросе.
+Так же по процессам разделён и кеш ответов: его метрики - по кешу
+своего воркера, а изменения из других процессов он видит не позже
+RESPONSE_CACHE_TTL (см. app.cache.ResponseCache).
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+from starlette.concurrency import run_in_threadpool
+
+from app import database
+from app.admission import limiters
+from app.cache import response_cache
+from app.hashing import Hasher
+from app.models import EmailOutbox
+from app.replicas import replicas
+from app.query_stats import count_queries
+from app.related import related_updater
+from app.view_counts import view_counter
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+HASHING_BUCKETS = (.05, .1, .2, .3, .5, .75, 1, 2, 5)
+POOL_BUCKETS = (.0005, .001, .005, .01, .05, .1, .5, 1, 5, 30)
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f'{self.name}{_labels(self.labelnames, labels)} {value}'
+                                for labels, value in values]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # счётчики по корзинам (последняя - +Inf), сумма, количество
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+def _family(name, documentation, samples, kind='gauge'):
+    """Метрика, которая вычисляется в момент опроса: samples - [(labels dict, значение)]."""
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        lines.append(f'{name}{_labels(labels.keys(), labels.values())} {value}')
+    return lines
+
+
+REQUESTS = Counter('http_requests_total', 'Запросы по роутам и кодам ответа',
+                   ('method', 'route', 'status'))
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Время обработки запроса',
+                             ('method', 'route'))
+IN_PROGRESS = Gauge('http_requests_in_progress', 'Запросы в обработке', ('method',))
+DB_STATEMENTS = Counter('db_statements_total', 'SQL-запросы по роутам', ('route',))
+DB_STATEMENT_SECONDS = Counter('db_statement_seconds_total', 'Суммарное время SQL-запросов по роутам', ('route',))
+POOL_CHECKOUT = Histogram('db_pool_checkout_seconds', 'Ожидание соединения из пула', ('pool',),
+                          buckets=POOL_BUCKETS)
+HASHING_DURATION = Histogram('hashing_duration_seconds', 'Хеширование и проверка паролей, с ожиданием в пуле',
+                             ('operation',), buckets=HASHING_BUCKETS)
+
+METRICS = [REQUESTS, REQUEST_DURATION, IN_PROGRESS, DB_STATEMENTS, DB_STATEMENT_SECONDS,
+           POOL_CHECKOUT, HASHING_DURATION]
+
+
+def _engines():
+    engines = {'sync': database.engine}
+    if database.async_engine is not None:
+        engines['async'] = database.async_engine.sync_engine
+    for replica in replicas.replicas:
+        engines[replica.name] = replica.sync_engine
+    return engines
+
+
+def _pool_name(pool):
+    for name, engine in _engines().items():
+        if engine.pool is pool:
+            return name
+    return 'async' if isinstance(pool, database.TimedAsyncQueuePool) else 'sync'
+
+
+def collect_pools():
+    samples = {'size': [], 'checked_out': [], 'overflow': []}
+    for name, engine in _engines().items():
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        samples['size'].append(({'pool': name}, pool.size()))
+        samples['checked_out'].append(({'pool': name}, pool.checkedout()))
+        samples['overflow'].append(({'pool': name}, pool.overflow()))
+    return [
+        *_family('db_pool_size', 'Постоянные соединения пула', samples['size']),
+        *_family('db_pool_checked_out', 'Выданные соединения', samples['checked_out']),
+        *_family('db_pool_overflow', 'Соединения сверх pool_size (отрицательное - ещё не открыты)',
+                       samples['overflow']),
+    ]
+
+
+def collect_response_cache():
+    stats = response_cache.stats()
+    return [
+        *_family('response_cache_requests_total', 'Обращения к кешу ответов',
+                 [({'result': key}, stats[key]) for key in ('hits', 'misses', 'not_modified')], kind='counter'),
+        *_family('response_cache_evictions_total', 'Вытесненные записи кеша ответов',
+                 [({}, stats['evictions'])], kind='counter'),
+        *_family('response_cache_expired_total', 'Записи кеша ответов, истёкшие по RESPONSE_CACHE_TTL',
+                 [({}, stats['expired'])], kind='counter'),
+        *_family('response_cache_entries', 'Записи в кеше ответов', [({}, stats['entries'])]),
+        *_family('response_cache_bytes', 'Размер кеша ответов', [({}, stats['bytes'])]),
+    ]
+
+
+def collect_view_counts():
+    stats = view_counter.stats()
+    return [
+        *_family('post_views_pending', 'Просмотры, ещё не записанные в БД', [({}, stats['pending'])]),
+        *_family('post_views_flushed_total', 'Просмотры, записанные в БД', [({}, stats['flushed'])], kind='counter'),
+        *_family('post_views_dropped_total', 'Просмотры, отброшенные из-за переполнения очереди',
+                 [({}, stats['dropped'])], kind='counter'),
+        *_family('post_views_flush_failures_total', 'Неудачные записи просмотров',
+                 [({}, stats['failures'])], kind='counter'),
+    ]
+
+
+def collect_related():
+    stats = related_updater.stats()
+    return [
+        *_family('related_posts_pending', 'Посты, ожидающие пересчёта похожих', [({}, stats['pending'])]),
+        *_family('related_posts_updated_total', 'Посты, чьи похожие пересчитаны', [({}, stats['updated'])],
+                 kind='counter'),
+        *_family('related_posts_update_failures_total', 'Неудачные пересчёты похожих постов',
+                 [({}, stats['failures'])], kind='counter'),
+    ]
+
+
+def collect_email_queue():
+    db = database.SessionLocal()
+    try:
+        rows = (db.query(EmailOutbox.status, func.count())
+                .filter(EmailOutbox.status.in_(['pending', 'failed']))
+                .group_by(EmailOutbox.status)
+                .all())
+    except SQLAlchemyError:
+        return []
+    finally:
+        db.close()
+    counts = {'pending': 0, 'failed': 0, **dict(rows)}
+    return _family('email_outbox_messages', 'Письма в outbox по статусам',
+                         [({'status': status}, count) for status, count in counts.items()])
+
+
+def collect_hashing():
+    return [
+        *_family('hashing_pending', 'Задачи хеширования в работе и в очереди', [({}, Hasher.pending)]),
+        *_family('hashing_rejected_total', 'Запросы, отклонённые из-за переполнения очереди хеширования',
+                 [({}, Hasher.rejected)], kind='counter'),
+    ]
+
+
+def collect_admission():
+    return [
+        *_family('admission_active', 'Запросы, допущенные к обработке, по классам',
+                 [({'class': name}, limiter.active) for name, limiter in limiters.items()]),
+        *_family('admission_queued', 'Запросы в очереди на допуск',
+                 [({'class': name}, limiter.queued) for name, limiter in limiters.items()]),
+        *_family('admission_rejected_total', 'Запросы, отклонённые с 503',
+                 [({'class': name}, limiter.rejected) for name, limiter in limiters.items()], kind='counter'),
+    ]
+
+
+COLLECTORS = [collect_admission, collect_pools, collect_hashing, collect_response_cache, collect_view_counts,
+              collect_related, collect_email_queue]
+
+
+def render():
+    lines = [line for metric in METRICS for line in metric.render()]
+    for collect in COLLECTORS:
+        lines.extend(collect())
+    return '\n'.join(lines) + '\n'
+
+
+def observe_pool_checkout(pool, seconds):
+    POOL_CHECKOUT.observe(seconds, (_pool_name(pool),))
+
+
+def observe_hashing(operation, seconds):
+    HASHING_DURATION.observe(seconds, (operation,))
+
+
+def install():
+    if observe_pool_checkout not in database.pool_checkout_observers:
+        database.pool_checkout_observers.append(observe_pool_checkout)
+    if observe_hashing not in Hasher.observers:
+        Hasher.observers.append(observe_hashing)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: время, код ответа и SQL-запросы каждого HTTP-запроса.
+
+    Роут берётся из шаблона пути (/posts/{slug}/), запросы мимо роутов
+    попадают в 'unmatched', чтобы число рядов метрик не росло.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        method = scope['method']
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        IN_PROGRESS.inc((method,))
+        started = time.perf_counter()
+        try:
+            with count_queries() as stats:
+                await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started
+            IN_PROGRESS.dec((method,))
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            REQUESTS.inc((method, route, status))
+            REQUEST_DURATION.observe(duration, (method, route))
+            if stats.count:
+                DB_STATEMENTS.inc((route,), stats.count)
+                DB_STATEMENT_SECONDS.inc((route,), stats.duration)
+
+
+router = APIRouter()
+
+
+@router.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    # Очередь писем считается запросом к БД, поэтому не в event loop
+    return PlainTextResponse(await run_in_threadpool(render), media_type=CONTENT_TYPE)
@@ -25,9 +25,21 @@ if config.config_file_name is not None:
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
+from app import settings
 from app.models import Base
 target_metadata = Base.metadata
 
+# search_vector и его индекс создаются DDL-ом из app.models и не описаны
+# в модели, autogenerate не должен пытаться их удалить.
+UNMAPPED_OBJECTS = {'search_vector', 'ix_posts_search_vector', 'posts_fts', 'backfill_progress',
+                    'ix_posts_slug_pattern',
+                    # служебные таблицы FTS5, которые SQLite создаёт вместе с posts_fts
+                    'posts_fts_data', 'posts_fts_idx', 'posts_fts_docsize', 'posts_fts_config'}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (reflected and name in UNMAPPED_OBJECTS)
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -49,6 +61,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=os.getenv('DATABASE_URL'),
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -71,8 +84,18 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            # DDL, не дождавшийся блокировки, падает, а не держит очередь из
+            # запросов приложения; ревизии могут менять таймауты (app/migrations/online.py)
+            with connection.begin():
+                connection.exec_driver_sql(f"SET lock_timeout = '{settings.MIGRATION_LOCK_TIMEOUT}'")
+                connection.exec_driver_sql(f"SET statement_timeout = '{settings.MIGRATION_STATEMENT_TIMEOUT}'")
+        # Своя транзакция у каждой ревизии: блокировки не копятся до конца
+        # всего upgrade, а autocommit_block (CONCURRENTLY, backfill) не
+        # фиксирует заодно чужие изменения
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata,
+            include_object=include_object, transaction_per_migration=True
         )
 
         with context.begin_transaction():
@@ -0,0 +1,235 @@
+"""Изменения схемы без простоя для больших таблиц.
+
+Правила для ревизий, которые трогают большие таблицы (posts, post_tags):
+
+* индексы - create_index_concurrently / drop_index_concurrently: на
+  PostgreSQL CONCURRENTLY не блокирует запись, но идёт вне транзакции,
+  поэтому env.py выполняет каждую ревизию в своей транзакции;
+* новая колонка - add_nullable_column (без NOT NULL и без DEFAULT,
+  который пришлось бы вычислять для каждой строки), заполнение -
+  backfill, NOT NULL - отдельной ревизией после заполнения;
+* DDL в транзакции ревизии ждёт блокировку не дольше lock_timeout
+  (MIGRATION_LOCK_TIMEOUT из env.py или set_timeouts в ревизии), иначе
+  ревизия падает, а не выстраивает за собой очередь из запросов
+  приложения - её можно просто запустить ещё раз;
+* backfill (и run_batches для прочих пакетных операций) идёт пачками по
+  диапазонам первичного ключа, каждая пачка - своя короткая транзакция
+  вместе с записью места остановки в таблицу backfill_progress, так что
+  прерванное заполнение продолжается с неё; downgrade таких ревизий
+  вызывает reset_progress.
+
+На SQLite все функции выполняют обычные операции.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from alembic import op
+
+from app import settings
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+PROGRESS_TABLE = sa.table('backfill_progress', sa.column('name'), sa.column('last_key'), sa.column('done'))
+PROGRESS_DDL = '''CREATE TABLE IF NOT EXISTS backfill_progress (
+    name VARCHAR(200) PRIMARY KEY,
+    last_key BIGINT NOT NULL,
+    done BOOLEAN NOT NULL DEFAULT FALSE
+)'''
+PROGRESS_INTERVAL = 5
+
+
+def _postgres():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def set_timeouts(lock=None, statement=None):
+    """Таймауты до конца транзакции текущей ревизии (SET LOCAL), например '3s' или '10min'."""
+    if not _postgres():
+        return
+    if lock is not None:
+        op.execute(sa.text(f"SET LOCAL lock_timeout = '{lock}'"))
+    if statement is not None:
+        op.execute(sa.text(f"SET LOCAL statement_timeout = '{statement}'"))
+
+
+@contextmanager
+def session_timeouts(lock=None, statement=None):
+    """Таймауты соединения внутри autocommit_block, где SET LOCAL не действует; потом прежние значения."""
+    conn = op.get_bind()
+    if conn.dialect.name != 'postgresql' or op.get_context().as_sql:
+        yield
+        return
+    values = {name: value for name, value in (('lock_timeout', lock), ('statement_timeout', statement))
+              if value is not None}
+    previous = {name: conn.exec_driver_sql(f'SHOW {name}').scalar() for name in values}
+    for name, value in values.items():
+        conn.exec_driver_sql(f"SET {name} = '{value}'")
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            conn.exec_driver_sql(f"SET {name} = '{value}'")
+
+
+def _index_valid(name):
+    """True/False для существующего индекса (False - недостроенный CONCURRENTLY), None - индекса нет."""
+    return op.get_bind().execute(sa.text(
+        'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name'
+    ), {'name': name}).scalar()
+
+
+def create_index_concurrently(name, table, columns, unique=False, **kw):
+    """CREATE INDEX CONCURRENTLY вне транзакции ревизии.
+
+    Построение может идти долго, поэтому statement_timeout снимается,
+    а lock_timeout остаётся: в начале и в конце CONCURRENTLY ждёт
+    завершения уже идущих транзакций. Если прошлая попытка прервалась,
+    от неё остаётся INVALID-индекс - он удаляется и строится заново.
+    """
+    if not _postgres():
+        op.create_index(name, table, columns, unique=unique, **kw)
+        return
+    with op.get_context().autocommit_block(), session_timeouts(statement='0'):
+        valid = None if op.get_context().as_sql else _index_valid(name)
+        if valid:
+            return
+        if valid is False:
+            logger.warning('Индекс %s остался недостроенным, строим заново', name)
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+        op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True, **kw)
+
+
+def drop_index_concurrently(name, table):
+    if not _postgres():
+        op.drop_index(name, table_name=table)
+        return
+    with op.get_context().autocommit_block(), session_timeouts(statement='0'):
+        op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+
+
+def add_nullable_column(table, column: sa.Column):
+    """ADD COLUMN без перезаписи таблицы: только NULL-колонка без значения по умолчанию."""
+    if not column.nullable or column.server_default is not None:
+        raise ValueError(f'{table}.{column.name}: NOT NULL и DEFAULT задаются после backfill отдельной ревизией')
+    op.add_column(table, column)
+
+
+def _progress(conn, name):
+    conn.exec_driver_sql(PROGRESS_DDL)
+    return conn.execute(sa.select(PROGRESS_TABLE.c.last_key, PROGRESS_TABLE.c.done)
+                        .where(PROGRESS_TABLE.c.name == name)).first()
+
+
+def _save_progress(conn, name, last_key, done=False):
+    updated = conn.execute(PROGRESS_TABLE.update().where(PROGRESS_TABLE.c.name == name)
+                           .values(last_key=last_key, done=done)).rowcount
+    if not updated:
+        conn.execute(PROGRESS_TABLE.insert().values(name=name, last_key=last_key, done=done))
+
+
+def log_progress(name, done, total, elapsed):
+    rate = done / elapsed if elapsed else 0
+    eta = (total - done) / rate if rate else 0
+    logger.info('%s: %d/%d ключей (%.0f%%), %.0f ключей/с, осталось ~%.0fs',
+                name, done, total, 100 * done / total if total else 100, rate, eta)
+
+
+@contextmanager
+def _batch_transaction(conn):
+    """Явная транзакция внутри autocommit_block: пачка и её прогресс фиксируются вместе."""
+    conn.exec_driver_sql('BEGIN')
+    try:
+        yield
+    except BaseException:
+        conn.exec_driver_sql('ROLLBACK')
+        raise
+    conn.exec_driver_sql('COMMIT')
+
+
+def reset_progress(name):
+    """Забывает сохранённый прогресс: для downgrade, иначе повторный upgrade счёл бы заполнение сделанным."""
+    if op.get_context().as_sql:
+        return
+    conn = op.get_bind()
+    conn.exec_driver_sql(PROGRESS_DDL)
+    conn.execute(PROGRESS_TABLE.delete().where(PROGRESS_TABLE.c.name == name))
+
+
+def run_batches(table, step, name, key='id', batch_size=None, rows_per_second=None, lock_timeout=None,
+                statement_timeout=None, report=log_progress, report_interval=PROGRESS_INTERVAL):
+    """Вызывает step(conn, low, high) для диапазонов ключа low < key <= high, каждый - отдельная транзакция.
+
+    Пачка и сохранение прогресса под именем name идут в одной
+    транзакции, поэтому прерванный запуск продолжается с первой
+    незафиксированной пачки и ни одну не выполняет дважды. step
+    возвращает число обработанных строк. rows_per_second ограничивает
+    скорость (по ключам), чтобы не забивать диск и реплики.
+    report(name, пройдено ключей, всего, секунд) вызывается не чаще раза
+    в report_interval секунд и после последней пачки.
+    Возвращает сумму результатов step.
+    """
+    if op.get_context().as_sql:
+        raise RuntimeError(f'{name}: пачки выполняются только online, alembic upgrade без --sql')
+    batch_size = batch_size or settings.BACKFILL_BATCH_SIZE
+    rows_per_second = rows_per_second if rows_per_second is not None else settings.BACKFILL_ROWS_PER_SECOND
+    target = sa.table(table, sa.column(key))
+    processed = 0
+    with op.get_context().autocommit_block(), \
+            session_timeouts(lock_timeout or settings.MIGRATION_LOCK_TIMEOUT,
+                             statement_timeout or settings.BACKFILL_STATEMENT_TIMEOUT):
+        conn = op.get_bind()
+        saved = _progress(conn, name)
+        if saved and saved.done:
+            logger.info('%s: уже заполнено', name)
+            return 0
+        low, high = conn.execute(sa.select(sa.func.min(target.c[key]), sa.func.max(target.c[key]))).first()
+        if high is None:
+            _save_progress(conn, name, 0, done=True)
+            return 0
+        start = saved.last_key if saved else low - 1
+        last, started, reported = start, time.monotonic(), 0.0
+        while True:
+            while last < high:
+                batch_started = time.monotonic()
+                upper = min(last + batch_size, high)
+                with _batch_transaction(conn):
+                    processed += step(conn, last, upper) or 0
+                    _save_progress(conn, name, upper)
+                last = upper
+                elapsed = time.monotonic() - started
+                if report and (elapsed - reported >= report_interval or last >= high):
+                    report(name, last - start, high - start, elapsed)
+                    reported = elapsed
+                if rows_per_second:
+                    time.sleep(max(0.0, batch_size / rows_per_second - (time.monotonic() - batch_started)))
+            # строки, вставленные, пока шла обработка
+            high = conn.execute(sa.select(sa.func.max(target.c[key]))).scalar()
+            if last >= high:
+                break
+        _save_progress(conn, name, last, done=True)
+    return processed
+
+
+def backfill(table, values, where=None, key='id', name=None, **kw):
+    """Заполняет колонки пачками по диапазонам ключа (run_batches), каждая пачка - отдельная транзакция.
+
+    values - {колонка: SQL-выражение}, where - SQL-условие строк, которые
+    ещё нужно заполнить (например 'slug IS NULL'). Прогресс сохраняется
+    под именем name (по умолчанию 'таблица:колонки'), и повторный запуск
+    продолжает с последней пачки. Остальные аргументы - как у run_batches.
+    Строки, вставленные во время заполнения, должно заполнять приложение.
+    Возвращает число обновлённых строк.
+    """
+    target = sa.table(table, sa.column(key), *(sa.column(column) for column in values))
+    assignments = {column: sa.text(expression) if isinstance(expression, str) else expression
+                   for column, expression in values.items()}
+
+    def step(conn, low, high):
+        stmt = target.update().where(target.c[key] > low, target.c[key] <= high).values(**assignments)
+        if where is not None:
+            stmt = stmt.where(sa.text(where) if isinstance(where, str) else where)
+        return conn.execute(stmt).rowcount
+
+    return run_batches(table, step, name or f'{table}:{",".join(values)}', key=key, **kw)
@@ -0,0 +1,55 @@
+"""Add posts search vector
+
+Revision ID: 3b8e1f6a2c47
+Revises: 15db44dc2fcc
+Create Date: 2026-10-18 10:12:41.208315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+from app.migrations.online import (add_nullable_column, backfill, create_index_concurrently,
+                                   drop_index_concurrently, reset_progress)
+from app.models import POSTGRES_SEARCH_TRIGGER_DDL, SEARCH_VECTOR, SQLITE_SEARCH_DDL
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e1f6a2c47'
+down_revision = '15db44dc2fcc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_DDL:
+            op.execute(statement)
+        # Индекс FTS5 по уже существующим постам, дальше его ведут триггеры
+        op.execute("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')")
+        return
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    add_nullable_column('posts', sa.Column('search_vector', TSVECTOR(), nullable=True))
+    # Новые и изменённые посты заполняет триггер, существующие - backfill
+    # пачками; пока он идёт, незаполненные посты просто не находятся поиском
+    for statement in POSTGRES_SEARCH_TRIGGER_DDL:
+        op.execute(statement)
+    backfill('posts', {'search_vector': SEARCH_VECTOR}, where='search_vector IS NULL')
+    # GIN строится вне транзакции ревизии и не блокирует запись в posts
+    create_index_concurrently('ix_posts_search_vector', 'posts', ['search_vector'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        for trigger in ('posts_fts_ai', 'posts_fts_ad', 'posts_fts_au'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute('DROP TABLE IF EXISTS posts_fts')
+        return
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    drop_index_concurrently('ix_posts_search_vector', 'posts')
+    op.execute('DROP TRIGGER IF EXISTS posts_search_vector ON posts')
+    op.execute('DROP FUNCTION IF EXISTS posts_search_vector()')
+    op.drop_column('posts', 'search_vector')
+    reset_progress('posts:search_vector')
@@ -0,0 +1,36 @@
+"""Add related posts
+
+Revision ID: 5e8c1b9a4d27
+Revises: f3a9d27c6b14
+Create Date: 2026-10-19 14:47:05.902615
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8c1b9a4d27'
+down_revision = 'f3a9d27c6b14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Таблица заполняется после миграции: python -m app.related (пересчёт
+    # всего корпуса держит блокировку posts, в ревизии ему не место)
+    op.create_table('related_posts',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('rank', sa.SmallInteger(), autoincrement=False, nullable=False),
+    sa.Column('related_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['related_id'], ['posts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('post_id', 'rank')
+    )
+    op.create_index('ix_related_posts_related_id', 'related_posts', ['related_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_related_posts_related_id', table_name='related_posts')
+    op.drop_table('related_posts')
@@ -0,0 +1,56 @@
+"""Normalize posts created_at to UTC
+
+Revision ID: 9a4f2c7e1d58
+Revises: 5e8c1b9a4d27
+Create Date: 2026-10-20 11:26:14.730952
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.migrations.online import backfill
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4f2c7e1d58'
+down_revision = '5e8c1b9a4d27'
+branch_labels = None
+depends_on = None
+
+PROGRESS = 'posts:created_at_utc'
+
+
+def _server_time_is_utc(conn):
+    # Зимнее и летнее смещение часового пояса сессии, чтобы не спутать UTC с зимним Лондоном
+    return conn.execute(sa.text(
+        "SELECT bool_and(moment AT TIME ZONE current_setting('TimeZone') = moment AT TIME ZONE 'UTC') "
+        "FROM (VALUES (timestamp '2000-01-15 12:00'), (timestamp '2000-07-15 12:00')) AS moments (moment)"
+    )).scalar()
+
+
+def upgrade() -> None:
+    # Раньше created_at по умолчанию был now() БД. На PostgreSQL колонка без
+    # часового пояса получала время в поясе сервера, теперь приложение пишет
+    # UTC (datetime.utcnow), и в ленте по (created_at, id) старые посты
+    # смешались бы с новыми. На SQLite CURRENT_TIMESTAMP - уже UTC, но без
+    # микросекунд, и такие строки сравниваются с курсором как текст неверно.
+    # Сдвиг не идемпотентен: пачка и её прогресс фиксируются вместе, а
+    # downgrade прогресс не сбрасывает, так что каждый пост сдвигается один раз
+    conn = op.get_bind()
+    if conn.dialect.name == 'sqlite':
+        op.execute("UPDATE posts SET created_at = created_at || '.000000' WHERE length(created_at) = 19")
+        return
+    if conn.dialect.name != 'postgresql' or op.get_context().as_sql or _server_time_is_utc(conn):
+        return
+    # Посты, вставленные после начала миграции, не трогаются: их может
+    # создавать уже новая версия приложения, в UTC
+    last_id = conn.execute(sa.text('SELECT max(id) FROM posts')).scalar()
+    if last_id is None:
+        return
+    backfill('posts', {'created_at': "(created_at AT TIME ZONE current_setting('TimeZone')) AT TIME ZONE 'UTC'"},
+             where=f'id <= {last_id}', name=PROGRESS)
+
+
+def downgrade() -> None:
+    # Время в UTC правильно и для прежней версии приложения, возвращать нечего
+    pass
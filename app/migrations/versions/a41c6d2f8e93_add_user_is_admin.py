@@ -0,0 +1,24 @@
+"""Add users.is_admin
+
+Revision ID: a41c6d2f8e93
+Revises: 7d2a9c4e5b10
+Create Date: 2026-10-18 18:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41c6d2f8e93'
+down_revision = '7d2a9c4e5b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('is_admin', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'is_admin')
@@ -0,0 +1,32 @@
+"""Add posts slug pattern index
+
+Revision ID: b6d3e8f2a915
+Revises: 9a4f2c7e1d58
+Create Date: 2026-10-20 15:02:37.418206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.migrations.online import create_index_concurrently, drop_index_concurrently
+from app.models import POSTGRES_SLUG_PATTERN_INDEX
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d3e8f2a915'
+down_revision = '9a4f2c7e1d58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Нужен только PostgreSQL: SQLite ищет слаги с суффиксом диапазоном по ix_posts_slug
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    create_index_concurrently(POSTGRES_SLUG_PATTERN_INDEX, 'posts', [sa.text('slug varchar_pattern_ops')])
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    drop_index_concurrently(POSTGRES_SLUG_PATTERN_INDEX, 'posts')
@@ -0,0 +1,70 @@
+"""Add facet counters
+
+Revision ID: c8f3b2d71e05
+Revises: a41c6d2f8e93
+Create Date: 2026-10-18 21:04:51.337120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.migrations.online import reset_progress, run_batches
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8f3b2d71e05'
+down_revision = 'a41c6d2f8e93'
+branch_labels = None
+depends_on = None
+
+
+PROGRESS = 'posts:facet_counters'
+
+
+def count_posts(conn, low, high):
+    """Прибавляет к счётчикам посты с low < id <= high."""
+    params = {'low': low, 'high': high}
+    conn.execute(sa.text(
+        'UPDATE categories SET posts_count = posts_count + (SELECT count(*) FROM posts '
+        'WHERE posts.category_id = categories.slug AND posts.id > :low AND posts.id <= :high) '
+        'WHERE slug IN (SELECT category_id FROM posts WHERE id > :low AND id <= :high)'), params)
+    conn.execute(sa.text(
+        'UPDATE tags SET posts_count = posts_count + (SELECT count(*) FROM post_tags '
+        'WHERE post_tags.tag_id = tags.slug AND post_tags.post_id > :low AND post_tags.post_id <= :high) '
+        'WHERE slug IN (SELECT tag_id FROM post_tags WHERE post_id > :low AND post_id <= :high)'), params)
+    conn.execute(sa.text(
+        'INSERT INTO category_tag_counts (category_id, tag_id, posts_count) '
+        'SELECT posts.category_id, post_tags.tag_id, count(*) FROM posts '
+        'JOIN post_tags ON post_tags.post_id = posts.id '
+        'WHERE posts.category_id IS NOT NULL AND posts.id > :low AND posts.id <= :high '
+        'GROUP BY posts.category_id, post_tags.tag_id '
+        'ON CONFLICT (category_id, tag_id) DO UPDATE '
+        'SET posts_count = category_tag_counts.posts_count + excluded.posts_count'), params)
+
+
+def upgrade() -> None:
+    # categories и tags - небольшие справочники, а ADD COLUMN с постоянным
+    # DEFAULT на PostgreSQL 11+ таблицу не перезаписывает, поэтому здесь
+    # сразу NOT NULL DEFAULT 0 вместо add_nullable_column
+    op.add_column('categories', sa.Column('posts_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('tags', sa.Column('posts_count', sa.Integer(), server_default='0', nullable=False))
+    op.create_table('category_tag_counts',
+    sa.Column('category_id', sa.String(length=50), nullable=False),
+    sa.Column('tag_id', sa.String(length=50), nullable=False),
+    sa.Column('posts_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.slug'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.slug'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('category_id', 'tag_id')
+    )
+    # Начальные значения - пачками по id постов, каждая пачка в своей
+    # транзакции вместе с прогрессом; дальше счётчики поддерживает
+    # app/facets.py. Посты, изменённые прежней версией приложения во время
+    # заполнения, поправит python -m app.facets
+    run_batches('posts', count_posts, PROGRESS)
+
+
+def downgrade() -> None:
+    op.drop_table('category_tag_counts')
+    op.drop_column('tags', 'posts_count')
+    op.drop_column('categories', 'posts_count')
+    reset_progress(PROGRESS)
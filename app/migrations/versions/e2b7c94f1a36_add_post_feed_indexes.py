@@ -0,0 +1,34 @@
+"""Add post feed indexes
+
+Revision ID: e2b7c94f1a36
+Revises: c8f3b2d71e05
+Create Date: 2026-10-18 22:31:08.520417
+
+"""
+import sqlalchemy as sa
+
+from app.migrations.online import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7c94f1a36'
+down_revision = 'c8f3b2d71e05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    create_index_concurrently('ix_posts_created_at_id', 'posts',
+                              [sa.text('created_at DESC'), sa.text('id DESC')])
+    create_index_concurrently('ix_posts_category_id_created_at_id', 'posts',
+                              ['category_id', sa.text('created_at DESC'), sa.text('id DESC')])
+    create_index_concurrently('ix_posts_author_id_created_at_id', 'posts',
+                              ['author_id', sa.text('created_at DESC'), sa.text('id DESC')])
+    create_index_concurrently('ix_post_tags_tag_id_post_id', 'post_tags', ['tag_id', 'post_id'])
+
+
+def downgrade() -> None:
+    drop_index_concurrently('ix_post_tags_tag_id_post_id', 'post_tags')
+    drop_index_concurrently('ix_posts_author_id_created_at_id', 'posts')
+    drop_index_concurrently('ix_posts_category_id_created_at_id', 'posts')
+    drop_index_concurrently('ix_posts_created_at_id', 'posts')
@@ -0,0 +1,33 @@
+"""Add post views
+
+Revision ID: f3a9d27c6b14
+Revises: e2b7c94f1a36
+Create Date: 2026-10-19 10:12:40.118350
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d27c6b14'
+down_revision = 'e2b7c94f1a36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Новая пустая таблица: блокировки posts не нужны, индекс строится сразу
+    op.create_table('post_views',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('views', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('post_id')
+    )
+    op.create_index('ix_post_views_views_post_id', 'post_views',
+                    [sa.text('views DESC'), sa.text('post_id DESC')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_post_views_views_post_id', table_name='post_views')
+    op.drop_table('post_views')
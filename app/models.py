@@ -1,9 +1,13 @@
+from datetime import datetime
+
 import sqlalchemy as sa
 from sqlalchemy import Table
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import column_property, relationship, query_expression
 
 from .database import Base
 
+EXCERPT_LENGTH = 200
+
 
 class User(Base):
     id = sa.Column(sa.Integer, primary_key=True)
@@ -11,6 +15,7 @@ class User(Base):
     name = sa.Column(sa.String(30))
     password = sa.Column(sa.String())
     is_active = sa.Column(sa.Boolean, default=False)
+    is_admin = sa.Column(sa.Boolean, default=False, server_default=sa.false(), nullable=False)
     activation_code = sa.Column(sa.String(8), default='')
     posts = relationship("Post", back_populates="author")
 
@@ -27,6 +32,8 @@ class Category(Base):
     title = sa.Column(sa.String(50), unique=True)
     slug = sa.Column(sa.String(50), primary_key=True)
     posts = relationship("Post", back_populates="category")
+    # Поддерживается app/facets.py
+    posts_count = sa.Column(sa.Integer, default=0, server_default='0', nullable=False)
 
     __tablename__ = 'categories'
 
@@ -42,6 +49,8 @@ through_table = Table(
     Base.metadata,
     sa.Column('post_id', sa.ForeignKey('posts.id'), primary_key=True),
     sa.Column('tag_id', sa.ForeignKey('tags.slug'), primary_key=True),
+    # Посты тега: первичный ключ (post_id, tag_id) годится только для тегов поста
+    sa.Index('ix_post_tags_tag_id_post_id', 'tag_id', 'post_id'),
 )
 
 
@@ -51,6 +60,8 @@ class Tag(Base):
     posts = relationship('Post',
                          secondary=through_table,
                          back_populates='tags')
+    # Поддерживается app/facets.py
+    posts_count = sa.Column(sa.Integer, default=0, server_default='0', nullable=False)
 
     __tablename__ = 'tags'
 
@@ -61,6 +72,42 @@ class Tag(Base):
         return self.title
 
 
+# Число постов категории с каждым тегом - для тегов в фильтре по категории
+category_tag_counts = Table(
+    'category_tag_counts',
+    Base.metadata,
+    sa.Column('category_id', sa.ForeignKey('categories.slug', ondelete='CASCADE'), primary_key=True),
+    sa.Column('tag_id', sa.ForeignKey('tags.slug', ondelete='CASCADE'), primary_key=True),
+    sa.Column('posts_count', sa.Integer, nullable=False),
+)
+
+
+# Просмотры постов копятся в памяти и записываются пачками (app/view_counts.py).
+# Отдельная узкая таблица: обновление posts пересчитывало бы search_vector
+# и блокировало строку поста для его редактирования.
+post_views = Table(
+    'post_views',
+    Base.metadata,
+    sa.Column('post_id', sa.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True),
+    sa.Column('views', sa.Integer, nullable=False),
+    # Самые просматриваемые посты
+    sa.Index('ix_post_views_views_post_id', sa.desc('views'), sa.desc('post_id')),
+)
+
+
+# Похожие посты, заранее посчитанные app/related.py: rank - место в списке поста
+related_posts = Table(
+    'related_posts',
+    Base.metadata,
+    sa.Column('post_id', sa.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True),
+    sa.Column('rank', sa.SmallInteger, primary_key=True, autoincrement=False),
+    sa.Column('related_id', sa.ForeignKey('posts.id', ondelete='CASCADE'), nullable=False),
+    sa.Column('score', sa.Float, nullable=False),
+    # Посты, в чьих списках есть изменённый пост
+    sa.Index('ix_related_posts_related_id', 'related_id'),
+)
+
+
 class Post(Base):
     id = sa.Column(sa.Integer, primary_key=True)
     title = sa.Column(sa.String(100), unique=True)
@@ -72,13 +119,29 @@ class Post(Base):
     author_id = sa.Column(sa.Integer,
                           sa.ForeignKey("users.id"))
     author = relationship("User", back_populates="posts")
+    # Значение из приложения в UTC, а не now() БД: на SQLite CURRENT_TIMESTAMP
+    # хранится без микросекунд, и сравнение с курсором (created_at, id)
+    # ломается, а на PostgreSQL now() в колонке без часового пояса - время
+    # в поясе сервера. Старые строки приводит к UTC миграция 9a4f2c7e1d58
     created_at = sa.Column(sa.DateTime,
-                           default=sa.sql.func.now())
+                           default=datetime.utcnow)
     tags = relationship('Tag',
                         secondary=through_table,
                         back_populates='posts')
+    snippet = query_expression()
+    excerpt = column_property(sa.func.substr(text, 1, EXCERPT_LENGTH), deferred=True)
+    views = column_property(sa.func.coalesce(sa.select(post_views.c.views)
+                                             .where(post_views.c.post_id == id)
+                                             .correlate_except(post_views)
+                                             .scalar_subquery(), 0), deferred=True)
 
     __tablename__ = 'posts'
+    # Ленты в порядке ключа (created_at, id): общая, по категории и по автору
+    __table_args__ = (
+        sa.Index('ix_posts_created_at_id', created_at.desc(), id.desc()),
+        sa.Index('ix_posts_category_id_created_at_id', category_id, created_at.desc(), id.desc()),
+        sa.Index('ix_posts_author_id_created_at_id', author_id, created_at.desc(), id.desc()),
+    )
 
     def __str__(self):
         return self.title
@@ -87,6 +150,93 @@ class Post(Base):
         return self.title
 
 
+class EmailOutbox(Base):
+    id = sa.Column(sa.Integer, primary_key=True)
+    recipient = sa.Column(sa.String(50))
+    subject = sa.Column(sa.String(255))
+    body = sa.Column(sa.Text())
+    status = sa.Column(sa.String(10), default='pending')
+    attempts = sa.Column(sa.Integer, default=0)
+    next_attempt_at = sa.Column(sa.DateTime, default=datetime.utcnow)
+    last_error = sa.Column(sa.Text())
+    created_at = sa.Column(sa.DateTime,
+                           default=sa.sql.func.now())
+    sent_at = sa.Column(sa.DateTime)
+
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        sa.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    def __str__(self):
+        return f'{self.recipient}: {self.subject}'
+
+    def __repr__(self):
+        return f'{self.recipient}: {self.subject}'
+
+
+# Полнотекстовый поиск по постам. На PostgreSQL - колонка search_vector с
+# GIN-индексом, которую заполняет триггер, на SQLite - FTS5-таблица
+# posts_fts, которую тоже поддерживают триггеры; и то и другое создаёт
+# миграция 3b8e1f6a2c47 (для БД из create_all - события ниже). В модели
+# колонка не описана, запросы к ней строятся в app/search.py.
+SEARCH_CONFIG = 'russian'
+
+
+def _search_vector(row=''):
+    return (f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce({row}title, '')), 'A') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce({row}text, '')), 'B')")
+
+
+# Значение для существующих строк (backfill в миграции)
+SEARCH_VECTOR = _search_vector()
+# Обычная колонка, которую ведёт триггер, а не GENERATED ... STORED:
+# добавление генерируемой колонки перезаписывает всю таблицу под блокировкой
+POSTGRES_SEARCH_TRIGGER_DDL = [
+    f"""CREATE OR REPLACE FUNCTION posts_search_vector() RETURNS trigger AS $$
+       BEGIN
+           NEW.search_vector := {_search_vector('NEW.')};
+           RETURN NEW;
+       END
+       $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER posts_search_vector BEFORE INSERT OR UPDATE OF title, text ON posts
+       FOR EACH ROW EXECUTE FUNCTION posts_search_vector()""",
+]
+POSTGRES_SEARCH_DDL = [
+    'ALTER TABLE posts ADD COLUMN search_vector tsvector',
+    *POSTGRES_SEARCH_TRIGGER_DDL,
+    'CREATE INDEX ix_posts_search_vector ON posts USING gin (search_vector)',
+]
+
+SQLITE_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE posts_fts USING fts5(
+           title, text, content='posts', content_rowid='id', tokenize='unicode61')""",
+    """CREATE TRIGGER posts_fts_ai AFTER INSERT ON posts BEGIN
+           INSERT INTO posts_fts(rowid, title, text) VALUES (new.id, new.title, new.text);
+       END""",
+    """CREATE TRIGGER posts_fts_ad AFTER DELETE ON posts BEGIN
+           INSERT INTO posts_fts(posts_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+       END""",
+    """CREATE TRIGGER posts_fts_au AFTER UPDATE OF title, text ON posts BEGIN
+           INSERT INTO posts_fts(posts_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+           INSERT INTO posts_fts(rowid, title, text) VALUES (new.id, new.title, new.text);
+       END""",
+]
+
+for statement in POSTGRES_SEARCH_DDL:
+    sa.event.listen(Post.__table__, 'after_create', sa.DDL(statement).execute_if(dialect='postgresql'))
+for statement in SQLITE_SEARCH_DDL:
+    sa.event.listen(Post.__table__, 'after_create', sa.DDL(statement).execute_if(dialect='sqlite'))
+sa.event.listen(Post.__table__, 'before_drop', sa.DDL('DROP TABLE IF EXISTS posts_fts').execute_if(dialect='sqlite'))
+
+# Слаги с суффиксом (crud.free_slug) ищутся через LIKE 'слаг-%': ix_posts_slug
+# для этого годится только при collation "C", индекс с varchar_pattern_ops -
+# при любой. На SQLite тот же поиск идёт диапазоном по ix_posts_slug
+POSTGRES_SLUG_PATTERN_INDEX = 'ix_posts_slug_pattern'
+sa.event.listen(Post.__table__, 'after_create', sa.DDL(
+    f'CREATE INDEX {POSTGRES_SLUG_PATTERN_INDEX} ON posts (slug varchar_pattern_ops)').execute_if(dialect='postgresql'))
+
+
 def get_random_string(length):
     import random
     import string
@@ -0,0 +1,191 @@
+import base64
+import binascii
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import sqlalchemy as sa
+from fastapi import HTTPException
+from fastapi_pagination import Params
+from sqlalchemy.orm import Query
+
+from app import settings
+from app.schemas import CursorPage
+
+
+class Keyset:
+    """Порядок сортировки, по которому строятся курсоры.
+
+    Все колонки сортируются в одном направлении, последняя колонка
+    должна быть уникальной (обычно первичный ключ). Имя попадает в
+    курсор, чтобы курсор одной сортировки не применили к другой.
+    """
+
+    def __init__(self, *columns, descending=True, name='newest'):
+        self.columns = columns
+        self.descending = descending
+        self.name = name
+
+    def order_by(self, reverse=False):
+        descending = self.descending != reverse
+        return [col.desc() if descending else col.asc() for col in self.columns]
+
+    def after(self, values, reverse=False):
+        key = sa.tuple_(*self.columns)
+        descending = self.descending != reverse
+        return key < tuple(values) if descending else key > tuple(values)
+
+    def values(self, obj):
+        return [getattr(obj, col.key) for col in self.columns]
+
+    def encode(self, obj, direction):
+        values = [v.isoformat() if isinstance(v, datetime) else v for v in self.values(obj)]
+        raw = json.dumps({'k': self.name, 'd': direction, 'v': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            data = json.loads(raw)
+            direction, values = data['d'], data['v']
+            # курсоры без 'k' выданы до появления сортировок - по created_at, id
+            if data.get('k', 'newest') != self.name:
+                raise HTTPException(status_code=400, detail='Курсор выдан для другой сортировки')
+            if direction not in ('next', 'prev') or len(values) != len(self.columns):
+                raise ValueError(cursor)
+            return direction, [
+                datetime.fromisoformat(v) if isinstance(col.type, sa.DateTime) else v
+                for col, v in zip(self.columns, values)
+            ]
+        except (binascii.Error, ValueError, KeyError, TypeError, AttributeError):
+            raise HTTPException(status_code=400, detail='Неверный курсор')
+
+
+class CountCache:
+    """Точные COUNT(*) по тексту запроса и параметрам, живут COUNT_CACHE_TTL секунд."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, query: Query):
+        compiled = query.statement.compile(dialect=query.session.get_bind().dialect)
+        key = (str(compiled), repr(sorted(compiled.params.items())))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        total = query.count()
+        with self._lock:
+            self._counts[key] = (total, now + self.ttl)
+            self._counts.move_to_end(key)
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return total
+
+
+count_cache = CountCache(settings.COUNT_CACHE_TTL, settings.COUNT_CACHE_SIZE)
+
+
+def planner_estimate(query: Query):
+    """Оценка числа строк от планировщика PostgreSQL, None - если оценки нет.
+
+    Без фильтров это reltuples таблицы из pg_class, с фильтрами - число
+    строк верхнего узла EXPLAIN. Оценка тем точнее, чем свежее ANALYZE.
+    """
+    connection = query.session.connection()
+    statement = query.statement
+    if statement.whereclause is None:
+        table = query.column_descriptions[0]['entity'].__table__.name
+        estimate = connection.execute(sa.text('SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table)'),
+                                      {'table': table}).scalar()
+    else:
+        compiled = statement.compile(dialect=connection.dialect)
+        parameters = compiled.params
+        if compiled.positional:
+            parameters = tuple(parameters[name] for name in compiled.positiontup)
+        plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', parameters).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = plan[0]['Plan']['Plan Rows']
+    # reltuples = -1: таблицу ещё не анализировали
+    return int(estimate) if estimate is not None and estimate >= 0 else None
+
+
+def estimate_count(query: Query):
+    query = query.order_by(None)
+    estimate = None
+    if query.session.get_bind().dialect.name == 'postgresql':
+        estimate = planner_estimate(query)
+    return count_cache.count(query) if estimate is None else estimate
+
+
+def paginate_offset(query: Query, params: Params, keyset: Keyset, rank=None, total_mode='exact') -> CursorPage:
+    """LIMIT/OFFSET на стороне БД, плюс курсоры для перехода в keyset-режим.
+
+    Если передан `rank`, сортировка идёт по релевантности, и курсоры
+    не выдаются - keyset-порядок с ней не совпадает.
+
+    `total_mode`: exact - COUNT(*) на каждой странице, estimated - оценка
+    (estimate_count), none - без total. Кроме exact, следующая страница
+    определяется по лишней строке (LIMIT size + 1), а не по total.
+    """
+    raw = params.to_raw_params()
+    order_by = keyset.order_by() if rank is None else [rank, *keyset.order_by()]
+    exact = total_mode == 'exact'
+    total = query.order_by(None).count() if exact else None
+    rows = query.order_by(*order_by).offset(raw.offset).limit(raw.limit + (not exact)).all()
+    items = rows[:raw.limit]
+    if exact:
+        has_next = raw.offset + len(items) < total
+    else:
+        has_next = len(rows) > raw.limit
+    if total_mode == 'estimated':
+        if not has_next and (items or not raw.offset):
+            # последняя страница: total известен точно
+            total = raw.offset + len(items)
+        else:
+            # оценка не должна противоречить тому, что видно на странице
+            estimate = estimate_count(query)
+            total = max(estimate, raw.offset + len(items) + 1) if items else min(estimate, raw.offset)
+    return CursorPage(
+        items=items,
+        total=total,
+        page=params.page,
+        size=params.size,
+        next_cursor=keyset.encode(items[-1], 'next') if items and has_next and rank is None else None,
+        prev_cursor=keyset.encode(items[0], 'prev') if items and params.page > 1 and rank is None else None,
+        has_next=has_next,
+        total_mode=total_mode,
+    )
+
+
+def paginate_cursor(query: Query, params: Params, keyset: Keyset, cursor: str) -> CursorPage:
+    """Keyset-пагинация: стоимость страницы не зависит от её глубины."""
+    direction, values = keyset.decode(cursor)
+    reverse = direction == 'prev'
+    rows = (query.filter(keyset.after(values, reverse=reverse))
+            .order_by(*keyset.order_by(reverse=reverse))
+            .limit(params.size + 1)
+            .all())
+    has_more = len(rows) > params.size
+    items = rows[:params.size]
+    if reverse:
+        items.reverse()
+    has_next = has_more if not reverse else True
+    has_prev = has_more if reverse else True
+    return CursorPage(
+        items=items,
+        total=None,
+        page=params.page,
+        size=params.size,
+        next_cursor=keyset.encode(items[-1], 'next') if items and has_next else None,
+        prev_cursor=keyset.encode(items[0], 'prev') if items and has_prev else None,
+        has_next=has_next,
+        total_mode='none',
+    )
@@ -0,0 +1,69 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+_current_stats = contextvars.ContextVar('query_stats', default=None)
+
+
+def current_stats():
+    return _current_stats.get()
+
+
+@contextmanager
+def count_queries():
+    """Считает SQL-запросы внутри блока, в том числе в threadpool и run_sync.
+
+        with count_queries() as stats:
+            crud.list_posts(db, params)
+        assert stats.count == 3
+
+    Вложенные блоки тоже учитываются во внешнем.
+    """
+    parent = _current_stats.get()
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+        if parent is not None:
+            parent.count += stats.count
+            parent.duration += stats.duration
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Время начала - в контексте выполнения, а не в conn.info: после ошибки запроса
+    # after_cursor_execute не вызывается, и запись осталась бы на соединении в пуле
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    if stats is not None:
+        finished = time.perf_counter()
+        stats.count += 1
+        stats.duration += finished - getattr(context, '_query_start', finished)
+
+
+def install(engine):
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+async def query_count_middleware(request, call_next):
+    """В режиме DEBUG отдаёт число и время запросов к БД в заголовках ответа."""
+    with count_queries() as stats:
+        response = await call_next(request)
+    response.headers['X-Query-Count'] = str(stats.count)
+    response.headers['X-Query-Time'] = f'{stats.duration * 1000:.2f}ms'
+    return response
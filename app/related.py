@@ -0,0 +1,354 @@
+"""Похожие посты: заранее посчитанные соседи по общим тегам.
+
+Похожесть двух постов - коэффициент Жаккара по их тегам (общие теги,
+делённые на все теги обоих постов), у постов одной категории он
+умножается на 1 + RELATED_CATEGORY_BOOST. Для каждого поста в
+related_posts хранятся RELATED_POSTS_LIMIT самых похожих, и
+/posts/{slug}/related/ читает их одним запросом по первичному ключу.
+
+Когда у постов меняются теги или категория (роуты, админка, импорт),
+их id после коммита попадают в очередь процесса, и фоновая задача раз
+в RELATED_UPDATE_INTERVAL секунд отдельной транзакцией пересчитывает
+списки этих постов, постов, в чьих списках они были, и постов, в чьи
+списки они теперь попадают. Запрос, изменивший посты, пересчёта не
+ждёт, а импорт пересчитывает всю пачку один раз. До пересчёта списки
+отстают на RELATED_UPDATE_INTERVAL секунд; при падении процесса очередь
+теряется, и списки этих постов остаются старыми до следующего изменения
+или полного пересчёта. Весь корпус пересчитывает
+
+    python -m app.related
+
+через разреженное произведение матрицы пост x тег на себя (numpy и
+scipy, без них - теми же запросами, что и при инкрементальном
+обновлении, только дольше).
+"""
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import settings
+from app.database import engine
+from app.facets import changed_posts
+from app.models import Category, Post, Tag, related_posts, through_table
+
+CHUNK = 500
+# Посты, соседи которых при пересчёте без numpy держатся в памяти одновременно
+REBUILD_CHUNK = 100
+INSERT_BATCH = 10000
+
+logger = logging.getLogger(__name__)
+
+
+def _chunks(ids, size=CHUNK):
+    ids = sorted(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def score(shared, size, other_size, same_category, boost):
+    jaccard = shared / (size + other_size - shared)
+    return jaccard * (1 + boost) if same_category else jaccard
+
+
+def _posts_info(db, ids):
+    """{id: (категория, число тегов)}"""
+    info = {}
+    for chunk in _chunks(ids):
+        sizes = dict(db.execute(sa.select(through_table.c.post_id, sa.func.count())
+                                .where(through_table.c.post_id.in_(chunk))
+                                .group_by(through_table.c.post_id)).all())
+        for post_id, category in db.execute(sa.select(Post.id, Post.category_id).where(Post.id.in_(chunk))):
+            info[post_id] = (category, sizes.get(post_id, 0))
+    return info
+
+
+def neighbours(db, ids, boost):
+    """Все посты с общими тегами и их похожесть: {id: {сосед: похожесть}}."""
+    mine, other = through_table.alias('mine'), through_table.alias('other')
+    shared = defaultdict(dict)
+    for chunk in _chunks(ids):
+        shared.update(((post_id, {}) for post_id in chunk))
+        for post_id, other_id, count in db.execute(
+                sa.select(mine.c.post_id, other.c.post_id, sa.func.count())
+                .join(other, sa.and_(other.c.tag_id == mine.c.tag_id, other.c.post_id != mine.c.post_id))
+                .where(mine.c.post_id.in_(chunk))
+                .group_by(mine.c.post_id, other.c.post_id)):
+            shared[post_id][other_id] = count
+    info = _posts_info(db, set(shared).union(*shared.values()))
+    result = {}
+    for post_id, counts in shared.items():
+        if post_id not in info:
+            continue
+        category, size = info[post_id]
+        result[post_id] = {
+            other_id: score(count, size, info[other_id][1], category is not None and info[other_id][0] == category,
+                            boost)
+            for other_id, count in counts.items() if other_id in info
+        }
+    return result
+
+
+def top(scores, limit):
+    """Лучшие соседи: по убыванию похожести, при равной - сначала более новые посты."""
+    best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+    return [(other_id, value) for other_id, value in best]
+
+
+def _insert(db, rows):
+    for start in range(0, len(rows), INSERT_BATCH):
+        db.execute(related_posts.insert(), rows[start:start + INSERT_BATCH])
+
+
+def _write(db, lists):
+    """Заменяет списки постов: {id: [(сосед, похожесть)]}."""
+    for chunk in _chunks(lists):
+        db.execute(related_posts.delete().where(related_posts.c.post_id.in_(chunk)))
+    _insert(db, [{'post_id': post_id, 'rank': rank, 'related_id': other_id, 'score': value}
+                 for post_id, items in sorted(lists.items()) for rank, (other_id, value) in enumerate(items)])
+
+
+def update(db, changed, deleted=(), stale=(), limit=None, boost=None):
+    """Обновляет списки после изменения тегов или категорий постов changed и удаления deleted.
+
+    Списки самих постов и постов, в чьих списках они были (похожесть
+    изменилась или пост удалён), считаются заново. В списки остальных
+    соседей изменённые посты только вставляются, если проходят по
+    похожести: прочие элементы этих списков не менялись. stale - посты,
+    в чьих списках были удалённые, если эти строки уже удалил
+    ON DELETE CASCADE.
+    """
+    limit = limit or settings.RELATED_POSTS_LIMIT
+    boost = settings.RELATED_CATEGORY_BOOST if boost is None else boost
+    deleted = set(deleted)
+    changed = set(changed) - deleted
+    if not changed and not deleted:
+        return
+    stale = set(stale)
+    for chunk in _chunks(changed | deleted):
+        stale.update(post_id for post_id, in db.execute(sa.select(related_posts.c.post_id)
+                                                         .where(related_posts.c.related_id.in_(chunk))))
+    stale -= changed | deleted
+    scores = neighbours(db, changed, boost)
+    incoming = defaultdict(dict)
+    for post_id, others in scores.items():
+        for other_id, value in others.items():
+            if other_id not in changed and other_id not in stale:
+                incoming[other_id][post_id] = value
+    scores.update(neighbours(db, stale, boost))
+    lists = {post_id: top(others, limit) for post_id, others in scores.items()}
+    for chunk in _chunks(incoming):
+        current = defaultdict(dict)
+        for post_id, other_id, value in db.execute(
+                sa.select(related_posts.c.post_id, related_posts.c.related_id, related_posts.c.score)
+                .where(related_posts.c.post_id.in_(chunk))):
+            current[post_id][other_id] = value
+        for post_id in chunk:
+            before = top(current[post_id], limit)
+            after = top({**current[post_id], **incoming[post_id]}, limit)
+            if after != before:
+                lists[post_id] = after
+    lists.update((post_id, []) for post_id in deleted)
+    _write(db, lists)
+
+
+class RelatedUpdater:
+    """Очередь постов, чьи списки нужно пересчитать, и фоновая задача пересчёта."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.updated = 0
+        self.failures = 0
+        self._changed, self._deleted, self._stale = set(), set(), set()
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self._task = None
+
+    @property
+    def pending(self):
+        return len(self._changed) + len(self._deleted) + len(self._stale)
+
+    def add(self, changed=(), deleted=(), stale=()):
+        with self._lock:
+            deleted = set(deleted)
+            # SQLite может отдать id удалённого поста новому
+            self._changed = (self._changed - deleted) | (set(changed) - deleted)
+            self._deleted |= deleted
+            self._stale |= set(stale)
+
+    def _take(self):
+        with self._lock:
+            queued = self._changed, self._deleted, self._stale
+            self._changed, self._deleted, self._stale = set(), set(), set()
+        return queued
+
+    def flush(self):
+        """Пересчитывает списки постов из очереди; при ошибке возвращает их в очередь."""
+        with self._update_lock:
+            changed, deleted, stale = self._take()
+            if not changed and not deleted and not stale:
+                return 0
+            try:
+                with engine.begin() as conn:
+                    update(conn, changed, deleted, stale)
+            except Exception as error:
+                # Например, параллельный пересчёт тех же списков в другом процессе
+                self.failures += 1
+                self.add(changed, deleted, stale)
+                logger.warning('Не удалось пересчитать похожие посты (%d постов): %s',
+                               len(changed | deleted | stale), error)
+                return 0
+            total = len(changed | deleted | stale)
+            self.updated += total
+            return total
+
+    async def _update_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await run_in_threadpool(self.flush)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._update_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await run_in_threadpool(self.flush)
+
+    def stats(self):
+        return {'pending': self.pending, 'updated': self.updated, 'failures': self.failures}
+
+
+related_updater = RelatedUpdater(settings.RELATED_UPDATE_INTERVAL)
+
+
+def queue(session, changed=(), deleted=(), stale=()):
+    """Запоминает посты для пересчёта; в очередь они попадут после коммита session."""
+    pending = session.info.setdefault('related_changes', (set(), set(), set()))
+    for ids, values in zip(pending, (changed, deleted, stale)):
+        ids.update(values)
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_related_changes(session, flush_context, instances):
+    posts = changed_posts(session)
+    removed_tags = [obj.slug for obj in session.deleted if isinstance(obj, Tag)]
+    removed_categories = [obj.slug for obj in session.deleted if isinstance(obj, Category)]
+    # После flush строк удалённых тегов и постов уже не будет, их посты запоминаются сейчас
+    ids, stale = set(), set()
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Post)]
+    if deleted:
+        stale.update(post_id for post_id, in session.execute(
+            sa.select(related_posts.c.post_id).where(related_posts.c.related_id.in_(deleted))))
+    if removed_tags:
+        ids.update(post_id for post_id, in session.execute(
+            sa.select(through_table.c.post_id).where(through_table.c.tag_id.in_(removed_tags))))
+    if removed_categories:
+        ids.update(post_id for post_id, in session.execute(
+            sa.select(Post.id).where(Post.category_id.in_(removed_categories))))
+    session.info['related_flush'] = (posts, ids, stale)
+
+
+@event.listens_for(Session, 'after_flush')
+def queue_related_changes(session, flush_context):
+    posts, ids, stale = session.info.pop('related_flush', ((), set(), set()))
+    deleted = {post.id for post in posts if post in session.deleted}
+    changed = ids | {post.id for post in posts if post.id is not None}
+    if changed or deleted or stale:
+        queue(session, changed - deleted, deleted, stale - deleted)
+
+
+@event.listens_for(Session, 'after_commit')
+def update_related(session):
+    changes = session.info.pop('related_changes', None)
+    if changes:
+        related_updater.add(*changes)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def forget_related_changes(session, previous_transaction):
+    session.info.pop('related_changes', None)
+
+
+def _lock(conn):
+    if conn.dialect.name == 'postgresql':
+        # Изменения тегов во время пересчёта потерялись бы
+        conn.execute(sa.text('LOCK TABLE posts, post_tags IN SHARE MODE'))
+
+
+def rebuild_python(conn, limit=None, boost=None):
+    """Пересчёт всего корпуса запросами по REBUILD_CHUNK постов."""
+    limit = limit or settings.RELATED_POSTS_LIMIT
+    boost = settings.RELATED_CATEGORY_BOOST if boost is None else boost
+    _lock(conn)
+    conn.execute(related_posts.delete())
+    ids = [post_id for post_id, in conn.execute(sa.select(Post.id))]
+    for chunk in _chunks(ids, REBUILD_CHUNK):
+        _write(conn, {post_id: top(others, limit) for post_id, others in neighbours(conn, chunk, boost).items()})
+    return len(ids)
+
+
+def rebuild(conn, limit=None, boost=None):
+    """Пересчёт всего корпуса разреженными матрицами; без numpy и scipy - rebuild_python."""
+    try:
+        import numpy as np
+        from scipy import sparse
+    except ImportError:
+        return rebuild_python(conn, limit, boost)
+    limit = limit or settings.RELATED_POSTS_LIMIT
+    boost = settings.RELATED_CATEGORY_BOOST if boost is None else boost
+    _lock(conn)
+    posts = conn.execute(sa.select(Post.id, Post.category_id).order_by(Post.id)).all()
+    ids = np.array([post_id for post_id, _ in posts], dtype=np.int64)
+    codes = {}
+    categories = np.array([-1 if category is None else codes.setdefault(category, len(codes))
+                           for _, category in posts], dtype=np.int64)
+    links = conn.execute(sa.select(through_table.c.post_id, through_table.c.tag_id)).all()
+    tags = {tag: index for index, tag in enumerate({tag for _, tag in links})}
+    rows = np.searchsorted(ids, np.array([post_id for post_id, _ in links], dtype=np.int64))
+    columns = np.array([tags[tag] for _, tag in links], dtype=np.int64)
+    # Пост x тег, произведение на транспонированную - число общих тегов у каждой пары
+    matrix = sparse.csr_matrix((np.ones(len(links), dtype=np.int32), (rows, columns)), shape=(len(ids), len(tags)))
+    transposed = matrix.T.tocsr()
+    sizes = np.diff(matrix.indptr)
+    conn.execute(related_posts.delete())
+    for start in range(0, len(ids), CHUNK):
+        shared = (matrix[start:start + CHUNK] @ transposed).tocsr()
+        row = np.repeat(np.arange(start, start + shared.shape[0]), np.diff(shared.indptr))
+        column, count = shared.indices, shared.data.astype(np.float64)
+        values = count / (sizes[row] + sizes[column] - count)
+        same = (categories[row] == categories[column]) & (categories[row] >= 0)
+        values = np.where(same, values * (1 + boost), values)
+        values[row == column] = -1
+        result = []
+        for offset in range(shared.shape[0]):
+            low, high = shared.indptr[offset], shared.indptr[offset + 1]
+            picked = np.arange(low, high)
+            if high - low > limit:
+                # Кандидаты не хуже limit-го, с равными ему - порядок среди них решает id
+                kth = np.partition(values[low:high], high - low - limit)[high - low - limit]
+                picked = picked[values[low:high] >= kth]
+            picked = picked[values[picked] >= 0]
+            picked = picked[np.lexsort((-ids[column[picked]], -values[picked]))][:limit]
+            post_id = int(ids[start + offset])
+            result.extend({'post_id': post_id, 'rank': rank, 'related_id': other_id, 'score': value}
+                          for rank, (other_id, value) in enumerate(zip(ids[column[picked]].tolist(),
+                                                                       values[picked].tolist())))
+        _insert(conn, result)
+    return len(ids)
+
+
+if __name__ == '__main__':
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        count = rebuild(connection)
+    print(f'Похожие посты для {count} постов пересчитаны за {time.perf_counter() - started:.1f}s')
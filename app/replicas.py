@@ -0,0 +1,201 @@
+"""Чтение с реплик.
+
+Роуты, которые только читают, берут сессию через get_read_db: она
+привязана к одной из здоровых реплик из REPLICA_URLS (по кругу или к
+наименее занятой), всё остальное идёт на primary через get_db. После
+успешного изменяющего запроса клиент получает cookie и следующие
+READ_AFTER_WRITE_WINDOW секунд читает с primary, чтобы увидеть свою
+запись несмотря на отставание реплик.
+
+Реплика выпадает из ротации, если с ней разорвалось или не открылось
+соединение или не прошла периодическая проверка, и возвращается, когда проверка
+снова проходит. Без REPLICA_URLS get_read_db отдаёт сессию primary.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+
+from fastapi import Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.concurrency import run_in_threadpool
+
+from app import settings
+from app.database import AsyncSessionLocal, SessionLocal, engine_options
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_COOKIE = 'read_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class Replica:
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.healthy = True
+        self.sessions = 0
+        self._lock = threading.Lock()
+        if settings.DB_ASYNC:
+            self.engine = None
+            self.async_engine = create_async_engine(settings.async_url(url),
+                                                    **engine_options(settings.async_url(url), asynchronous=True))
+            self.sync_engine = self.async_engine.sync_engine
+        else:
+            self.engine = create_engine(url, **engine_options(url))
+            self.async_engine = None
+            self.sync_engine = self.engine
+        event.listen(self.sync_engine, 'handle_error', self._handle_error)
+
+    def _handle_error(self, context):
+        # Только разрыв или неудачное открытие соединения: таймаут запроса или
+        # блокировки - тоже OperationalError, но реплика при этом жива
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.original_exception)
+
+    def mark_down(self, reason):
+        if self.healthy:
+            logger.warning('Реплика %s выведена из ротации: %s', self.name, reason)
+        self.healthy = False
+
+    def mark_up(self):
+        if not self.healthy:
+            logger.warning('Реплика %s снова в ротации', self.name)
+        self.healthy = True
+
+    def acquire(self):
+        with self._lock:
+            self.sessions += 1
+
+    def release(self):
+        with self._lock:
+            self.sessions -= 1
+
+    def _ping_sync(self):
+        with self.engine.connect() as conn:
+            conn.execute(text(settings.REPLICA_HEALTH_QUERY))
+
+    async def _ping(self):
+        if self.async_engine is None:
+            return await run_in_threadpool(self._ping_sync)
+        async with self.async_engine.connect() as conn:
+            await conn.execute(text(settings.REPLICA_HEALTH_QUERY))
+
+    async def check(self):
+        try:
+            await asyncio.wait_for(self._ping(), settings.REPLICA_HEALTH_TIMEOUT)
+        except Exception as error:
+            self.mark_down(repr(error))
+        else:
+            self.mark_up()
+
+
+class ReplicaSet:
+    def __init__(self, urls, strategy):
+        self.replicas = [Replica(f'replica-{i}', url) for i, url in enumerate(urls)]
+        self.strategy = strategy
+        self._counter = itertools.count()
+        self._task = None
+
+    def choose(self):
+        """Здоровая реплика или None, если читать нужно с primary."""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        if self.strategy == 'least_connections':
+            return min(healthy, key=lambda replica: replica.sessions)
+        return healthy[next(self._counter) % len(healthy)]
+
+    def sync_engines(self):
+        return [replica.sync_engine for replica in self.replicas]
+
+    async def check_all(self):
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+
+    async def _health_loop(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(settings.REPLICA_HEALTH_INTERVAL)
+
+    def start(self):
+        if self.replicas and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._health_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for replica in self.replicas:
+            if replica.async_engine is not None:
+                await replica.async_engine.dispose()
+            else:
+                replica.engine.dispose()
+
+
+replicas = ReplicaSet(settings.REPLICA_URLS, settings.REPLICA_STRATEGY)
+
+
+def pinned_to_primary(request: Request):
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def from_replica(db):
+    return 'replica' in db.info
+
+
+def get_sync_read_db(request: Request):
+    replica = None if pinned_to_primary(request) else replicas.choose()
+    if replica is None:
+        db = SessionLocal()
+    else:
+        replica.acquire()
+        db = SessionLocal(bind=replica.engine, info={'replica': replica.name})
+    try:
+        yield db
+    finally:
+        db.close()
+        if replica is not None:
+            replica.release()
+
+
+async def get_async_read_db(request: Request):
+    replica = None if pinned_to_primary(request) else replicas.choose()
+    if replica is None:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    replica.acquire()
+    try:
+        async with AsyncSessionLocal(bind=replica.async_engine, info={'replica': replica.name}) as db:
+            yield db
+    finally:
+        replica.release()
+
+
+get_read_db = get_async_read_db if settings.DB_ASYNC else get_sync_read_db
+
+
+class ReadAfterWriteMiddleware:
+    """Ставит cookie, по которой get_read_db читает с primary после успешной записи клиента."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] in SAFE_METHODS:
+            return await self.app(scope, receive, send)
+
+        async def send_with_cookie(message):
+            if message['type'] == 'http.response.start' and message['status'] < 400:
+                window = settings.READ_AFTER_WRITE_WINDOW
+                cookie = (f'{PRIMARY_COOKIE}={time.time() + window:.3f}; Max-Age={window}; '
+                          f'Path=/; HttpOnly; SameSite=Lax')
+                message['headers'] = [*message.get('headers', []), (b'set-cookie', cookie.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
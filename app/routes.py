@@ -1,68 +1,265 @@
+import json
+from datetime import datetime
 from typing import List
 
-from fastapi import APIRouter, Depends, status, HTTPException, BackgroundTasks
-from fastapi_pagination import Page, paginate
-from slugify import slugify
-from sqlalchemy import or_
+from fastapi import APIRouter, Depends, status, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse
+from fastapi_pagination import Params
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.auth import get_request_user, create_access_token, create_refresh_token
-from app.database import get_db
+from app import crud, settings, slow_queries
+from app.admission import throttle_auth
+from app.auth import get_request_user, get_admin_user, create_access_token, create_refresh_token
+from app.cache import response_cache, post_cache_tags
+from app.database import get_db, run_db
+from app.replicas import from_replica, get_read_db
+from app.export import MEDIA_TYPES, export_statement, stream_posts
+from app.facets import facet_counts
 from app.hashing import Hasher
-from app.models import Category, Post, User, get_random_string, Tag
+from app.models import User, get_random_string
 from app.schemas import CategorySchema, PostSchema, CreatePostSchema, UpdatePostSchema, CreateUserSchema, Token, \
-    LoginSchema
-from app.send_mail import send_email
+    LoginSchema, CursorPage, ImportPostSchema, ImportResultSchema, PostSummarySchema, PostViewsSchema, UserSchema, \
+    SlowQuerySchema, FacetsSchema
+from app.serializers import json_response, render, serializer
+from app.view_counts import view_counter
 
 router = APIRouter()
 
+CATEGORIES_CACHE_CONTROL = 'public, max-age=300'
+POST_CACHE_CONTROL = 'public, max-age=60'
+IMPORT_BATCH = 2000
+
+
+def cacheable(db: Session):
+    """Ответ, прочитанный с реплики сразу после инвалидации, может быть устаревшим - его не кешируем."""
+    return not (from_replica(db) and response_cache.recently_invalidated(settings.READ_AFTER_WRITE_WINDOW))
+
 
 @router.get('/categories/', response_model=List[CategorySchema], status_code=status.HTTP_200_OK, tags=['categories'])
-async def categories_list(db: Session = Depends(get_db)):
-    return db.query(Category).all()
+async def categories_list(request: Request, db: Session = Depends(get_read_db)):
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+    categories = await run_db(db, crud.list_categories)
+    if settings.FAST_JSON:
+        content = serializer(CategorySchema).dumps_many(categories)
+    else:
+        content = [CategorySchema.from_orm(category) for category in categories]
+    return response_cache.set(request,
+                              content,
+                              tags=['categories'],
+                              cache_control=CATEGORIES_CACHE_CONTROL,
+                              store=cacheable(db))
+
+
+@router.get('/facets/', response_model=FacetsSchema, status_code=status.HTTP_200_OK, tags=['categories'])
+async def facets_list(category: str = None,
+                      q: str = None,
+                      limit: int = Query(50, ge=1, le=500),
+                      db: Session = Depends(get_read_db)):
+    """Число постов по категориям и тегам (`limit` самых частых тегов).
+
+    Читается из счётчиков, а не из таблицы постов. С `category` теги
+    считаются только по постам этой категории, с `q` - по постам,
+    найденным поиском, как в списке постов.
+    """
+    return await run_db(db, facet_counts, category, q, limit)
+
+
+def selected_fields(fields: str = None):
+    if not fields:
+        return crud.POST_LIST_FIELDS
+    selected = tuple(field.strip() for field in fields.split(','))
+    unknown = set(selected) - {*crud.POST_LIST_FIELDS, *crud.POST_OPTIONAL_FIELDS}
+    if unknown:
+        raise HTTPException(status_code=400,
+                            detail=f'Неизвестные поля: {", ".join(sorted(unknown))}')
+    return selected
+
+
+class FeedParams:
+    """Параметры ленты постов, общие для /posts/ и /users/{id}/posts/."""
+
+    def __init__(self,
+                 cursor: str = None,
+                 sort: str = Query(None, regex='^(newest|oldest|title)$'),
+                 since: datetime = None,
+                 until: datetime = None,
+                 total: str = Query(None, regex='^(exact|estimated|none)$'),
+                 fields: str = None):
+        self.cursor = cursor
+        self.sort = sort
+        self.since = since
+        self.until = until
+        self.total_mode = total or settings.POSTS_TOTAL
+        self.fields = selected_fields(fields)
+
+    def options(self):
+        return {'cursor': self.cursor, 'sort': self.sort, 'since': self.since, 'until': self.until,
+                'total_mode': self.total_mode, 'fields': self.fields, 'fast': settings.FAST_JSON}
+
+
+@router.get('/posts/', response_model=CursorPage[PostSummarySchema], response_model_exclude_unset=True,
+            status_code=200, tags=['posts'])
+async def posts_list(category: str = None,
+                     tag: str = None,
+                     q: str = None,
+                     highlight: bool = False,
+                     feed: FeedParams = Depends(),
+                     params: Params = Depends(),
+                     db: Session = Depends(get_read_db)):
+    """Возвращает список всех постов, по умолчанию от новых к старым.
+
+    `sort`: `newest`, `oldest` или `title`; без `sort` с `q` постраничный
+    режим сортирует по релевантности, `highlight` добавляет в ответ
+    фрагменты текста с подсветкой совпадений (HTML: текст экранирован,
+    совпадения в `<b>`). `since`/`until` - посты,
+    созданные не раньше `since` и раньше `until`.
+    Без `cursor` работает постранично (`page`/`size`), с `cursor` -
+    по ключу сортировки, курсоры берутся из `next_cursor`/`prev_cursor`.
+    `fields` - список полей через запятую, по умолчанию без текста поста;
+    `excerpt` - начало текста, `text` - текст целиком.
+    `total` - как считать общее число постов: `exact` (COUNT), `estimated`
+    (приблизительно, по статистике БД) или `none` (без total, только
+    `has_next`); по умолчанию - из настройки POSTS_TOTAL.
+    """
+    page = await run_db(db, crud.list_posts, params, category=category, tag=tag, q=q, highlight=highlight,
+                        **feed.options())
+    return json_response(page) if settings.FAST_JSON else page
+
+
+@router.get('/users/{user_id}/posts/', response_model=CursorPage[PostSummarySchema],
+            response_model_exclude_unset=True, status_code=200, tags=['posts'])
+async def user_posts(user_id: int,
+                     category: str = None,
+                     feed: FeedParams = Depends(),
+                     params: Params = Depends(),
+                     db: Session = Depends(get_read_db)):
+    """Посты автора; параметры - как у списка всех постов."""
+    page = await run_db(db, crud.list_posts, params, category=category, author=user_id, **feed.options())
+    return json_response(page) if settings.FAST_JSON else page
 
 
-@router.get('/posts/', response_model=Page[PostSchema], status_code=200, tags=['posts'])
-async def posts_list(category: str = None, tag: str = None, q: str = None, db: Session = Depends(get_db)):
-    """Возвращает список всех постов"""
-    posts = db.query(Post)
-    if category:
-        posts = posts.filter(Post.category_id == category)
-    if tag:
-        # posts = posts.join(through_table).filter(through_table.columns.tag_id == tag)
-        posts = posts.filter(Post.tags.any(Tag.slug == tag))
-    if q:
-        posts = posts.filter(or_(Post.title.ilike(f'%{q}%'), Post.text.ilike(f'%{q}%')))
-    return paginate(posts.all())
+@router.get('/posts/export', status_code=status.HTTP_200_OK, tags=['posts'])
+async def export_posts(format: str = Query('ndjson', regex='^(ndjson|csv)$'),
+                       category: str = None,
+                       tag: str = None,
+                       q: str = None,
+                       since: datetime = None,
+                       db: Session = Depends(get_read_db)):
+    """Выгружает все посты потоком в NDJSON или CSV, от старых к новым.
+
+    `since` отдаёт только посты, созданные не раньше указанного момента, -
+    для инкрементальной синхронизации.
+    """
+    stmt = export_statement(db.bind.dialect.name, category, tag, q, since)
+    return StreamingResponse(stream_posts(db, stmt, format), media_type=MEDIA_TYPES[format])
+
+
+@router.get('/posts/popular', response_model=List[PostSummarySchema], response_model_exclude_unset=True,
+            status_code=status.HTTP_200_OK, tags=['posts'])
+async def popular_posts(limit: int = Query(20, ge=1, le=100),
+                        category: str = None,
+                        db: Session = Depends(get_read_db)):
+    """Самые просматриваемые посты (`views`), можно только из одной категории.
+
+    Просмотры записываются с задержкой до нескольких секунд.
+    """
+    posts = await run_db(db, crud.popular_posts, limit, category, settings.FAST_JSON)
+    return json_response(posts) if settings.FAST_JSON else posts
 
 
 @router.get('/posts/{slug}/', response_model=PostSchema, status_code=status.HTTP_200_OK, tags=['posts'])
-async def post_details(slug, db: Session = Depends(get_db)):
-    post = db.query(Post).filter(Post.slug == slug).first()
+async def post_details(slug, request: Request, db: Session = Depends(get_read_db)):
+    cached = response_cache.get(request)
+    if cached is not None:
+        view_counter.add(slug)
+        return cached
+    post = await run_db(db, crud.get_post, slug)
     if post is None:
         raise HTTPException(
             status_code=404,
             detail='Пост не найден'
         )
-    return post
+    view_counter.add(slug)
+    return response_cache.set(request,
+                              serializer(PostSchema).dumps(post) if settings.FAST_JSON else PostSchema.from_orm(post),
+                              tags=post_cache_tags(post),
+                              cache_control=POST_CACHE_CONTROL,
+                              store=cacheable(db))
+
+
+@router.get('/posts/{slug}/views/', response_model=PostViewsSchema, status_code=status.HTTP_200_OK, tags=['posts'])
+async def post_views(slug: str, db: Session = Depends(get_read_db)):
+    """Число просмотров поста.
+
+    Отдельно от /posts/{slug}/: страница поста кешируется и не должна
+    сбрасываться при каждой записи просмотров. Просмотры записываются
+    с задержкой до нескольких секунд.
+    """
+    views = await run_db(db, crud.get_post_views, slug)
+    if views is None:
+        raise HTTPException(status_code=404, detail='Пост не найден')
+    return {'slug': slug, 'views': views}
+
+
+@router.get('/posts/{slug}/related/', response_model=List[PostSummarySchema], response_model_exclude_unset=True,
+            status_code=status.HTTP_200_OK, tags=['posts'])
+async def related_posts(slug: str, db: Session = Depends(get_read_db)):
+    """Похожие посты по общим тегам, самые похожие первыми."""
+    posts = await run_db(db, crud.related_to, slug, settings.FAST_JSON)
+    if posts is None:
+        raise HTTPException(status_code=404, detail='Пост не найден')
+    return json_response(posts) if settings.FAST_JSON else posts
 
 
 @router.post('/posts/', response_model=PostSchema, status_code=status.HTTP_201_CREATED, tags=['posts'])
 async def create_post(data: CreatePostSchema,
                       db: Session = Depends(get_db),
                       user: User = Depends(get_request_user)):
-    posts = [post[0] for post in db.query(Post).values('title')]
-    if data.title in posts:
-        return HTTPException(status_code=400,
-                             detail='Пост с таким заголовком уже существует')
-    slug = slugify(data.title)
-    post = Post(author_id=user.id,
-                slug=slug,
-                **data.dict())
-    db.add(post)
-    db.commit()
-    db.refresh(post)
-    return post
+    post = await run_db(db, crud.create_post, data, user.id)
+    return render(PostSchema, post, status_code=status.HTTP_201_CREATED)
+
+
+async def ndjson_lines(request: Request):
+    buffer = b''
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line
+    yield buffer
+
+
+@router.post('/posts/import', response_model=ImportResultSchema, status_code=status.HTTP_200_OK, tags=['posts'])
+async def import_posts(request: Request,
+                       db: Session = Depends(get_db),
+                       user: User = Depends(get_request_user)):
+    """Массовый импорт постов из NDJSON: по объекту {title, text, category_id, tags} на строку.
+
+    Ошибочные строки не прерывают импорт и возвращаются с номерами строк.
+    """
+    imported, errors, batch = 0, [], []
+    line_number = 0
+    async for line in ndjson_lines(request):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            batch.append((line_number, ImportPostSchema(**json.loads(line))))
+        except (ValueError, TypeError, ValidationError) as exc:
+            errors.append({'line': line_number, 'detail': str(exc)})
+        if len(batch) >= IMPORT_BATCH:
+            count, batch_errors = await run_db(db, crud.import_posts, batch, user.id)
+            imported, batch = imported + count, []
+            errors.extend(batch_errors)
+    if batch:
+        count, batch_errors = await run_db(db, crud.import_posts, batch, user.id)
+        imported += count
+        errors.extend(batch_errors)
+    return {'imported': imported, 'errors': sorted(errors, key=lambda error: error['line'])}
 
 
 @router.patch('/posts/{slug}/', response_model=PostSchema, status_code=status.HTTP_200_OK, tags=['posts'])
@@ -70,92 +267,76 @@ async def update_post(slug: str,
                       data: UpdatePostSchema,
                       db: Session = Depends(get_db),
                       user: User = Depends(get_request_user)):
-    post = db.query(Post).filter(Post.slug == slug).first()
-    if post is None:
-        raise HTTPException(status_code=404,
-                            detail='Пост не найден')
-    if post.author_id != user.id:
-        raise HTTPException(status_code=403,
-                            detail='Вы не являетесь автором')
-    for key, value in data.dict().items():
-        if value is not None:
-            setattr(post, key, value)
-    db.commit()
-    db.refresh(post)
-    return post
+    post = await run_db(db, crud.update_post, slug, data, user.id)
+    return render(PostSchema, post)
 
 
 @router.delete('/posts/{slug}/', status_code=status.HTTP_204_NO_CONTENT, tags=['posts'])
 async def delete_post(slug: str,
                       db: Session = Depends(get_db),
                       user: User = Depends(get_request_user)):
-    post = db.query(Post).filter(Post.slug == slug).first()
-    if post is None:
-        raise HTTPException(status_code=404,
-                            detail='Пост не найден')
-    if post.author_id != user.id:
-        raise HTTPException(status_code=403,
-                            detail='Вы не являетесь автором')
-    db.delete(post)
-    db.commit()
+    await run_db(db, crud.delete_post, slug, user.id)
     return 'Пост удалён'
 
 
-@router.post('/register/', status_code=status.HTTP_201_CREATED, tags=['auth'])
-def register_user(background_task: BackgroundTasks,
-                  user: CreateUserSchema,
-                  db: Session = Depends(get_db)):
-    emails = [u.email for u in db.query(User).all()]
-    if user.email in emails:
-        return HTTPException(
+# Без response_model FastAPI отдал бы ORM-объект целиком, с хешем пароля и кодом активации
+@router.post('/register/', response_model=UserSchema, status_code=status.HTTP_201_CREATED, tags=['auth'])
+async def register_user(user: CreateUserSchema,
+                        request: Request,
+                        db: Session = Depends(get_db)):
+    throttle_auth(request, user.email)
+    if await run_db(db, crud.email_taken, user.email):
+        raise HTTPException(
             status_code=400,
-            detail='Email уже занят'
+            detail=crud.EMAIL_TAKEN
         )
     activation_code = get_random_string(8)
-    hashed = Hasher.hash_password(user.password)
-    user1 = User(**{'email': user.email, 'name': user.name})
-    user1.password = hashed
-    user1.activation_code = activation_code
-    db.add(user1)
-    db.commit()
-    db.refresh(user1)
-    send_email(
-        background_task,
+    hashed = await Hasher.hash_password_async(user.password)
+    activation_email = (
         'Активация аккаунта',
-        user1.email,
         f'Для активации аккаунта перейдите по ссылке: http://localhost:8000/activate/{activation_code}/'
     )
-    return user1
+    user1 = await run_db(db, crud.create_user, user.email, user.name, hashed, activation_code,
+                         emails=[activation_email])
+    return render(UserSchema, user1, status_code=status.HTTP_201_CREATED)
 
 
 @router.get('/activate/{activation_code}/', status_code=status.HTTP_200_OK, tags=['auth'])
-def activation(activation_code: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.activation_code == activation_code).first()
+async def activation(activation_code: str, db: Session = Depends(get_db)):
+    user = await run_db(db, crud.activate_user, activation_code)
     if user:
-        user.activation_code = ''
-        user.is_active = True
-        db.commit()
-        db.refresh(user)
         return 'Ваш аккаунт успешно активирован'
     else:
         raise HTTPException(status_code=404, detail='Пользователь не найден')
 
 
 @router.post('/login/', response_model=Token, status_code=status.HTTP_200_OK, tags=['auth'])
-def login(data: LoginSchema, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == data.email).first()
+async def login(data: LoginSchema, request: Request, db: Session = Depends(get_db)):
+    throttle_auth(request, data.email)
+    user = await run_db(db, crud.get_user_by_email, data.email)
     if user is None:
         raise HTTPException(status_code=400,
                             detail='Неверный email')
     hashed_pass = user.password
     raw_pass = data.password
-    if not Hasher.verify_password(raw_pass, hashed_pass):
+    valid, new_hash = await Hasher.verify_and_update(raw_pass, hashed_pass)
+    if not valid:
         raise HTTPException(status_code=400,
                             detail='Неверный пароль')
+    if new_hash:
+        await run_db(db, crud.set_password, user.id, new_hash)
     if not user.is_active:
         raise HTTPException(status_code=400,
                             detail='Аккаунт не активен')
     return {
-        'access_token': create_access_token(str(user.id)),
+        'access_token': create_access_token(str(user.id), user),
         'refresh_token': create_refresh_token(str(user.id))
     }
+
+
+@router.get('/slow-queries/', response_model=List[SlowQuerySchema], status_code=status.HTTP_200_OK, tags=['admin'])
+async def slow_queries_list(limit: int = Query(100, ge=1, le=1000),
+                            route: str = None,
+                            user: UserSchema = Depends(get_admin_user)):
+    """Последние медленные SQL-запросы из журнала, новые первыми. Только для администраторов."""
+    return await run_in_threadpool(slow_queries.recent, limit, route)
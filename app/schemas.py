@@ -1,7 +1,11 @@
-from typing import Optional
+from datetime import datetime
+from typing import Any, Generic, List, Optional, TypeVar
 
+from fastapi_pagination import Page
 from pydantic import BaseModel, EmailStr, validator
 
+T = TypeVar('T')
+
 
 class BaseClass(BaseModel):
     class Config:
@@ -13,12 +17,18 @@ class CategorySchema(BaseClass):
     slug: str
 
 
+class TagSchema(BaseClass):
+    title: str
+    slug: str
+
+
 class PostSchema(BaseClass):
     id: int
     title: str
     slug: str
     text: str
     category: CategorySchema
+    tags: List[TagSchema] = []
 
     class Config:
         schema_extra = {
@@ -31,17 +41,59 @@ class PostSchema(BaseClass):
                     {
                      "title": "Новости",
                      "slug": "news"
+                    },
+                "tags": [
+                    {
+                     "title": "Выпускной",
+                     "slug": "graduation"
                     }
+                ]
             }
         }
 
 
+class PostViewsSchema(BaseClass):
+    slug: str
+    views: int
+
+
+class PostSummarySchema(BaseClass):
+    """Пост в списке: отдаются только запрошенные через `fields` поля."""
+    id: Optional[int]
+    title: Optional[str]
+    slug: Optional[str]
+    category: Optional[CategorySchema]
+    tags: Optional[List[TagSchema]]
+    created_at: Optional[datetime]
+    excerpt: Optional[str]
+    text: Optional[str]
+    snippet: Optional[str]
+    views: Optional[int]
+
+
 class CreatePostSchema(BaseClass):
     title: str
     text: str
     category_id: str
 
 
+class ImportPostSchema(BaseClass):
+    title: str
+    text: str
+    category_id: str
+    tags: List[str] = []
+
+
+class ImportErrorSchema(BaseModel):
+    line: int
+    detail: str
+
+
+class ImportResultSchema(BaseModel):
+    imported: int
+    errors: List[ImportErrorSchema]
+
+
 class UpdatePostSchema(BaseClass):
     title: Optional[str]
     text: Optional[str]
@@ -67,6 +119,7 @@ class UserSchema(BaseClass):
     email: EmailStr
     name: str
     is_active: bool
+    is_admin: bool = False
 
 
 class Token(BaseModel):
@@ -82,3 +135,36 @@ class LoginSchema(BaseModel):
 class TokenPayload(BaseModel):
     sub: str
     exp: int
+    email: Optional[str]
+    name: Optional[str]
+    is_active: Optional[bool]
+    is_admin: Optional[bool]
+
+
+class SlowQuerySchema(BaseModel):
+    time: datetime
+    route: Optional[str]
+    duration_ms: float
+    statement: str
+    parameters: Any
+    executemany: bool
+    plan: Optional[str]
+
+
+class FacetSchema(BaseModel):
+    slug: str
+    title: str
+    count: int
+
+
+class FacetsSchema(BaseModel):
+    categories: List[FacetSchema]
+    tags: List[FacetSchema]
+
+
+class CursorPage(Page[T], Generic[T]):
+    total: Optional[int]
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+    has_next: Optional[bool]
+    total_mode: Optional[str]
@@ -0,0 +1,64 @@
+import html
+import re
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import Query, with_expression
+
+from app.models import Post, SEARCH_CONFIG
+
+# СУБД отмечает совпадения символами из области частного использования, а не
+# тегами: текст поста экранируется уже после, и разметка в нём не выживает
+HIGHLIGHT_START = '\ue000'
+HIGHLIGHT_STOP = '\ue001'
+
+search_vector = sa.literal_column('posts.search_vector', type_=TSVECTOR)
+posts_fts = sa.table('posts_fts', sa.column('rowid'))
+fts_table = sa.literal_column('posts_fts')
+
+
+def _fts5_query(q: str) -> str:
+    """Превращает пользовательский ввод в безопасный запрос FTS5: все слова через AND."""
+    words = re.findall(r'\w+', q)
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def render_snippet(snippet):
+    """Фрагмент с подсветкой в безопасный HTML: текст экранируется, совпадения - в <b>."""
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(HIGHLIGHT_START, '<b>').replace(HIGHLIGHT_STOP, '</b>')
+
+
+def escape_like(value: str) -> str:
+    """Экранирует спецсимволы LIKE; в запросе нужен escape='\\'."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_posts(query: Query, q: str, dialect: str, highlight: bool = False):
+    """Фильтрует посты по `q` через полнотекстовый индекс.
+
+    Возвращает запрос и выражение для сортировки по релевантности
+    (None, если СУБД не поддерживает ранжирование).
+    """
+    if dialect == 'postgresql':
+        ts_query = sa.func.websearch_to_tsquery(SEARCH_CONFIG, q)
+        query = query.filter(search_vector.op('@@')(ts_query))
+        if highlight:
+            options = f'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_STOP}", MaxFragments=2'
+            snippet = sa.func.ts_headline(SEARCH_CONFIG, Post.text, ts_query, options)
+            query = query.options(with_expression(Post.snippet, snippet))
+        return query, sa.func.ts_rank_cd(search_vector, ts_query).desc()
+    if dialect == 'sqlite':
+        fts_query = _fts5_query(q)
+        if not fts_query:
+            return query.filter(sa.false()), None
+        query = (query.join(posts_fts, posts_fts.c.rowid == Post.id)
+                 .filter(fts_table.op('MATCH')(fts_query)))
+        if highlight:
+            snippet = sa.func.snippet(fts_table, -1, HIGHLIGHT_START, HIGHLIGHT_STOP, '…', 16)
+            query = query.options(with_expression(Post.snippet, snippet))
+        return query, sa.func.bm25(fts_table).asc()
+    pattern = f'%{escape_like(q)}%'
+    query = query.filter(sa.or_(Post.title.ilike(pattern, escape='\\'), Post.text.ilike(pattern, escape='\\')))
+    return query, None
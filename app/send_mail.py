@@ -1,30 +1,31 @@
-from fastapi import BackgroundTasks
-from fastapi_mail import (FastMail,
-                          MessageSchema,
-                          ConnectionConfig)
+from functools import lru_cache
+
+from sqlalchemy.orm import Session
 
 from app import settings
+from app.models import EmailOutbox
+
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.EMAIL_USER,
-    MAIL_PASSWORD=settings.EMAIL_PASSWORD,
-    MAIL_FROM=settings.EMAIL_FROM,
-    MAIL_PORT=settings.EMAIL_PORT,
-    MAIL_SERVER=settings.EMAIL_HOST,
-    MAIL_TLS=True,
-    MAIL_SSL=False,
-    USE_CREDENTIALS=True
-)
+@lru_cache(maxsize=None)
+def get_conf():
+    """Настройки SMTP; собираются при первом обращении, API-процессу они не нужны."""
+    # fastapi_mail тянет jinja2 и aioredis - импортируем только там, где реально отправляем письма
+    from fastapi_mail import ConnectionConfig
+    return ConnectionConfig(
+        MAIL_USERNAME=settings.EMAIL_USER,
+        MAIL_PASSWORD=settings.EMAIL_PASSWORD,
+        MAIL_FROM=settings.EMAIL_FROM,
+        MAIL_PORT=settings.EMAIL_PORT,
+        MAIL_SERVER=settings.EMAIL_HOST,
+        MAIL_TLS=True,
+        MAIL_SSL=False,
+        USE_CREDENTIALS=True
+    )
 
 
-def send_email(background_tasks: BackgroundTasks,
+def send_email(db: Session,
                subject: str,
                email: str,
                body: str):
-    message = MessageSchema(
-        subject=subject,
-        recipients=[email],
-        body=body
-    )
-    fm = FastMail(conf)
-    background_tasks.add_task(fm.send_message, message)
+    """Кладёт письмо в outbox текущей транзакции, отправит его app.mail_worker."""
+    db.add(EmailOutbox(recipient=email, subject=subject, body=body))
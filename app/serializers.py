@@ -0,0 +1,73 @@
+from functools import lru_cache
+from operator import attrgetter
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON
+from starlette.responses import JSONResponse, Response
+
+from app import settings
+
+
+# Быстрый путь сериализации (FAST_JSON=1): ORM-объекты превращаются в байты
+# без валидации pydantic и jsonable_encoder. Результат совпадает с тем,
+# что FastAPI отдаёт через response_model и JSONResponse.
+
+DefaultResponse = ORJSONResponse if settings.FAST_JSON else JSONResponse
+
+
+class Serializer:
+    """Сериализатор схемы, собранный один раз: список (поле, функция чтения из ORM-объекта).
+
+    `fields` ограничивает набор полей - как exclude_unset для схемы,
+    заполненной только этими полями. Порядок полей - как в схеме.
+    """
+
+    def __init__(self, schema, fields=None):
+        self.schema = schema
+        self.readers = [(name, self._reader(field)) for name, field in schema.__fields__.items()
+                        if fields is None or name in fields]
+
+    @staticmethod
+    def _reader(field):
+        get = attrgetter(field.name)
+        if not (isinstance(field.type_, type) and issubclass(field.type_, BaseModel)):
+            return get
+        nested = serializer(field.type_)
+        if field.shape == SHAPE_SINGLETON:
+            return lambda obj: None if (value := get(obj)) is None else nested.to_dict(value)
+        if field.shape == SHAPE_LIST:
+            return lambda obj: None if (value := get(obj)) is None else [nested.to_dict(v) for v in value]
+        raise TypeError(f'{field.name}: неподдерживаемый тип поля')
+
+    def to_dict(self, obj):
+        return {name: read(obj) for name, read in self.readers}
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(self.to_dict(obj))
+
+    def dumps_many(self, objs) -> bytes:
+        return orjson.dumps([self.to_dict(obj) for obj in objs])
+
+    def dumps_page(self, page) -> bytes:
+        """Страница пагинации с ORM-объектами в items."""
+        data = {name: getattr(page, name) for name in type(page).__fields__}
+        data['items'] = [self.to_dict(obj) for obj in page.items]
+        return orjson.dumps(data)
+
+
+@lru_cache(maxsize=None)
+def serializer(schema, fields=None) -> Serializer:
+    return Serializer(schema, fields)
+
+
+def json_response(body: bytes, status_code=200, headers=None) -> Response:
+    return Response(body, status_code=status_code, headers=headers, media_type='application/json')
+
+
+def render(schema, obj, status_code=200):
+    """Ответ роута с response_model=schema: байты при FAST_JSON, иначе ORM-объект для FastAPI."""
+    if not settings.FAST_JSON:
+        return obj
+    return json_response(serializer(schema).dumps(obj), status_code=status_code)
@@ -14,5 +14,103 @@ EMAIL_HOST = os.getenv('EMAIL_HOST')
 SECRET_KEY = os.getenv('SECRET_KEY')
 REFRESH_SECRET_KEY = os.getenv('REFRESH_SECRET_KEY')
 ALGORITHM = os.getenv('ALGORITHM')
-ACCESS_TOKEN_LIFETIME = os.getenv('ACCESS_TOKEN_LIFETIME')
-REFRESH_TOKEN_LIFETIME = os.getenv('REFRESH_TOKEN_LIFETIME')
+ACCESS_TOKEN_LIFETIME = int(os.getenv('ACCESS_TOKEN_LIFETIME', 30))
+REFRESH_TOKEN_LIFETIME = int(os.getenv('REFRESH_TOKEN_LIFETIME', 60 * 24 * 7))
+DEBUG = os.getenv('DEBUG', '0') == '1'
+# lazy - админка собирается при первом запросе к /admin, off - не монтируется (см. app/admin_app.py)
+ADMIN_PANEL = os.getenv('ADMIN_PANEL', 'lazy')
+# Middleware с метриками и эндпоинт /metrics в формате Prometheus
+METRICS = os.getenv('METRICS', '1') == '1'
+
+# DB_ASYNC=0 возвращает синхронные сессии (запросы в threadpool) - для сравнения пропускной способности.
+DB_ASYNC = os.getenv('DB_ASYNC', '1') == '1'
+
+
+def async_url(url):
+    return url.replace('postgresql://', 'postgresql+asyncpg://', 1).replace('sqlite://', 'sqlite+aiosqlite://', 1)
+
+
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL') or async_url(DATABASE_URL or '')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+
+# Реплики для чтения через запятую; round_robin или least_connections
+REPLICA_URLS = [url.strip() for url in os.getenv('REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_STRATEGY = os.getenv('REPLICA_STRATEGY', 'round_robin')
+REPLICA_HEALTH_INTERVAL = float(os.getenv('REPLICA_HEALTH_INTERVAL', 5))
+REPLICA_HEALTH_TIMEOUT = float(os.getenv('REPLICA_HEALTH_TIMEOUT', 2))
+REPLICA_HEALTH_QUERY = os.getenv('REPLICA_HEALTH_QUERY', 'SELECT 1')
+# Сколько секунд после записи клиент читает с primary (cookie) - должно покрывать отставание реплик
+READ_AFTER_WRITE_WINDOW = int(os.getenv('READ_AFTER_WRITE_WINDOW', 5))
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+# thread - bcrypt отпускает GIL, process - полная изоляция от воркера uvicorn
+HASHING_EXECUTOR = os.getenv('HASHING_EXECUTOR', 'thread')
+HASHING_WORKERS = int(os.getenv('HASHING_WORKERS', os.cpu_count() or 1))
+HASHING_QUEUE_LIMIT = int(os.getenv('HASHING_QUEUE_LIMIT', 64))
+
+# Лимиты одновременных запросов по классам роутов, очередь и максимальное ожидание в ней (секунды)
+ADMISSION = os.getenv('ADMISSION', '1') == '1'
+ADMISSION_AUTH_CONCURRENCY = int(os.getenv('ADMISSION_AUTH_CONCURRENCY', HASHING_WORKERS * 2))
+ADMISSION_WRITE_CONCURRENCY = int(os.getenv('ADMISSION_WRITE_CONCURRENCY', 32))
+ADMISSION_READ_CONCURRENCY = int(os.getenv('ADMISSION_READ_CONCURRENCY', 128))
+ADMISSION_ADMIN_CONCURRENCY = int(os.getenv('ADMISSION_ADMIN_CONCURRENCY', 4))
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 256))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', 1))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 1))
+# Попыток /login/ и /register/ в минуту и размер всплеска - на IP и на email
+AUTH_THROTTLE_IP_RATE = float(os.getenv('AUTH_THROTTLE_IP_RATE', 20))
+AUTH_THROTTLE_IP_BURST = int(os.getenv('AUTH_THROTTLE_IP_BURST', 20))
+AUTH_THROTTLE_EMAIL_RATE = float(os.getenv('AUTH_THROTTLE_EMAIL_RATE', 5))
+AUTH_THROTTLE_EMAIL_BURST = int(os.getenv('AUTH_THROTTLE_EMAIL_BURST', 5))
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv('PRINCIPAL_CACHE_SIZE', 10000))
+PRINCIPAL_CACHE_TTL = int(os.getenv('PRINCIPAL_CACHE_TTL', 60))
+# Класть email, name и is_active в access-токен и не ходить за пользователем в БД
+AUTH_TOKEN_CLAIMS = os.getenv('AUTH_TOKEN_CLAIMS', '0') == '1'
+
+# total в списке постов по умолчанию: exact, estimated или none (запрос может выбрать ?total=)
+POSTS_TOTAL = os.getenv('POSTS_TOTAL', 'exact')
+# Точные COUNT(*) для estimated там, где нет оценки планировщика (SQLite)
+COUNT_CACHE_TTL = int(os.getenv('COUNT_CACHE_TTL', 60))
+COUNT_CACHE_SIZE = int(os.getenv('COUNT_CACHE_SIZE', 1024))
+
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# Срок жизни записи кеша ответов: дольше изменения из других процессов не видны (0 - без кеша)
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 60))
+# Запросы дольше SLOW_QUERY_MS пишутся в журнал (0 - выключено), у доли из них снимается план
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', 200))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv('SLOW_QUERY_EXPLAIN_RATE', 0.1))
+# Каждый процесс пишет в свой файл: logs/slow_queries.<pid>.log
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', 'logs/slow_queries.log')
+SLOW_QUERY_LOG_BYTES = int(os.getenv('SLOW_QUERY_LOG_BYTES', 10 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv('SLOW_QUERY_LOG_BACKUPS', 5))
+
+# Сериализация ответов через orjson без валидации pydantic (app/serializers.py)
+FAST_JSON = os.getenv('FAST_JSON', '0') == '1'
+
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 100))
+EMAIL_CONCURRENCY = int(os.getenv('EMAIL_CONCURRENCY', 2))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 8))
+EMAIL_RETRY_BASE = int(os.getenv('EMAIL_RETRY_BASE', 30))
+EMAIL_POLL_INTERVAL = float(os.getenv('EMAIL_POLL_INTERVAL', 2))
+
+# Таймауты DDL в миграциях и заполнение колонок пачками (app/migrations/online.py)
+MIGRATION_LOCK_TIMEOUT = os.getenv('MIGRATION_LOCK_TIMEOUT', '5s')
+MIGRATION_STATEMENT_TIMEOUT = os.getenv('MIGRATION_STATEMENT_TIMEOUT', '0')
+BACKFILL_BATCH_SIZE = int(os.getenv('BACKFILL_BATCH_SIZE', 5000))
+BACKFILL_ROWS_PER_SECOND = int(os.getenv('BACKFILL_ROWS_PER_SECOND', 0))
+BACKFILL_STATEMENT_TIMEOUT = os.getenv('BACKFILL_STATEMENT_TIMEOUT', '30s')
+
+# Просмотры постов копятся в памяти и записываются пачками (app/view_counts.py)
+VIEWS_FLUSH_INTERVAL = float(os.getenv('VIEWS_FLUSH_INTERVAL', 5))
+VIEWS_FLUSH_SIZE = int(os.getenv('VIEWS_FLUSH_SIZE', 1000))
+VIEWS_MAX_PENDING = int(os.getenv('VIEWS_MAX_PENDING', 100000))
+
+# Похожие посты (app/related.py): сколько хранить на пост, надбавка за общую категорию
+# и как часто пересчитывать списки изменённых постов
+RELATED_POSTS_LIMIT = int(os.getenv('RELATED_POSTS_LIMIT', 5))
+RELATED_CATEGORY_BOOST = float(os.getenv('RELATED_CATEGORY_BOOST', 0.25))
+RELATED_UPDATE_INTERVAL = float(os.getenv('RELATED_UPDATE_INTERVAL', 2))
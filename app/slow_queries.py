@@ -0,0 +1,205 @@
+"""Журнал медленных SQL-запросов.
+
+Каждый запрос к БД засекается; если он дольше SLOW_QUERY_MS, в журнал
+(ротируемый файл, строка JSON на запрос) пишутся роут, время, SQL и
+параметры, в которых строки и байты заменены типом и длиной. У каждого
+процесса свой файл - SLOW_QUERY_LOG с pid перед расширением: ротация
+одного файла из нескольких воркеров теряла бы и перемешивала строки. Для доли
+SLOW_QUERY_EXPLAIN_RATE медленных SELECT дописывается план: на PostgreSQL
+EXPLAIN (ANALYZE, BUFFERS) в точке сохранения, которая потом
+откатывается, на SQLite - EXPLAIN QUERY PLAN.
+"""
+import contextvars
+import glob
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from sqlalchemy import event
+
+from app import settings
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN (ANALYZE, BUFFERS) ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+EXPLAIN_SAVEPOINT = 'slow_query_explain'
+
+_current_scope = contextvars.ContextVar('request_scope', default=None)
+
+
+def current_route():
+    """Шаблон пути роута текущего запроса (или сам путь, если роут не найден)."""
+    scope = _current_scope.get()
+    if scope is None:
+        return None
+    return getattr(scope.get('route'), 'path', None) or scope.get('path')
+
+
+class RequestContextMiddleware:
+    """Запоминает ASGI scope запроса, чтобы SQL-запросы можно было привязать к роуту."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        token = _current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_scope.reset(token)
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return f'<{type(value).__name__}:{len(value)}>'
+    return f'<{type(value).__name__}>'
+
+
+def explain(conn, statement, parameters):
+    """План запроса через отдельный курсор того же соединения (события SQLAlchemy не срабатывают)."""
+    dialect = conn.dialect.name
+    prefix = EXPLAIN_PREFIXES.get(dialect)
+    if prefix is None or not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    postgres = dialect == 'postgresql'
+    cursor = conn.connection.cursor()
+    try:
+        if postgres:
+            # ANALYZE выполняет запрос ещё раз: откатываем его эффекты и ошибку, транзакция не страдает
+            cursor.execute(f'SAVEPOINT {EXPLAIN_SAVEPOINT}')
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        except Exception as exc:
+            return f'EXPLAIN не выполнен: {exc}'
+        finally:
+            if postgres:
+                cursor.execute(f'ROLLBACK TO SAVEPOINT {EXPLAIN_SAVEPOINT}')
+                cursor.execute(f'RELEASE SAVEPOINT {EXPLAIN_SAVEPOINT}')
+    finally:
+        cursor.close()
+    if postgres:
+        return '\n'.join(row[0] for row in rows)
+    # SQLite: (id, parent, notused, detail)
+    return '\n'.join(row[-1] for row in rows)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Как в query_stats: в контексте выполнения, после ошибки запроса на соединении ничего не остаётся
+    if context is not None:
+        context._slow_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_slow_query_start', None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    if duration * 1000 < settings.SLOW_QUERY_MS:
+        return
+    record = {
+        'time': datetime.utcnow().isoformat(),
+        'route': current_route(),
+        'duration_ms': round(duration * 1000, 2),
+        'statement': statement,
+        'parameters': redact(parameters[:1] if executemany else parameters),
+        'executemany': executemany,
+        'plan': None,
+    }
+    if not executemany and random.random() < settings.SLOW_QUERY_EXPLAIN_RATE:
+        record['plan'] = explain(conn, statement, parameters)
+    logger.warning(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def process_log_path(path, pid):
+    """logs/slow_queries.log -> logs/slow_queries.<pid>.log"""
+    root, extension = os.path.splitext(path)
+    return f'{root}.{pid}{extension}'
+
+
+class ProcessRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler, который пишет в файл своего процесса, в том числе после fork."""
+
+    def __init__(self, path, **kwargs):
+        self.pid = os.getpid()
+        super().__init__(process_log_path(path, self.pid), delay=True, **kwargs)
+        self.path = path
+
+    def emit(self, record):
+        pid = os.getpid()
+        if pid != self.pid:
+            # Обработчик создан до fork (gunicorn --preload): файл родителя не трогаем
+            self.acquire()
+            try:
+                if self.stream is not None:
+                    # StreamHandler сбрасывает буфер после каждой записи, в копии потока нет чужих строк
+                    self.stream.close()
+                    self.stream = None
+                self.pid = pid
+                self.baseFilename = os.path.abspath(process_log_path(self.path, pid))
+            finally:
+                self.release()
+        super().emit(record)
+
+
+def configure_log():
+    if logger.handlers:
+        return
+    directory = os.path.dirname(settings.SLOW_QUERY_LOG)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    handler = ProcessRotatingFileHandler(settings.SLOW_QUERY_LOG,
+                                         maxBytes=settings.SLOW_QUERY_LOG_BYTES,
+                                         backupCount=settings.SLOW_QUERY_LOG_BACKUPS,
+                                         encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.WARNING)
+    logger.propagate = False
+
+
+def install(engine):
+    configure_log()
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _records(lines):
+    for line in lines:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # строка, которую другой процесс ещё дописывает
+            continue
+
+
+def recent(limit=100, route=None):
+    """Последние записи текущих файлов журнала всех процессов, новые первыми."""
+    records = []
+    for path in glob.glob(process_log_path(glob.escape(settings.SLOW_QUERY_LOG), '*')):
+        try:
+            log = open(path, encoding='utf-8')
+        except FileNotFoundError:
+            # файл как раз ротируется
+            continue
+        with log:
+            records.extend(deque((record for record in _records(log) if route is None or record['route'] == route),
+                                 maxlen=limit))
+    records.sort(key=lambda record: record['time'], reverse=True)
+    return records[:limit]
@@ -0,0 +1,146 @@
+"""Счётчики просмотров постов с отложенной записью.
+
+post_details не пишет в БД: просмотр увеличивает счётчик в памяти
+процесса, а фоновая задача раз в VIEWS_FLUSH_INTERVAL секунд (или
+раньше, когда накопилось VIEWS_FLUSH_SIZE просмотров) записывает всё
+накопленное одним executemany-upsert в post_views. Каждый пост
+обновляется раз за сброс, а не на каждый просмотр, и строки поста
+(posts) запись не касается вовсе. Кеш ответов сброс тоже не трогает:
+просмотров нет в кешируемой странице поста, их отдаёт отдельный
+/posts/{slug}/views/.
+
+При падении процесса теряются просмотры, накопленные с последнего
+сброса, - не больше VIEWS_FLUSH_INTERVAL секунд и VIEWS_FLUSH_SIZE
+просмотров на процесс. Если БД недоступна, просмотры остаются в памяти
+до следующей попытки, но не больше VIEWS_MAX_PENDING: остальные
+отбрасываются и учитываются в dropped.
+"""
+import asyncio
+import logging
+import threading
+from collections import Counter
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import settings
+from app.database import engine
+from app.models import Post, post_views
+
+logger = logging.getLogger(__name__)
+
+
+def upsert(conn, counts):
+    """Прибавляет просмотры {слаг: число}; посты, удалённые после просмотра, пропускаются."""
+    dialect = {'postgresql': postgresql, 'sqlite': sqlite}[conn.dialect.name]
+    # WHERE в SELECT обязателен: без него SQLite не разбирает INSERT ... SELECT ... ON CONFLICT
+    insert = dialect.insert(post_views).from_select(
+        ['post_id', 'views'],
+        sa.select(Post.id, sa.bindparam('b_views', type_=sa.Integer)).where(Post.slug == sa.bindparam('b_slug')),
+    )
+    # Одинаковый порядок строк у всех процессов - без взаимных блокировок
+    conn.execute(insert.on_conflict_do_update(index_elements=[post_views.c.post_id],
+                                              set_={'views': post_views.c.views + insert.excluded.views}),
+                 [{'b_slug': slug, 'b_views': views} for slug, views in sorted(counts.items())])
+
+
+class ViewCounter:
+    def __init__(self, flush_interval, flush_size, max_pending):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self.flushed = 0
+        self.dropped = 0
+        self.failures = 0
+        self._pending = Counter()
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = None
+        self._task = None
+
+    @property
+    def pending(self):
+        return self._pending_total
+
+    def add(self, slug, count=1):
+        with self._lock:
+            if self._pending_total + count > self.max_pending:
+                self.dropped += count
+                return
+            self._pending[slug] += count
+            self._pending_total += count
+            full = self._pending_total >= self.flush_size
+        if full and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _take(self):
+        with self._lock:
+            counts, self._pending, self._pending_total = self._pending, Counter(), 0
+        return counts
+
+    def _restore(self, counts):
+        with self._lock:
+            for slug, count in counts.items():
+                if self._pending_total + count > self.max_pending:
+                    self.dropped += count
+                    continue
+                self._pending[slug] += count
+                self._pending_total += count
+
+    def flush(self):
+        """Записывает накопленные просмотры; при ошибке возвращает их в очередь."""
+        with self._flush_lock:
+            counts = self._take()
+            if not counts:
+                return 0
+            try:
+                with engine.begin() as conn:
+                    upsert(conn, counts)
+            except Exception as error:
+                self.failures += 1
+                self._restore(counts)
+                logger.warning('Не удалось записать просмотры (%d постов): %s', len(counts), error)
+                return 0
+            total = sum(counts.values())
+            self.flushed += total
+            return total
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await run_in_threadpool(self.flush)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._wakeup = None
+        await run_in_threadpool(self.flush)
+
+    def stats(self):
+        return {'pending': self.pending, 'flushed': self.flushed, 'dropped': self.dropped, 'failures': self.failures}
+
+
+view_counter = ViewCounter(settings.VIEWS_FLUSH_INTERVAL, settings.VIEWS_FLUSH_SIZE, settings.VIEWS_MAX_PENDING)
+
+
+@event.listens_for(Session, 'after_flush')
+def delete_post_views(session, flush_context):
+    # SQLite без PRAGMA foreign_keys не выполняет ON DELETE CASCADE, а id
+    # удалённого поста может достаться новому
+    ids = [obj.id for obj in session.deleted if isinstance(obj, Post)]
+    if ids:
+        session.execute(post_views.delete().where(post_views.c.post_id.in_(ids)))
@@ -0,0 +1,41 @@
+"""Пропускная способность проверки паролей в зависимости от числа воркеров хеширования.
+
+    python -m benchmarks.bench_hashing --logins 200 --kind thread
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from app.hashing import Hasher
+
+
+async def run(kind, workers, logins, hashed):
+    Hasher.configure(kind=kind, workers=workers)
+    try:
+        await Hasher.verify_and_update('password', hashed)  # прогрев пула
+        started = time.perf_counter()
+        await asyncio.gather(*(Hasher.verify_and_update('password', hashed) for _ in range(logins)))
+        return logins / (time.perf_counter() - started)
+    finally:
+        Hasher.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--kind', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    hashed = Hasher.hash_password('password')
+    print(f'{"workers":>8} {"logins/s":>10}')
+    workers = 1
+    while workers <= args.max_workers:
+        rate = asyncio.run(run(args.kind, workers, args.logins, hashed))
+        print(f'{workers:>8} {rate:>10.1f}')
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Накладные расходы MetricsMiddleware на один запрос.
+
+    python -m benchmarks.bench_metrics --requests 50000
+
+Запросы идут напрямую в ASGI-приложение без сети и БД, поэтому разница
+между прогонами - чистая стоимость middleware. Для сравнения с реальными
+роутами смотрите p50 в benchmarks.runner.
+"""
+import argparse
+import asyncio
+import time
+
+from app.metrics import MetricsMiddleware, render
+
+
+class Route:
+    path = '/posts/{slug}/'
+
+
+async def endpoint(scope, receive, send):
+    scope['route'] = Route
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': b'{}'})
+
+
+async def receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+
+async def send(message):
+    pass
+
+
+async def run(app, requests):
+    scope = {'type': 'http', 'method': 'GET', 'path': '/posts/post-1/', 'headers': []}
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=50000)
+    args = parser.parse_args()
+
+    bare = asyncio.run(run(endpoint, args.requests))
+    instrumented = asyncio.run(run(MetricsMiddleware(endpoint), args.requests))
+    started = time.perf_counter()
+    text = render()
+    render_ms = (time.perf_counter() - started) * 1000
+
+    print(f'{"app":>14} {"us/request":>12}')
+    print(f'{"bare":>14} {bare:>12.2f}')
+    print(f'{"metrics":>14} {instrumented:>12.2f}')
+    print(f'накладные расходы: {instrumented - bare:.2f} us/запрос')
+    print(f'/metrics: {len(text)} байт за {render_ms:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Сериализация страницы Page[PostSchema]: response_model + jsonable_encoder против app.serializers.
+
+    python -m benchmarks.bench_serialization --size 100 --rounds 200
+
+БД не нужна: посты - несохранённые ORM-объекты с категорией и тегами.
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from fastapi_pagination import Page
+from starlette.responses import JSONResponse
+
+from app.models import Category, Post, Tag
+from app.schemas import PostSchema
+from app.serializers import serializer
+from benchmarks.datagen import WORDS
+
+
+def make_posts(size, tags_per_post):
+    category = Category(title='Новости', slug='news')
+    tags = [Tag(title=f'Тег {i}', slug=f'tag-{i}') for i in range(tags_per_post)]
+    return [Post(id=i, title=f'Пост {i}', slug=f'post-{i}', text=' '.join(WORDS) * 5,
+                 category=category, tags=tags)
+            for i in range(size)]
+
+
+def make_page(posts):
+    return Page.construct(items=posts, total=len(posts) * 10, page=1, size=len(posts))
+
+
+async def pydantic_path(field, page):
+    content = await serialize_response(field=field, response_content=page, is_coroutine=True)
+    return JSONResponse(content).body
+
+
+def fast_path(page):
+    return serializer(PostSchema).dumps_page(page)
+
+
+def measure(fn, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=100)
+    parser.add_argument('--tags', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    page = make_page(make_posts(args.size, args.tags))
+    field = create_response_field(name='response', type_=Page[PostSchema])
+    loop = asyncio.new_event_loop()
+
+    slow = loop.run_until_complete(pydantic_path(field, page))
+    assert slow == fast_path(page), 'ответы различаются'
+
+    results = {
+        'pydantic': measure(lambda: loop.run_until_complete(pydantic_path(field, page)), args.rounds),
+        'orjson': measure(lambda: fast_path(page), args.rounds),
+    }
+    print(f'Page[PostSchema], {args.size} постов, {len(slow)} байт')
+    print(f'{"path":>10} {"ms/page":>10} {"pages/s":>10}')
+    for name, ms in results.items():
+        print(f'{name:>10} {ms:>10.3f} {1000 / ms:>10.1f}')
+    print(f'ускорение: x{results["pydantic"] / results["orjson"]:.1f}')
+
+
+if __name__ == '__main__':
+    main()
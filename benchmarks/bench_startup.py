@@ -0,0 +1,95 @@
+"""Холодный старт: импорт app.main, startup и первые запросы.
+
+    python -m benchmarks.bench_startup --runs 5
+    ADMIN_PANEL=off python -m benchmarks.bench_startup --runs 5
+
+Каждый прогон - отдельный процесс, иначе модули уже лежат в sys.modules.
+Запросы идут напрямую в ASGI-приложение без сети, поэтому время первого
+запроса - это подготовка роута, сессии и сериализации, а не uvicorn.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+PATHS = ['/categories/', '/posts/?size=1']
+HEAVY_MODULES = ['sqladmin', 'fastapi_mail', 'passlib']
+
+
+async def request(app, path):
+    """GET через ASGI-интерфейс приложения, возвращает код ответа."""
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+             'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+             'query_string': query.encode(), 'headers': [(b'host', b'bench')],
+             'client': ('127.0.0.1', 0), 'server': ('bench', 80)}
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+async def first_requests(app, paths):
+    timings = {}
+    await app.router.startup()
+    try:
+        for path in paths:
+            started = time.perf_counter()
+            status = await request(app, path)
+            timings[path] = (time.perf_counter() - started) * 1000
+            if status != 200:
+                print(f'{path}: {status}', file=sys.stderr)
+    finally:
+        await app.router.shutdown()
+    return timings
+
+
+def child(paths):
+    """Один холодный старт в этом процессе; результат - JSON в stdout."""
+    started = time.perf_counter()
+    from app.main import app
+    result = {'import': (time.perf_counter() - started) * 1000,
+              'loaded': [name for name in HEAVY_MODULES if name in sys.modules]}
+    result.update(asyncio.run(first_requests(app, paths)))
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--admin', action='store_true', help='добавить первый запрос к /admin/')
+    parser.add_argument('--output', help='сохранить все прогоны в JSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    paths = PATHS + (['/admin/'] if args.admin else [])
+
+    if args.child:
+        return child(paths)
+
+    command = [sys.executable, '-m', 'benchmarks.bench_startup', '--child'] + (['--admin'] if args.admin else [])
+    runs = [json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+            for _ in range(args.runs)]
+
+    print(f'{"ms":>16} {"median":>8} {"max":>8}')
+    for key in ['import', *paths]:
+        values = [run[key] for run in runs]
+        print(f'{key:>16} {statistics.median(values):>8.1f} {max(values):>8.1f}')
+    print('загружены при импорте:', ', '.join(runs[0]['loaded']) or 'ничего из ' + ', '.join(HEAVY_MODULES))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(runs, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
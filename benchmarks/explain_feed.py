@@ -0,0 +1,142 @@
+"""Проверка планов запросов ленты постов: каждый должен идти по индексу.
+
+    python -m benchmarks.explain_feed
+    python -m benchmarks.explain_feed --planner-defaults --verbose
+
+Запросы не пишутся руками, а перехватываются при вызове crud.list_posts
+с разными сортировками и фильтрами, так что проверяется ровно то, что
+выполняют роуты. План считается плохим, если в нём есть полный проход
+по posts/post_tags, отдельная сортировка или в нём не встречается
+индекс, рассчитанный на этот запрос. Исключение - фильтр по тегу: посты
+находятся диапазоном по ix_post_tags_tag_id_post_id и сортируются уже
+только они, индекса, общего для тега и даты поста, нет. На маленькой базе
+PostgreSQL честно предпочитает Seq Scan, поэтому по умолчанию seqscan
+и sort для проверки выключаются: остаётся только вопрос, есть ли у
+запроса индексный путь. С --planner-defaults проверяется реальный план
+(имеет смысл на базе из benchmarks.datagen). Код выхода 1 - есть плохие
+планы. Те же проверки на тестовой базе выполняет tests/test_feed_plans.py.
+"""
+import argparse
+import re
+import sys
+from datetime import datetime, timedelta
+
+from fastapi_pagination import Params
+from sqlalchemy import event
+
+from app import crud
+from app.database import SessionLocal, engine
+from app.models import Category, Post, Tag
+from app.slow_queries import explain
+
+TABLES = 'posts|post_tags'
+FULL_SCAN = {
+    'sqlite': re.compile(rf'^SCAN ({TABLES})$', re.M),
+    'postgresql': re.compile(rf'Seq Scan on ({TABLES})\b'),
+}
+SORT = {
+    'sqlite': re.compile('USE TEMP B-TREE FOR ORDER BY'),
+    'postgresql': re.compile(r'(^|->\s*)(Incremental )?Sort\b', re.M),
+}
+TITLE_INDEX = {'sqlite': 'sqlite_autoindex_posts_1', 'postgresql': 'posts_title_key'}
+
+
+def scenarios(db):
+    category = db.query(Category.slug).order_by(Category.posts_count.desc()).limit(1).scalar()
+    tag = db.query(Tag.slug).order_by(Tag.posts_count.desc()).limit(1).scalar()
+    author = (db.query(Post.author_id).filter(Post.author_id.isnot(None))
+              .order_by(Post.created_at.desc(), Post.id.desc()).limit(1).scalar())
+    since = datetime.utcnow() - timedelta(days=30)
+    first, deep = Params(page=1, size=20), Params(page=5, size=20)
+    feed, by_category, by_author = 'ix_posts_created_at_id', 'ix_posts_category_id_created_at_id', \
+        'ix_posts_author_id_created_at_id'
+    # (название, страница, аргументы list_posts, ожидаемый индекс, допустима ли сортировка)
+    return [
+        ('лента, newest', first, {}, feed, False),
+        ('лента, oldest, 5-я страница', deep, {'sort': 'oldest'}, feed, False),
+        ('лента, title', first, {'sort': 'title'}, TITLE_INDEX[db.get_bind().dialect.name], False),
+        ('лента, newest, курсор', first, {'cursor': True}, feed, False),
+        ('категория, newest', first, {'category': category}, by_category, False),
+        ('категория, oldest, курсор', first, {'category': category, 'sort': 'oldest', 'cursor': True},
+         by_category, False),
+        ('категория, since/until', first, {'category': category, 'since': since, 'until': datetime.utcnow()},
+         by_category, False),
+        ('категория, COUNT', first, {'category': category, 'total_mode': 'exact'}, by_category, False),
+        ('автор, newest', first, {'author': author}, by_author, False),
+        ('автор, oldest, курсор', first, {'author': author, 'sort': 'oldest', 'cursor': True}, by_author, False),
+        ('тег, newest', first, {'tag': tag}, 'ix_post_tags_tag_id_post_id', True),
+    ]
+
+
+def capture(db, params, options):
+    """SELECT-запросы одного вызова list_posts: [(sql, параметры)]."""
+    options = {'total_mode': 'none', **options}
+    if options.pop('cursor', False):
+        page = crud.list_posts(db, params, **options)
+        options['cursor'] = page.next_cursor
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', collect)
+    try:
+        crud.list_posts(db, params, **options)
+    finally:
+        event.remove(engine, 'before_cursor_execute', collect)
+    return statements
+
+
+def check(conn, db, params, options, index, sort_allowed):
+    """Планы запросов сценария: ([(запрос, план, плохой ли)], встречается ли в них index)."""
+    dialect = conn.dialect.name
+    plans = []
+    for statement, parameters in capture(db, params, options):
+        plan = explain(conn, statement, parameters) or ''
+        bad = bool(FULL_SCAN[dialect].search(plan) or (not sort_allowed and SORT[dialect].search(plan)))
+        plans.append((statement, plan, bad))
+    return plans, any(index in plan for _, plan, _ in plans)
+
+
+def planner_without_shortcuts(conn):
+    """На PostgreSQL выключает seqscan и sort: остаётся вопрос, есть ли у запроса индексный путь."""
+    if conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql('SET enable_seqscan = off')
+        conn.exec_driver_sql('SET enable_sort = off')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--planner-defaults', action='store_true',
+                        help='не выключать seqscan и sort на PostgreSQL')
+    parser.add_argument('--verbose', action='store_true', help='печатать планы всех запросов')
+    args = parser.parse_args()
+
+    dialect = engine.dialect.name
+    if dialect not in FULL_SCAN:
+        sys.exit(f'Проверка планов не поддерживает {dialect}')
+    db = SessionLocal()
+    failed = 0
+    try:
+        with engine.connect() as conn:
+            if not args.planner_defaults:
+                planner_without_shortcuts(conn)
+            for name, params, options, index, sort_allowed in scenarios(db):
+                plans, uses_index = check(conn, db, params, options, index, sort_allowed)
+                for statement, plan, bad in plans:
+                    failed += bad
+                    print(f'{"FAIL" if bad else "ok":>4}  {name}: {" ".join(statement.split())[:90]}')
+                    if bad or args.verbose:
+                        print('      ' + plan.replace('\n', '\n      '))
+                if not uses_index:
+                    failed += 1
+                    print(f'FAIL  {name}: ни один запрос не использует {index}')
+    finally:
+        db.close()
+    if failed:
+        sys.exit(f'Запросов без индекса: {failed}')
+
+
+if __name__ == '__main__':
+    main()
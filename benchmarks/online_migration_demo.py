@@ -0,0 +1,133 @@
+"""Заполнение новой колонки на большой таблице без остановки записи.
+
+    python -m benchmarks.online_migration_demo --rows 1000000
+    python -m benchmarks.online_migration_demo --stop-after 300000   # «падение» посередине
+    python -m benchmarks.online_migration_demo --keep                # продолжение с места остановки
+
+В синтетической таблице demo_posts(id, title) выполняется то же, что
+делала бы ревизия через app/migrations/online.py: добавляется пустая
+колонка slug, заполняется пачками по id, затем строится уникальный индекс
+(на PostgreSQL - CONCURRENTLY). Параллельно поток-писатель вставляет и
+обновляет строки, как это делало бы приложение, и замеряет, сколько его
+запросы ждали блокировок. Без --keep таблица создаётся заново.
+"""
+import argparse
+import logging
+import random
+import statistics
+import threading
+import time
+
+import sqlalchemy as sa
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+from app.database import engine
+from app.migrations import online
+
+TABLE = 'demo_posts'
+BACKFILL = 'demo_posts:slug'
+SLUG = "lower(replace(title, ' ', '-')) || '-' || id"
+WORDS = ['fast', 'api', 'blog', 'post', 'index', 'query', 'cache', 'slug', 'schema', 'online']
+INSERT_BATCH = 50000
+
+
+class Interrupted(Exception):
+    pass
+
+
+def create_table(rows):
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f'DROP TABLE IF EXISTS {TABLE}')
+        conn.exec_driver_sql(f'CREATE TABLE {TABLE} (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL)')
+        conn.exec_driver_sql(online.PROGRESS_DDL)
+        conn.execute(online.PROGRESS_TABLE.delete().where(online.PROGRESS_TABLE.c.name == BACKFILL))
+        insert = sa.text(f'INSERT INTO {TABLE} (id, title) VALUES (:id, :title)')
+        for start in range(1, rows + 1, INSERT_BATCH):
+            conn.execute(insert, [{'id': i, 'title': f'{random.choice(WORDS)} {random.choice(WORDS)} {i % 997}'}
+                                  for i in range(start, min(start + INSERT_BATCH, rows + 1))])
+    print(f'{TABLE}: {rows} строк за {time.perf_counter() - started:.1f}s')
+
+
+def writer(stop, latencies):
+    """Запись приложения: новые строки и правки старых, время каждого запроса."""
+    with engine.connect() as conn:
+        while not stop.is_set():
+            started = time.perf_counter()
+            with conn.begin():
+                top = conn.exec_driver_sql(f'SELECT max(id) FROM {TABLE}').scalar()
+                # Новые посты приложение создаёт уже со slug
+                conn.execute(sa.text(f'INSERT INTO {TABLE} (id, title, slug) VALUES (:id, :title, :slug)'),
+                             {'id': top + 1, 'title': 'new post', 'slug': f'new-post-{top + 1}'})
+                conn.execute(sa.text(f'UPDATE {TABLE} SET title = title WHERE id = :id'),
+                             {'id': random.randint(1, top)})
+            latencies.append(time.perf_counter() - started)
+            time.sleep(0.01)
+
+
+def reporter(stop_after):
+    last = [0.0]
+
+    def report(name, done, total, elapsed):
+        if elapsed - last[0] >= 1 or done >= total:
+            online.log_progress(name, done, total, elapsed)
+            last[0] = elapsed
+        if stop_after and done >= stop_after:
+            raise Interrupted(done)
+    return report
+
+
+def migrate(args, on_column_added):
+    with engine.connect() as conn:
+        context = MigrationContext.configure(conn)
+        with Operations.context(context):
+            if 'slug' not in {column['name'] for column in sa.inspect(conn).get_columns(TABLE)}:
+                online.add_nullable_column(TABLE, sa.Column('slug', sa.String(250), nullable=True))
+            on_column_added()
+            updated = online.backfill(TABLE, {'slug': SLUG}, where='slug IS NULL', name=BACKFILL,
+                                      batch_size=args.batch, rows_per_second=args.rate,
+                                      report=reporter(args.stop_after), report_interval=0)
+            print(f'Заполнено строк: {updated}')
+            started = time.perf_counter()
+            online.create_index_concurrently(f'ix_{TABLE}_slug', TABLE, ['slug'], unique=True)
+            print(f'Индекс построен за {time.perf_counter() - started:.1f}s')
+        return conn.exec_driver_sql(f'SELECT count(*) FROM {TABLE} WHERE slug IS NULL').scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=5000)
+    parser.add_argument('--rate', type=int, default=0, help='ограничение, строк в секунду (0 - нет)')
+    parser.add_argument('--stop-after', type=int, default=0, help='прервать заполнение после N строк')
+    parser.add_argument('--keep', action='store_true', help='не пересоздавать таблицу, продолжить заполнение')
+    parser.add_argument('--no-writer', action='store_true', help='без параллельной записи')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if not args.keep:
+        create_table(args.rows)
+    stop, latencies = threading.Event(), []
+    thread = threading.Thread(target=writer, args=(stop, latencies), daemon=True)
+    started = time.perf_counter()
+    try:
+        try:
+            # Писатель вставляет строки со slug, поэтому стартует после появления колонки
+            remaining = migrate(args, (lambda: None) if args.no_writer else thread.start)
+        finally:
+            stop.set()
+            if thread.is_alive():
+                thread.join()
+    except Interrupted as error:
+        print(f'Прервано после {error.args[0]} строк, продолжение: --keep')
+        return
+    print(f'Миграция: {time.perf_counter() - started:.1f}s, строк без slug: {remaining}')
+    if latencies:
+        latencies.sort()
+        print(f'Запись приложения: {len(latencies)} транзакций, медиана {statistics.median(latencies) * 1000:.1f}ms, '
+              f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms, максимум {latencies[-1] * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
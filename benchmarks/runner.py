@@ -0,0 +1,137 @@
+"""Прогон сценариев и отчёт: пропускная способность и p50/p95/p99.
+
+    # против запущенного сервиса
+    python -m benchmarks.runner --url http://localhost:8000 --output results/pg.json
+    # в том же процессе через ASGI, БД берётся из DATABASE_URL
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.runner --output results/sqlite.json
+    # сравнение с прошлым прогоном
+    python -m benchmarks.runner --compare results/old.json results/new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+
+import httpx
+
+from benchmarks.scenarios import SCENARIOS, prepare
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def run_scenario(client, ctx, scenario, duration, concurrency):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await scenario(client, ctx)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def make_client(url):
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=60)
+    from app.main import app
+    return httpx.AsyncClient(app=app, base_url='http://bench', timeout=60)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    names = args.scenarios or list(SCENARIOS)
+    results = {}
+    async with make_client(args.url) as client:
+        ctx = await prepare(client)
+        for name in names:
+            results[name] = await run_scenario(client, ctx, SCENARIOS[name], args.duration, args.concurrency)
+            print_row(name, results[name])
+    return {
+        'commit': git_commit(),
+        'date': datetime.utcnow().isoformat(),
+        'target': args.url or 'asgi',
+        'database': (os.getenv('DATABASE_URL') or '').split(':', 1)[0],
+        'python': platform.python_version(),
+        'duration': args.duration,
+        'concurrency': args.concurrency,
+        'results': results,
+    }
+
+
+def print_header():
+    print(f'{"scenario":<22} {"req":>7} {"err":>5} {"rps":>9} {"p50ms":>8} {"p95ms":>8} {"p99ms":>8}')
+
+
+def print_row(name, row):
+    print(f'{name:<22} {row["requests"]:>7} {row["errors"]:>5} {row["rps"]:>9.1f} '
+          f'{row["p50_ms"]:>8.2f} {row["p95_ms"]:>8.2f} {row["p99_ms"]:>8.2f}')
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f'{old["commit"]} -> {new["commit"]}')
+    print(f'{"scenario":<22} {"rps":>18} {"p99ms":>18}')
+    for name, row in new['results'].items():
+        before = old['results'].get(name)
+        if before is None:
+            continue
+        print(f'{name:<22} {before["rps"]:>8.1f} {row["rps"]:>8.1f} '
+              f'{before["p99_ms"]:>8.2f} {row["p99_ms"]:>8.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='адрес сервиса; без него приложение запускается в процессе')
+    parser.add_argument('--duration', type=float, default=10, help='секунд на сценарий')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--scenarios', nargs='*', choices=list(SCENARIOS))
+    parser.add_argument('--output', help='куда сохранить результаты в JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    print_header()
+    report = asyncio.run(run(args))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Сценарии нагрузки: по одному на каждый роут app/routes.py.
+
+Сценарий - корутина (client, ctx) -> httpx.Response. ctx собирается
+один раз перед прогоном в prepare() и содержит токен, слаги и фильтры.
+Коды активации сценарий activate_user читает из БД (DATABASE_URL должен
+указывать на базу сервиса): неактивные пользователи из datagen --inactive
+и зарегистрированные сценарием register_user.
+"""
+import random
+import uuid
+
+import sqlalchemy as sa
+from starlette.concurrency import run_in_threadpool
+
+from app.database import engine
+from app.models import User
+from benchmarks.datagen import PASSWORD, WORDS
+
+LOGIN_EMAIL = 'user0@example.com'
+
+
+async def prepare(client):
+    ctx = {}
+    response = await client.post('/login/', json={'email': LOGIN_EMAIL, 'password': PASSWORD})
+    response.raise_for_status()
+    ctx['headers'] = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+    ctx['categories'] = [c['slug'] for c in (await client.get('/categories/')).json()]
+    page = (await client.get('/posts/', params={'size': 100})).json()
+    ctx['slugs'] = [post['slug'] for post in page['items']]
+    ctx['tags'] = sorted({tag['slug'] for post in page['items'] for tag in post.get('tags', [])})
+    ctx['cursor'] = page.get('next_cursor')
+    ctx['own'] = []
+    ctx['activation_codes'] = await run_in_threadpool(activation_codes)
+    ctx['activated'] = set()
+    return ctx
+
+
+def activation_codes(limit=10000):
+    with engine.connect() as conn:
+        return [code for code, in conn.execute(sa.select(User.activation_code)
+                                               .where(User.is_active.is_(False), User.activation_code != '')
+                                               .limit(limit))]
+
+
+async def categories_list(client, ctx):
+    return await client.get('/categories/')
+
+
+async def posts_list(client, ctx):
+    return await client.get('/posts/', params={'page': random.randint(1, 20)})
+
+
+async def posts_list_category(client, ctx):
+    return await client.get('/posts/', params={'category': random.choice(ctx['categories'])})
+
+
+async def posts_list_tag(client, ctx):
+    return await client.get('/posts/', params={'tag': random.choice(ctx['tags'])})
+
+
+async def posts_list_search(client, ctx):
+    return await client.get('/posts/', params={'q': random.choice(WORDS)})
+
+
+async def posts_list_cursor(client, ctx):
+    return await client.get('/posts/', params={'cursor': ctx['cursor']})
+
+
+async def post_details(client, ctx):
+    return await client.get(f'/posts/{random.choice(ctx["slugs"])}/')
+
+
+async def create_post(client, ctx):
+    response = await client.post('/posts/', headers=ctx['headers'], json={
+        'title': f'Bench {uuid.uuid4().hex}',
+        'text': ' '.join(random.choices(WORDS, k=200)),
+        'category_id': random.choice(ctx['categories']),
+    })
+    if response.status_code == 201:
+        ctx['own'].append(response.json()['slug'])
+    return response
+
+
+async def update_post(client, ctx):
+    if not ctx['own']:
+        return await create_post(client, ctx)
+    return await client.patch(f'/posts/{random.choice(ctx["own"])}/', headers=ctx['headers'],
+                              json={'text': ' '.join(random.choices(WORDS, k=200))})
+
+
+async def delete_post(client, ctx):
+    if not ctx['own']:
+        return await create_post(client, ctx)
+    return await client.delete(f'/posts/{ctx["own"].pop()}/', headers=ctx['headers'])
+
+
+async def login(client, ctx):
+    # Все запросы идут с одного IP и email: поднимите AUTH_THROTTLE_* у сервиса, иначе сценарий меряет 429
+    return await client.post('/login/', json={'email': LOGIN_EMAIL, 'password': PASSWORD})
+
+
+async def register_user(client, ctx):
+    # Тот же лимит AUTH_THROTTLE_* по IP, что и у login
+    return await client.post('/register/', json={
+        'email': f'bench-{uuid.uuid4().hex[:16]}@example.com',
+        'name': 'bench',
+        'password': PASSWORD,
+        'password_confirm': PASSWORD,
+    })
+
+
+async def activate_user(client, ctx):
+    if not ctx['activation_codes']:
+        # Коды, запросы с которыми ещё идут, в БД пока не погашены
+        ctx['activation_codes'] = [code for code in await run_in_threadpool(activation_codes)
+                                   if code not in ctx['activated']]
+    if not ctx['activation_codes']:
+        return await register_user(client, ctx)
+    code = ctx['activation_codes'].pop()
+    ctx['activated'].add(code)
+    return await client.get(f'/activate/{code}/')
+
+
+SCENARIOS = {
+    'categories_list': categories_list,
+    'posts_list': posts_list,
+    'posts_list_category': posts_list_category,
+    'posts_list_tag': posts_list_tag,
+    'posts_list_search': posts_list_search,
+    'posts_list_cursor': posts_list_cursor,
+    'post_details': post_details,
+    'create_post': create_post,
+    'update_post': update_post,
+    'delete_post': delete_post,
+    'login': login,
+    'register_user': register_user,
+    'activate_user': activate_user,
+}
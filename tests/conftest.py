@@ -0,0 +1,120 @@
+"""Общие фикстуры: приложение на отдельной SQLite-базе во временном каталоге.
+
+Настройки читаются при импорте app, поэтому окружение задаётся здесь,
+до первого импорта. Другую базу можно указать в TEST_DATABASE_URL - все
+таблицы в ней пересоздаются.
+"""
+import asyncio
+import os
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix='fastapi_blog_tests_')
+os.environ['DATABASE_URL'] = os.getenv('TEST_DATABASE_URL', f'sqlite:///{TEST_DIR}/test.db')
+os.environ.pop('ASYNC_DATABASE_URL', None)
+os.environ['REPLICA_URLS'] = ''
+for name, value in {
+    'SECRET_KEY': 'test-secret',
+    'REFRESH_SECRET_KEY': 'test-refresh-secret',
+    'ALGORITHM': 'HS256',
+    'EMAIL_USER': 'blog',
+    'EMAIL_PASSWORD': 'secret',
+    'EMAIL_FROM': 'blog@example.com',
+    'EMAIL_HOST': 'localhost',
+    'EMAIL_PORT': '8025',
+    'BCRYPT_ROUNDS': '4',
+    'SLOW_QUERY_MS': '0',
+}.items():
+    os.environ.setdefault(name, value)
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+from app.auth import create_access_token  # noqa: E402
+from app.cache import response_cache  # noqa: E402
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import Category, Post, Tag, User  # noqa: E402
+from app.query_stats import count_queries  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    response_cache.clear()
+
+
+class Client:
+    """Запросы к приложению в том же контексте, что и тест, - их SQL видит count_queries."""
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def request(self, method, url, token=None, **kwargs):
+        async def send():
+            async with httpx.AsyncClient(app=app, base_url='http://test') as client:
+                return await client.request(method, url, **kwargs)
+
+        if token is not None:
+            kwargs['headers'] = {**kwargs.get('headers', {}), 'Authorization': f'Bearer {token}'}
+        return self.loop.run_until_complete(send())
+
+    def counted(self, method, url, **kwargs):
+        """Ответ и число SQL-запросов, выполненных при его обработке."""
+        with count_queries() as stats:
+            response = self.request(method, url, **kwargs)
+        return response, stats.count
+
+
+@pytest.fixture
+def client(loop):
+    return Client(loop)
+
+
+@pytest.fixture
+def user(db):
+    user = User(email=f'author{db.query(User).count()}@example.com', name='Автор', password='x',
+                is_active=True, activation_code='')
+    db.add(user)
+    db.commit()
+    return user
+
+
+@pytest.fixture
+def token(user):
+    return create_access_token(str(user.id))
+
+
+@pytest.fixture
+def posts(db, user):
+    """Категория, теги и 30 постов с двумя тегами у каждого."""
+    category = db.get(Category, 'python') or Category(slug='python', title='Python')
+    tags = [db.get(Tag, slug) or Tag(slug=slug, title=slug) for slug in ('orm', 'sql', 'async')]
+    created = []
+    for index in range(30):
+        post = Post(title=f'Пост {user.id}-{index}', slug=f'post-{user.id}-{index}', text='Текст поста ' * 20,
+                    category=category, author_id=user.id, tags=[tags[index % 3], tags[(index + 1) % 3]])
+        db.add(post)
+        created.append(post)
+    db.commit()
+    return created
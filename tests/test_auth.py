@@ -0,0 +1,32 @@
+import pytest
+
+from app import settings
+from app.auth import create_access_token
+
+
+@pytest.mark.parametrize('fast_json', [False, True])
+def test_register_does_not_leak_password(client, monkeypatch, fast_json):
+    monkeypatch.setattr(settings, 'FAST_JSON', fast_json)
+    email = f'reader{int(fast_json)}@example.com'
+    response = client.request('POST', '/register/', json={
+        'email': email, 'name': 'Читатель', 'password': 'secret-password', 'password_confirm': 'secret-password'})
+    assert response.status_code == 201, response.text
+    body = response.json()
+    assert body['email'] == email
+    assert set(body) == {'id', 'email', 'name', 'is_active', 'is_admin'}
+    assert 'secret-password' not in response.text
+    assert '$2b$' not in response.text
+
+
+@pytest.mark.parametrize('claims, status', [(True, 200), (False, 403)])
+def test_token_claims_only_with_setting(client, db, user, monkeypatch, tmp_path, claims, status):
+    monkeypatch.setattr(settings, 'SLOW_QUERY_LOG', str(tmp_path / 'slow.log'))
+    user.is_admin = True
+    db.commit()
+    monkeypatch.setattr(settings, 'AUTH_TOKEN_CLAIMS', True)
+    token = create_access_token(str(user.id), user)
+    user.is_admin = False
+    db.commit()
+    # С данными в токене права проверяются по нему до истечения, без - по БД
+    monkeypatch.setattr(settings, 'AUTH_TOKEN_CLAIMS', claims)
+    assert client.request('GET', '/slow-queries/', token=token).status_code == status
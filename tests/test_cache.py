@@ -0,0 +1,39 @@
+from starlette.requests import Request
+
+from app import cache
+from app.cache import ResponseCache
+
+
+def make_request(path='/posts/first/'):
+    return Request({'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': []})
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    response_cache = ResponseCache(1024, ttl=60)
+    response_cache.set(make_request(), {'title': 'Первый'}, tags=['post:first'])
+    now[0] += 59
+    assert response_cache.get(make_request()).headers['X-Cache'] == 'HIT'
+    now[0] += 1
+    assert response_cache.get(make_request()) is None
+    assert response_cache.stats()['expired'] == 1
+    assert response_cache.stats()['entries'] == 0
+
+
+def test_zero_ttl_disables_cache():
+    response_cache = ResponseCache(1024, ttl=0)
+    response = response_cache.set(make_request(), {'title': 'Первый'}, tags=['post:first'])
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response_cache.get(make_request()) is None
+
+
+def test_commit_invalidates_tags(client, db, posts):
+    url = f'/posts/{posts[0].slug}/'
+    assert client.request('GET', url).headers['X-Cache'] == 'MISS'
+    assert client.request('GET', url).headers['X-Cache'] == 'HIT'
+    posts[0].text = 'Новый текст'
+    db.commit()
+    response = client.request('GET', url)
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.json()['text'] == 'Новый текст'
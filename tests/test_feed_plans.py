@@ -0,0 +1,26 @@
+"""Запросы ленты постов идут по индексам из app/models.py (проверки benchmarks.explain_feed)."""
+from benchmarks.explain_feed import check, planner_without_shortcuts, scenarios
+from app.database import engine
+from app.models import Post, through_table
+
+
+def test_feed_indexes_are_declared(db, posts):
+    declared = {index.name for table in (Post.__table__, through_table) for index in table.indexes}
+    expected = {index for _, _, _, index, _ in scenarios(db)}
+    # Кроме уникального индекса по заголовку, его создаёт ограничение unique=True
+    assert expected - declared == {'sqlite_autoindex_posts_1' if engine.dialect.name == 'sqlite'
+                                   else 'posts_title_key'}
+
+
+def test_feed_queries_use_indexes(db, posts):
+    failures = []
+    with engine.connect() as conn:
+        planner_without_shortcuts(conn)
+        for name, params, options, index, sort_allowed in scenarios(db):
+            plans, uses_index = check(conn, db, params, options, index, sort_allowed)
+            assert plans, name
+            failures.extend(f'{name}: {" ".join(statement.split())}\n{plan}'
+                            for statement, plan, bad in plans if bad)
+            if not uses_index:
+                failures.append(f'{name}: ни один запрос не использует {index}')
+    assert not failures, '\n\n'.join(failures)
@@ -0,0 +1,118 @@
+"""Отправка outbox через настоящий SMTP-сервер (aiosmtpd) на localhost."""
+import asyncio
+import logging
+import socket
+from types import SimpleNamespace
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app import mail_worker, settings
+from app.models import EmailOutbox
+
+
+class Handler:
+    def __init__(self):
+        self.messages = []
+        self.reject = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.reject:
+            self.reject -= 1
+            return '451 Попробуйте позже'
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    handler = Handler()
+    controller = Controller(handler, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    monkeypatch.setattr(mail_worker, 'get_conf', lambda: SimpleNamespace(
+        MAIL_SERVER=controller.hostname, MAIL_PORT=controller.port, MAIL_SSL=False, MAIL_TLS=False,
+        VALIDATE_CERTS=False, USE_CREDENTIALS=False, MAIL_FROM='blog@example.com'))
+    yield handler
+    controller.stop()
+
+
+@pytest.fixture
+def outbox(db):
+    db.query(EmailOutbox).delete()
+    db.add_all([EmailOutbox(recipient=f'user{index}@example.com', subject='Активация', body=f'Код {index}')
+                for index in range(3)])
+    db.commit()
+    return db
+
+
+def drain(loop, concurrency=2):
+    async def run():
+        connections = [mail_worker.Connection() for _ in range(concurrency)]
+        try:
+            return await mail_worker.drain_once(connections)
+        finally:
+            for connection in connections:
+                await connection.close()
+    return loop.run_until_complete(run())
+
+
+def statuses(db):
+    db.expire_all()
+    return {row.recipient: (row.status, row.attempts) for row in db.query(EmailOutbox)}
+
+
+def test_delivery(loop, smtp, outbox):
+    assert drain(loop) == 3
+    assert sorted(envelope.rcpt_tos[0] for envelope in smtp.messages) == [
+        'user0@example.com', 'user1@example.com', 'user2@example.com']
+    assert set(statuses(outbox).values()) == {('sent', 1)}
+    assert drain(loop) == 0
+
+
+def test_retry_after_temporary_error(loop, smtp, outbox, monkeypatch):
+    monkeypatch.setattr(settings, 'EMAIL_RETRY_BASE', 0)
+    smtp.reject = 1
+    assert drain(loop, concurrency=1) == 3
+    first = statuses(outbox)
+    assert sorted(status for status, _ in first.values()) == ['pending', 'sent', 'sent']
+    assert drain(loop, concurrency=1) == 1
+    assert set(statuses(outbox).values()) == {('sent', 1), ('sent', 2)}
+    assert len(smtp.messages) == 3
+
+
+def test_failed_after_max_attempts(loop, smtp, outbox, monkeypatch):
+    monkeypatch.setattr(settings, 'EMAIL_RETRY_BASE', 0)
+    monkeypatch.setattr(settings, 'EMAIL_MAX_ATTEMPTS', 2)
+    smtp.reject = 6
+    drain(loop)
+    drain(loop)
+    assert set(statuses(outbox).values()) == {('failed', 2)}
+    assert drain(loop) == 0
+    row = outbox.query(EmailOutbox).first()
+    assert row.last_error and '451' in row.last_error
+
+
+def test_run_survives_batch_errors(loop, monkeypatch, caplog):
+    calls = []
+
+    async def drain_once(connections):
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise OSError('БД недоступна')
+        if len(calls) == 3:
+            raise asyncio.CancelledError
+        return 0
+
+    monkeypatch.setattr(mail_worker, 'drain_once', drain_once)
+    monkeypatch.setattr(mail_worker, 'Connection', lambda: SimpleNamespace(close=lambda: asyncio.sleep(0)))
+    monkeypatch.setattr(settings, 'EMAIL_POLL_INTERVAL', 0.001)
+    with caplog.at_level(logging.ERROR, logger=mail_worker.__name__), pytest.raises(asyncio.CancelledError):
+        loop.run_until_complete(mail_worker.run())
+    assert len(calls) == 3
+    assert 'БД недоступна' in caplog.text
@@ -0,0 +1,85 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app import crud
+from app.models import Post
+
+
+class UniqueViolation(Exception):
+    constraint_name = 'ix_posts_slug'
+
+
+def integrity_error(orig):
+    return IntegrityError('INSERT INTO posts ...', {}, orig)
+
+
+def sqlite_error(*statements):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute('CREATE TABLE categories (slug TEXT PRIMARY KEY)')
+    conn.execute('CREATE TABLE posts (id INTEGER PRIMARY KEY, title TEXT UNIQUE, slug TEXT, '
+                 'category_id TEXT REFERENCES categories (slug))')
+    conn.execute('CREATE UNIQUE INDEX ix_posts_slug ON posts (slug)')
+    with pytest.raises(sqlite3.IntegrityError) as error:
+        for statement in statements:
+            conn.execute(statement)
+    return integrity_error(error.value)
+
+
+def test_violated_constraint_sqlite():
+    insert = "INSERT INTO posts (title, slug) VALUES ('{}', '{}')"
+    assert crud.violated_constraint(sqlite_error(insert.format('a', 'a'), insert.format('a', 'b'))) == 'posts.title'
+    assert crud.violated_constraint(sqlite_error(insert.format('a', 'a'), insert.format('b', 'a'))) == 'posts.slug'
+    error = sqlite_error("INSERT INTO posts (title, slug, category_id) VALUES ('a', 'a', 'missing')")
+    assert crud.violates(error, crud.POST_CATEGORY_FK)
+
+
+def test_violated_constraint_postgres():
+    psycopg2_error = SimpleNamespace(diag=SimpleNamespace(constraint_name='posts_title_key'), __cause__=None)
+    assert crud.violates(integrity_error(psycopg2_error), crud.POST_TITLE_UNIQUE)
+    asyncpg_error = Exception('duplicate key value violates unique constraint "ix_posts_slug"')
+    asyncpg_error.__cause__ = UniqueViolation()
+    assert crud.violates(integrity_error(asyncpg_error), crud.POST_SLUG_UNIQUE)
+    # Имя колонки в тексте ошибки чужого ограничения не должно совпадать
+    other = SimpleNamespace(diag=SimpleNamespace(constraint_name='posts_title_slug_check'), __cause__=None)
+    assert not crud.violates(integrity_error(other), crud.POST_TITLE_UNIQUE)
+    assert not crud.violates(integrity_error(other), crud.POST_SLUG_UNIQUE)
+
+
+def test_post_conflict_reraises_unknown_errors():
+    error = integrity_error(sqlite3.IntegrityError('NOT NULL constraint failed: posts.text'))
+    with pytest.raises(IntegrityError):
+        crud.post_conflict(error)
+    assert crud.post_conflict(sqlite_error("INSERT INTO posts (title, slug, category_id) VALUES ('a', 'a', 'x')")
+                              ).detail == crud.CATEGORY_NOT_FOUND
+
+
+def test_free_slug_suffixes(db, posts):
+    db.add_all([Post(title=title, slug=slug, text='', author_id=posts[0].author_id)
+                for title, slug in (('Слаг', 'slag'), ('Слаг 2', 'slag-2'), ('Слаг 10', 'slag-10'),
+                                    ('Слаги', 'slag-i'), ('Слаговый', 'slagovyi'))])
+    db.commit()
+    assert crud.free_slug(db, 'Слаг!') == 'slag-11'
+    assert crud.free_slug(db, 'Слаг') is None
+    assert crud.free_slug(db, 'Слаговая') == 'slagovaia'
+
+
+def test_create_post_errors(client, posts, token):
+    taken = {'title': posts[0].title, 'text': 'Текст', 'category_id': 'python'}
+    response = client.request('POST', '/posts/', token=token, json=taken)
+    assert response.status_code == 400
+    assert response.json()['detail'] == crud.TITLE_TAKEN
+    response = client.request('PATCH', f'/posts/{posts[1].slug}/', token=token, json={'title': posts[0].title})
+    assert response.status_code == 400
+    assert response.json()['detail'] == crud.TITLE_TAKEN
+
+
+def test_create_post_unknown_category(client, posts, token):
+    data = {'title': 'Пост без категории', 'text': 'Текст', 'category_id': 'missing'}
+    response = client.request('POST', '/posts/', token=token, json=data)
+    assert response.status_code == 400
+    assert response.json()['detail'] == crud.CATEGORY_NOT_FOUND
+    assert client.request('GET', '/posts/post-bez-kategorii/').status_code == 404
@@ -0,0 +1,60 @@
+"""Число SQL-запросов на основных роутах постов: без N+1 по тегам и категориям."""
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.query_stats import count_queries
+
+# Страница: COUNT, посты с категорией, теги всех постов страницы одним selectin
+LIST_QUERIES = 3
+# Пост с категорией и автором, теги
+DETAILS_QUERIES = 2
+# Автор по токену, категория (только SQLite), свободный слаг, вставка, счётчики фасетов во flush, пост для ответа
+CREATE_QUERIES = 9
+
+
+def test_posts_list(client, posts):
+    response, queries = client.counted('GET', '/posts/', params={'size': 20})
+    assert response.status_code == 200
+    assert len(response.json()['items']) == 20
+    assert queries <= LIST_QUERIES
+
+
+def test_posts_list_by_cursor(client, posts):
+    first = client.request('GET', '/posts/', params={'size': 10, 'cursor': ''}).json()
+    response, queries = client.counted('GET', '/posts/', params={'size': 10, 'cursor': first['next_cursor']})
+    assert response.status_code == 200
+    assert len(response.json()['items']) == 10
+    assert queries <= LIST_QUERIES
+
+
+def test_post_details(client, posts):
+    response, queries = client.counted('GET', f'/posts/{posts[0].slug}/')
+    assert response.status_code == 200
+    assert len(response.json()['tags']) == 2
+    assert queries <= DETAILS_QUERIES
+
+
+def test_cached_post_details(client, posts):
+    client.request('GET', f'/posts/{posts[0].slug}/')
+    response, queries = client.counted('GET', f'/posts/{posts[0].slug}/')
+    assert response.status_code == 200
+    assert queries == 0
+
+
+def test_create_post(client, posts, token):
+    response, queries = client.counted('POST', '/posts/', token=token,
+                                       json={'title': 'Новый пост', 'text': 'Текст', 'category_id': 'python'})
+    assert response.status_code == 201
+    assert queries <= CREATE_QUERIES
+
+
+def test_failed_query_leaves_nothing_on_connection(db):
+    with count_queries() as stats:
+        with pytest.raises(OperationalError):
+            db.execute(text('SELECT * FROM missing'))
+        db.rollback()
+        db.execute(text('SELECT 1'))
+        info = dict(db.connection().info)
+    assert stats.count == 1
+    assert not [key for key in info if key.endswith('start_time')]
@@ -0,0 +1,69 @@
+import sqlalchemy as sa
+
+from app import crud, related, settings
+from app.database import engine
+from app.models import Post, related_posts
+from app.related import related_updater
+from app.schemas import ImportPostSchema
+
+
+def stored_lists(conn):
+    return conn.execute(sa.select(related_posts).order_by(related_posts.c.post_id, related_posts.c.rank)).all()
+
+
+def matches_rebuild():
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            before = stored_lists(conn)
+            related.rebuild_python(conn)
+            return stored_lists(conn) == before
+        finally:
+            transaction.rollback()
+
+
+def test_lists_updated_after_commit(db, client, posts, user):
+    related_updater.flush()
+    post = Post(title=f'Похожий пост {user.id}', slug=f'similar-{user.id}', text='Текст', category=posts[0].category,
+                author_id=user.id, tags=posts[0].tags)
+    db.add(post)
+    db.commit()
+    assert related_updater.pending
+    assert client.request('GET', f'/posts/{post.slug}/related/').json() == []
+    assert related_updater.flush()
+    response = client.request('GET', f'/posts/{post.slug}/related/')
+    assert len(response.json()) == settings.RELATED_POSTS_LIMIT
+    assert matches_rebuild()
+
+
+def test_rollback_not_queued(db, posts):
+    related_updater.flush()
+    posts[0].tags = posts[0].tags[:1]
+    db.flush()
+    db.rollback()
+    assert not related_updater.pending
+
+
+def test_deleted_post_removed_from_lists(db, posts):
+    related_updater.flush()
+    post_id = posts[0].id
+    db.delete(posts[0])
+    db.commit()
+    related_updater.flush()
+    assert not db.execute(sa.select(related_posts).where(sa.or_(related_posts.c.post_id == post_id,
+                                                                related_posts.c.related_id == post_id))).all()
+    assert matches_rebuild()
+
+
+def test_import_updates_lists_once(db, posts, user):
+    related_updater.flush()
+    rows = [(line, ImportPostSchema(title=f'Импорт {user.id}-{line}', text='Текст', category_id='python',
+                                    tags=['orm', 'async']))
+            for line in range(1, 6)]
+    imported, errors = crud.import_posts(db, rows, user.id)
+    assert imported == 5 and not errors
+    ids = [post_id for post_id, in db.query(Post.id).filter(Post.title.like(f'Импорт {user.id}-%'))]
+    assert not db.execute(sa.select(related_posts).where(related_posts.c.post_id.in_(ids))).all()
+    assert related_updater.flush() >= 5
+    assert len(db.execute(sa.select(related_posts).where(related_posts.c.post_id.in_(ids))).all()) == 5 * 5
+    assert matches_rebuild()
@@ -0,0 +1,29 @@
+import pytest
+from sqlalchemy import exc, text
+
+from app import settings
+from app.replicas import Replica
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'DB_ASYNC', False)
+    replica = Replica('replica', f'sqlite:///{tmp_path}/replica.db')
+    yield replica
+    replica.engine.dispose()
+
+
+def test_query_error_keeps_replica(replica):
+    # "no such table" - OperationalError без разрыва соединения, как таймаут запроса
+    with pytest.raises(exc.OperationalError):
+        with replica.engine.connect() as conn:
+            conn.execute(text('SELECT * FROM missing'))
+    assert replica.healthy
+
+
+def test_connection_error_marks_replica_down(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'DB_ASYNC', False)
+    replica = Replica('replica', f'sqlite:///{tmp_path}/missing/replica.db')
+    with pytest.raises(exc.OperationalError):
+        replica.engine.connect()
+    assert not replica.healthy
@@ -0,0 +1,48 @@
+import json
+import logging
+import os
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+from app import settings, slow_queries
+
+
+def write(handler, record):
+    handler.emit(logging.makeLogRecord({'msg': json.dumps(record), 'levelno': logging.WARNING}))
+
+
+def test_log_file_per_process(tmp_path, monkeypatch):
+    path = str(tmp_path / 'slow.log')
+    monkeypatch.setattr(settings, 'SLOW_QUERY_LOG', path)
+    parent = os.getpid()
+    handler = slow_queries.ProcessRotatingFileHandler(path, maxBytes=1024, backupCount=1, encoding='utf-8')
+    try:
+        write(handler, {'time': '2026-01-01T00:00:01', 'route': '/posts/'})
+        # Тот же обработчик в дочернем процессе после fork
+        monkeypatch.setattr(os, 'getpid', lambda: parent + 1)
+        write(handler, {'time': '2026-01-01T00:00:02', 'route': '/posts/{slug}/'})
+    finally:
+        handler.close()
+    assert sorted(os.listdir(tmp_path)) == sorted([f'slow.{parent}.log', f'slow.{parent + 1}.log'])
+    assert [record['route'] for record in slow_queries.recent()] == ['/posts/{slug}/', '/posts/']
+    assert [record['time'] for record in slow_queries.recent(route='/posts/')] == ['2026-01-01T00:00:01']
+
+
+def test_failed_query_leaves_nothing_on_connection(tmp_path, monkeypatch):
+    records = []
+    monkeypatch.setattr(settings, 'SLOW_QUERY_MS', 0)
+    monkeypatch.setattr(slow_queries.logger, 'warning', lambda message: records.append(json.loads(message)))
+    engine = create_engine(f'sqlite:///{tmp_path}/slow.db')
+    event.listen(engine, 'before_cursor_execute', slow_queries._before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', slow_queries._after_cursor_execute)
+    try:
+        with engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.execute(text('SELECT * FROM missing'))
+            conn.execute(text('SELECT 1'))
+            assert 'slow_query_start_time' not in conn.info
+    finally:
+        engine.dispose()
+    assert [record['statement'] for record in records] == ['SELECT 1']
@@ -0,0 +1,24 @@
+from app.view_counts import view_counter
+
+
+def test_view_flush_keeps_cached_post(client, posts):
+    url = f'/posts/{posts[0].slug}/'
+    first = client.request('GET', url)
+    assert 'views' not in first.json()
+    assert client.request('GET', url).headers['X-Cache'] == 'HIT'
+    assert view_counter.flush() >= 2
+    cached = client.request('GET', url)
+    assert cached.headers['X-Cache'] == 'HIT'
+    assert cached.headers['ETag'] == first.headers['ETag']
+
+
+def test_post_views(client, posts):
+    view_counter.flush()
+    before = client.request('GET', f'/posts/{posts[1].slug}/views/').json()['views']
+    for _ in range(3):
+        client.request('GET', f'/posts/{posts[1].slug}/')
+    view_counter.flush()
+    response, queries = client.counted('GET', f'/posts/{posts[1].slug}/views/')
+    assert response.json() == {'slug': posts[1].slug, 'views': before + 3}
+    assert queries == 1
+    assert client.request('GET', '/posts/missing/views/').status_code == 404